@@ -1,12 +1,23 @@
+import os
 import sys
-import joblib
-import numpy as np
 import matplotlib.pyplot as plt
 from matplotlib import rcParams
 from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg as FigureCanvas
-from PyQt5.QtWidgets import QApplication, QComboBox, QWidget, QLabel, QLineEdit, QPushButton, QGridLayout, QGroupBox, QVBoxLayout, QHBoxLayout
+from PyQt5.QtWidgets import QApplication, QCheckBox, QComboBox, QWidget, QLabel, QLineEdit, QPushButton, QGridLayout, QGroupBox, QVBoxLayout, QHBoxLayout
 from PyQt5.QtCore import pyqtSlot, Qt
 from PyQt5 import QtGui
+# the GUI only wires the widgets to the headless core and to the drawings,
+# both are re-exported here for the scripts written against Predictor.py
+from predictor_core import (input_names, feature_names, section_type_list, section_hot_code, failure_mode_names,
+                            prediction_dtype, section_type_to_hot_code, section_type_to_hot_codes, build_features,
+                            normalize, back_from_normalized, predict_features, predict_batch,
+                            predictor_fm, predictor_strength, predictor_deformation)
+from wall_plot import (plot_rec, plot_rectangular, plot_barbell, plot_wall, read_crack_data, plot_shear_crack,
+                       plot_flexural_crack, plot_flexural_shear_crack, plot_sliding_crack, crack_plots)
+from wall_renderer import WallRenderer
+from live_prediction import LivePrediction
+from dependency_graph import DependencyGraph, PredictionGraph
+from profiling import profiler, format_timings
 
 
 config = {
@@ -16,296 +27,6 @@ config = {
 }
 rcParams.update(config)
 
-def section_type_to_hot_code(section_type):
-    if section_type == 'Rectangular':
-        #               B  F  R
-        section_list = [0, 0, 1]
-    if section_type == 'Barbell':
-        #               B  F  R
-        section_list = [1, 0, 0]
-    if section_type == 'Flange':
-        #               B  F  R
-        section_list = [0, 1, 0]
-    return section_list
-
-def normalize(original_data, mean, var, min_data, max_data):
-    normalized_standard = np.true_divide((original_data-mean), np.sqrt(var))
-    normalized_min_max  = np.true_divide((normalized_standard-min_data), (max_data-min_data))
-    return normalized_min_max
-
-def back_from_normalized(normalized_data, mean, var, min_data, max_data):
-    back_from_min_max = normalized_data*(max_data-min_data)+min_data
-    back_from_standard = back_from_min_max*np.sqrt(var)+mean
-    return back_from_standard
-
-def predictor_fm(capacity_ratio, shear_span, axial_ratio, longi_reinf, hoop_reinf,
-                width_to_thick, web_hor_reinf, web_ver_reinf, Ab_Ag, section_type):
-    
-    features_list = [shear_span, width_to_thick, web_ver_reinf, web_hor_reinf, longi_reinf, hoop_reinf,
-                    axial_ratio, Ab_Ag, capacity_ratio]
-    section_list  = section_type_to_hot_code(section_type)
-    features_list = features_list + section_list
-    features_np   = np.array(features_list)
-
-    with open(sys.path[0]+'/Scaler_fm.txt') as scaler_fm:
-        lines = scaler_fm.readlines()
-        fm_mean = lines[3].split()
-        fm_var  = lines[5].split()
-        fm_min  = lines[8].split()
-        fm_max  = lines[10].split()
-        fm_mean_np = np.array(fm_mean, dtype=float)
-        fm_var_np  = np.array(fm_var, dtype=float)
-        fm_min_np  = np.array(fm_min, dtype=float)
-        fm_max_np  = np.array(fm_max, dtype=float)
-
-    features_normalized = normalize(original_data=features_np, mean=fm_mean_np, var=fm_var_np,
-                                    min_data=fm_min_np, max_data=fm_max_np)
-
-    fm_predictor = joblib.load(sys.path[0]+'/fm_xgboost.pkl')
-    fm_predicted = fm_predictor.predict(features_normalized.reshape(1,-1))
-    if fm_predicted[0] == '1' or fm_predicted[0] == 1:
-        fm_name = 'Flexure'
-    if fm_predicted[0] == '2' or fm_predicted[0] == 2:
-        fm_name = 'Flexure-Shear'
-    if fm_predicted[0] == '3' or fm_predicted[0] == 3:
-        fm_name = 'Shear'
-    if fm_predicted[0] == '4' or fm_predicted[0] == 4:
-        fm_name = 'Sliding'
-    
-    return fm_name
-
-def predictor_strength(shear_span, axial_ratio, longi_reinf, hoop_reinf,
-                width_to_thick, web_hor_reinf, web_ver_reinf, Ab_Ag, section_type):
-    
-    features_list = [shear_span, width_to_thick, web_ver_reinf, web_hor_reinf, longi_reinf, hoop_reinf,
-                    axial_ratio, Ab_Ag]
-    section_list  = section_type_to_hot_code(section_type)
-    features_list = features_list + section_list
-    features_np   = np.array(features_list)
-
-    with open(sys.path[0]+'/Scaler_strength.txt') as scaler_strength:
-        lines = scaler_strength.readlines()
-        strength_mean_x = lines[4].split()
-        strength_var_x  = lines[6].split()
-        strength_mean_y = lines[9].split()
-        strength_var_y  = lines[11].split()
-        strength_min_x  = lines[15].split()
-        strength_max_x  = lines[17].split()
-        strength_min_y  = lines[20].split()
-        strength_max_y  = lines[22].split()
-        strength_mean_x_np = np.array(strength_mean_x, dtype=float)
-        strength_var_x_np  = np.array(strength_var_x, dtype=float)
-        strength_mean_y_np = np.array(strength_mean_y, dtype=float)
-        strength_var_y_np  = np.array(strength_var_y, dtype=float)
-        strength_min_x_np  = np.array(strength_min_x, dtype=float)
-        strength_max_x_np  = np.array(strength_max_x, dtype=float)
-        strength_min_y_np  = np.array(strength_min_y, dtype=float)
-        strength_max_y_np  = np.array(strength_max_y, dtype=float)
-        
-    features_normalized = normalize(original_data=features_np, mean=strength_mean_x_np,
-                                    var=strength_var_x_np, min_data=strength_min_x_np,
-                                    max_data=strength_max_x_np)
-
-    strength_predictor = joblib.load(sys.path[0]+'/strength_gb.pkl')
-    strength_predicted = strength_predictor.predict(features_normalized.reshape(1,-1))
-    
-    strength = back_from_normalized(normalized_data=strength_predicted, mean=strength_mean_y_np,
-                        var=strength_var_y_np, min_data=strength_min_y_np, max_data=strength_max_y_np)
-
-    return strength[0]
-
-def predictor_deformation(shear_span, axial_ratio, longi_reinf, hoop_reinf,
-                width_to_thick, web_hor_reinf, web_ver_reinf, Ab_Ag, section_type):
-    
-    features_list = [shear_span, width_to_thick, web_ver_reinf, web_hor_reinf, longi_reinf, hoop_reinf,
-                    axial_ratio, Ab_Ag]
-    section_list  = section_type_to_hot_code(section_type)
-    features_list = features_list + section_list
-    features_np   = np.array(features_list)
-
-    with open(sys.path[0]+'/Scaler_deformation.txt') as scaler_deformation:
-        lines = scaler_deformation.readlines()
-        deformation_mean_x = lines[4].split()
-        deformation_var_x  = lines[6].split()
-        deformation_mean_y = lines[9].split()
-        deformation_var_y  = lines[11].split()
-        deformation_min_x  = lines[15].split()
-        deformation_max_x  = lines[17].split()
-        deformation_min_y  = lines[20].split()
-        deformation_max_y  = lines[22].split()
-        deformation_mean_x_np = np.array(deformation_mean_x, dtype=float)
-        deformation_var_x_np  = np.array(deformation_var_x, dtype=float)
-        deformation_mean_y_np = np.array(deformation_mean_y, dtype=float)
-        deformation_var_y_np  = np.array(deformation_var_y, dtype=float)
-        deformation_min_x_np  = np.array(deformation_min_x, dtype=float)
-        deformation_max_x_np  = np.array(deformation_max_x, dtype=float)
-        deformation_min_y_np  = np.array(deformation_min_y, dtype=float)
-        deformation_max_y_np  = np.array(deformation_max_y, dtype=float)
-        
-    features_normalized = normalize(original_data=features_np, mean=deformation_mean_x_np,
-                                    var=deformation_var_x_np, min_data=deformation_min_x_np,
-                                    max_data=deformation_max_x_np)
-
-    deformation_predictor = joblib.load(sys.path[0]+'/deformation_rf.pkl')
-    deformation_predicted = deformation_predictor.predict(features_normalized.reshape(1,-1))
-    
-    deformation = back_from_normalized(normalized_data=deformation_predicted, mean=deformation_mean_y_np,
-                        var=deformation_var_y_np, min_data=deformation_min_y_np, max_data=deformation_max_y_np)
-
-    return deformation[0]
-
-def plot_rec(origin, height, width, fig_num):
-    plt.figure(fig_num)
-    # left -> back -> right -> front
-    plt.plot([origin[0], origin[0]], [origin[1], origin[1]+height], '-k')
-    plt.plot([origin[0], origin[0]+width], [origin[1]+height, origin[1]+height], '-k')
-    plt.plot([origin[0]+width, origin[0]+width], [origin[1]+height, origin[1]], '-k')
-    plt.plot([origin[0]+width, origin[0]], [origin[1], origin[1]], '-k')
-    plt.axis('scaled')
-    plt.xlim(-0.2,1.2)
-    return None
-
-def plot_rectangular(origin, height, width, thickness, fig_num=1):
-    plt.figure(fig_num)
-    # elevation
-    plot_rec(origin=origin, width=width, height=height, fig_num=fig_num)
-    # plan (top view)
-    spacing_of_two_view = 0.5*width
-    plot_rec(origin=[origin[0],height+spacing_of_two_view], width=width, height=thickness, fig_num=fig_num)
-    plt.axis('scaled')
-    plt.xlim(-0.2,1.2)
-    return None
-
-def plot_barbell(origin, height, width, thickness, ratio_width=0.2, ratio_thickness=1.5, fig_num=1):
-    '''
-    ratio_width     = 0.2   # ratio of barbell width to wall width
-    ratio_thickness = 1.5   # ratio of barbell thickness to wall thickness
-    '''
-    plt.figure(fig_num)
-    origin_x = origin[0]
-    origin_y = origin[1]
-    # elevation
-    barbell_width   = width*ratio_width
-    # outline -> two vertical lines inside
-    plot_rec(origin=origin, width=width, height=height, fig_num=fig_num)
-    plt.plot([origin_x+ratio_width*width, origin_x+ratio_width*width], [origin_y, origin_y+height], '-k')
-    plt.plot([origin_x+width-barbell_width, origin_x+width-barbell_width], [origin_y, origin_y+height], '-k')
-    # plan (top view)
-    spacing_of_two_view = 0.5*width
-    barbell_thickness   = thickness*ratio_thickness
-    half_thickness_difference = (barbell_thickness-thickness)/2
-    # left -> back -> right -> front
-    origin_plan_y = origin_y+height+spacing_of_two_view
-    plt.plot([origin_x, origin_x], [origin_plan_y, origin_plan_y+barbell_thickness], '-k')
-    plt.plot([origin_x, origin_x+barbell_width], [origin_plan_y+barbell_thickness, origin_plan_y+barbell_thickness], '-k')
-    plt.plot([origin_x+barbell_width, origin_x+barbell_width],
-            [origin_plan_y+barbell_thickness, origin_plan_y+barbell_thickness-(ratio_thickness*thickness-thickness)/2], '-k')
-    plt.plot([origin_x+barbell_width, origin_x+width-barbell_width],
-            [origin_plan_y+barbell_thickness-half_thickness_difference, origin_plan_y+barbell_thickness-half_thickness_difference], '-k')
-    plt.plot([origin_x+width-barbell_width, origin_x+width-barbell_width],
-            [origin_plan_y+barbell_thickness-half_thickness_difference, origin_plan_y+barbell_thickness], '-k')
-    plt.plot([origin_x+width-barbell_width, origin_x+width], [origin_plan_y+barbell_thickness, origin_plan_y+barbell_thickness], '-k')
-    plt.plot([origin_x+width, origin_x+width], [origin_plan_y+barbell_thickness, origin_plan_y], '-k')
-    plt.plot([origin_x+width, origin_x+width-barbell_width], [origin_plan_y, origin_plan_y], '-k')
-    plt.plot([origin_x+width-barbell_width, origin_x+width-barbell_width],
-            [origin_plan_y, origin_plan_y+half_thickness_difference], '-k')
-    plt.plot([origin_x+width-barbell_width, origin_x+barbell_width],
-            [origin_plan_y+half_thickness_difference, origin_plan_y+half_thickness_difference], '-k')
-    plt.plot([origin_x+barbell_width, origin_x+barbell_width], [origin_plan_y+half_thickness_difference, origin_plan_y], '-k')
-    plt.plot([origin_x+barbell_width, origin_x], [origin_plan_y, origin_plan_y], '-k')
-    plt.axis('scaled')
-    plt.xlim(-0.2,1.2)
-    
-    return None
-
-def plot_wall(section_type, height, width, thickness, fig_num=1):
-    plt.figure(fig_num)
-    if section_type == 'Rectangular':
-        plot_rectangular(origin=[0,0], height=height, width=width, thickness=thickness)
-    if section_type == 'Barbell':
-        plot_barbell(origin=[0,0], height=height, width=width, thickness=thickness, ratio_width=0.2, ratio_thickness=3)
-    if section_type == 'Flange':
-        plot_barbell(origin=[0,0], height=height, width=width, thickness=thickness, ratio_width=0.07, ratio_thickness=8)
-    plt.axis('scaled')
-    plt.xlim(-0.2,1.2)
-    # plt.subplots_adjust(top=1,bottom=0,left=0,right=1,hspace=0,wspace=0)
-    plt.xticks([])
-    plt.yticks([])
-    ax = plt.gca()
-    ax.spines['right'].set_color('none')
-    ax.spines['left'].set_color('none')
-    ax.spines['bottom'].set_color('none')
-    ax.spines['top'].set_color('none')
-    # plt.axis('off')
-    return None
-
-def read_crack_data(crack_data, line_num):
-    with open(sys.path[0]+crack_data) as crack:
-        lines = crack.readlines()
-        line_name_list = ['Line #{0}\n'.format(i) for i in range(1, line_num+1)]
-        lines_row_num = []
-        for r, l in enumerate(lines):
-            if l in line_name_list:
-                lines_row_num.append(r)
-        
-        lines_x_list = []
-        lines_y_list = []
-        for num in range(line_num):
-            line_x  = []
-            line_y  = []
-            if num != line_num-1:
-                for i in lines[lines_row_num[num]+1:lines_row_num[num+1]-1]:
-                    line_x.append(i.split()[0])
-                    line_y.append(i.split()[1])
-            if num == line_num-1:
-                for i in lines[lines_row_num[num]+1:len(lines)]:
-                    line_x.append(i.split()[0])
-                    line_y.append(i.split()[1])
-            lines_x_list.append(np.array(line_x, dtype=float))
-            lines_y_list.append(np.array(line_y, dtype=float))
-    return lines_x_list, lines_y_list
-
-def plot_shear_crack(origin, height, width, fig_num=1):
-    x, y = read_crack_data(crack_data='/Crack/DiagonalTensile.txt', line_num=1)
-    plt.figure(fig_num)
-    plt.plot((origin[0]+x[0])*width, (origin[1]+y[0])*height, '-r')
-    plt.plot((origin[0]+x[0])*width, (origin[1]+1-y[0])*height, '-r')
-    plt.title('Shear Failure',fontsize=15,fontweight='bold')
-    plt.xlabel('Note: Pictures shown are for illustration purpose only.')
-    plt.axis('scaled')
-    return None
-
-def plot_flexural_crack(origin, height, width, fig_num=1):
-    x, y = read_crack_data(crack_data='/Crack/Flexure.txt', line_num=4)
-    plt.figure(fig_num)
-    for i in range(4):
-        plt.plot((origin[0]+x[i])*width, (origin[1]+y[i])*height, '-r')
-        plt.plot((origin[0]+1-x[i])*width, (origin[1]+y[i])*height, '-r')
-    plt.title('Flexural Failure',fontsize=15,fontweight='bold')
-    plt.xlabel('Note: Pictures shown are for illustration purpose only.')
-    plt.axis('scaled')
-    return None
-
-def plot_flexural_shear_crack(origin, height, width, fig_num=1):
-    x, y = read_crack_data(crack_data='/Crack/FlexuralShear.txt', line_num=4)
-    plt.figure(fig_num)
-    for i in range(4):
-        plt.plot((origin[0]+x[i])*width, (origin[1]+y[i])*height, '-r')
-        plt.plot((origin[0]+1-x[i])*width, (origin[1]+y[i])*height, '-r')
-    plt.title('Flexure-Shear Failure',fontsize=15,fontweight='bold')
-    plt.xlabel('Note: Pictures shown are for illustration purpose only.')
-    plt.axis('scaled')
-    return None
-
-def plot_sliding_crack(origin, height, width, fig_num=1):
-    x, y = read_crack_data(crack_data='/Crack/Sliding.txt', line_num=1)
-    plt.figure(fig_num)
-    plt.plot((origin[0]+x[0])*width, (origin[1]+y[0])*height, '-r', linewidth=8)
-    plt.title('Sliding Failure',fontsize=15,fontweight='bold')
-    plt.xlabel('Note: Pictures shown are for illustration purpose only.')
-    plt.axis('scaled')
-    return None
-
 class predictor(QWidget):
 
     def __init__(self):
@@ -394,14 +115,35 @@ class predictor(QWidget):
         self.pred_button = QPushButton('Predict', self)
         self.pred_button.clicked.connect(self.on_pred_button_click)
         self.pred_button.setStyleSheet('color:red; background-color:rgb(0,150,195); border-radius:10px; border:2px groove gray; border-style:outset;')
+        # live mode: every edit is predicted on a background thread
+        self.live_checkbox = QCheckBox('Predict while typing', self)
+        self.live_checkbox.setChecked(True)
+        self.live_checkbox.stateChanged.connect(self.on_input_edited)
+        self.live = LivePrediction(debounce_ms=150, parent=self)
+        self.live.ready.connect(self.on_live_prediction)
+        self.live.error.connect(self.on_live_error)
+        for name in input_names:
+            if name != 'section_type':
+                getattr(self, name+'_line').textEdited.connect(self.on_input_edited)
 
         # plot
         self.fig_fm = plt.figure(1, figsize=(5,10))
         self.plt_fm = FigureCanvas(self.fig_fm)
-        plot_wall(section_type='Rectangular', height=2, width=1, thickness=0.1, fig_num=1)
-        self.plt_fm.draw()
+        # wall and crack artists are kept and updated in place
+        self.renderer = WallRenderer(self.fig_fm)
+        self.renderer.update('Rectangular', height=2, thickness=0.1)
+        self.renderer.draw()
+        # models and view are recomputed from what changed since the last prediction,
+        # recomputed lists the graph nodes of the last one (models, then view)
+        self.model_graph = PredictionGraph()
+        self.view_graph  = self.build_view_graph()
+        self.recomputed  = []
 
         # self.note_label = QLabel('Note: Pictures shown are for illustration purpose only.', self)
+        # per-stage timings of the last prediction
+        self.status_label = QLabel('', self)
+        self.status_label.setStyleSheet('color:gray; font-size:10pt')
+        self.status_label.setWordWrap(True)
         
         # layout
         self.grid_layout_intro  = QGridLayout()
@@ -445,6 +187,7 @@ class predictor(QWidget):
         self.grid_layout_plot.addWidget(self.plt_fm, self.row_start+0, 1, 16, 1)
         # self.row_start = -15
         self.grid_layout_pred.addWidget(self.pred_button, self.row_start+15, 0, 1, 2)
+        self.grid_layout_pred.addWidget(self.live_checkbox, self.row_start+16, 0, 1, 2)
         # self.grid_layout.setSpacing(20)
 
         self.groupbox_input  = QGroupBox('Input variables', self)
@@ -463,81 +206,120 @@ class predictor(QWidget):
         self.hbox_layout_var_plot.addLayout(self.grid_layout_plot)
         self.vbox_layout_all.addLayout(self.grid_layout_intro)
         self.vbox_layout_all.addLayout(self.hbox_layout_var_plot)
+        self.vbox_layout_all.addWidget(self.status_label)
 
         self.setLayout(self.vbox_layout_all)
     
+    def build_view_graph(self):
+        '''
+        plot layers and output boxes of the predicted wall, each redrawn only when what it shows changed
+        '''
+        graph = DependencyGraph()
+        for name in ['section_type', 'shear_span', 'width_to_thick', 'failure_mode', 'strength', 'deformation']:
+            graph.add_input(name)
+        graph.add('outline_layer', self.draw_outline, ['section_type', 'shear_span', 'width_to_thick'])
+        graph.add('crack_layer', self.draw_crack, ['failure_mode', 'shear_span'])
+        graph.add('canvas', lambda outline, crack: self.renderer.draw(), ['outline_layer', 'crack_layer'])
+        graph.add('failure_mode_box', self.failure_mode_line.setText, ['failure_mode'])
+        graph.add('strength_box', lambda strength: self.strength_line.setText('{0:4f}'.format(strength)), ['strength'])
+        graph.add('deformation_box', lambda deformation: self.deformation_line.setText('{0:4f}'.format(deformation)),
+                  ['deformation'])
+        return graph
+
+    def draw_outline(self, section_type, shear_span, width_to_thick):
+        width = 1
+        self.renderer.set_outline(section_type, height=shear_span*width, thickness=width/width_to_thick, width=width)
+        return self.renderer.outline_state
+
+    def draw_crack(self, failure_mode, shear_span):
+        width = 1
+        self.renderer.set_crack(failure_mode, height=shear_span*width, width=width)
+        return self.renderer.crack_state
+
+    def read_inputs(self):
+        '''
+        predict_batch columns of the wall in the input boxes, raises ValueError on an incomplete number
+        '''
+        walls = {}
+        for name in input_names:
+            if name == 'section_type':
+                walls[name] = [self.section_type_combox.currentText()]
+            else:
+                walls[name] = [float(getattr(self, name+'_line').text())]
+        return walls
+
+    def set_inputs(self, walls):
+        for name in input_names:
+            setattr(self, name+'_val', walls[name][0])
+
     @pyqtSlot()
     def on_section_type_change(self):
-        self.capacity_ratio_val = float(self.capacity_ratio_line.text())
-        self.shear_span_val     = float(self.shear_span_line.text())
-        self.axial_ratio_val    = float(self.axial_ratio_line.text())
-        self.longi_reinf_val    = float(self.longi_reinf_line.text())
-        self.hoop_reinf_val     = float(self.hoop_reinf_line.text())
-        self.width_to_thick_val = float(self.width_to_thick_line.text())
-        self.web_hor_reinf_val  = float(self.web_hor_reinf_line.text())
-        self.web_ver_reinf_val  = float(self.web_ver_reinf_line.text())
-        self.Ab_Ag_val          = float(self.Ab_Ag_line.text())
-        self.section_type_val   = self.section_type_combox.currentText()
+        self.set_inputs(self.read_inputs())
 
-        self.fig_fm.clf()
-        width     = 1
-        height    = self.shear_span_val*width
-        thickness = width/self.width_to_thick_val
-        plot_wall(section_type=self.section_type_val, height=height, width=1, thickness=thickness, fig_num=1)
-        self.plt_fm.draw()
+        # the wall of the new section type, without the crack pattern of the old prediction
+        self.view_graph.set_inputs({'section_type': self.section_type_val, 'shear_span': self.shear_span_val,
+                                    'width_to_thick': self.width_to_thick_val, 'failure_mode': None})
+        self.view_graph.evaluate(['canvas'])
+        self.on_input_edited()
+
+    @pyqtSlot()
+    def on_input_edited(self):
+        if not self.live_checkbox.isChecked():
+            return
+        try:
+            walls = self.read_inputs()
+        except ValueError:
+            # still typing: the shown prediction is not the one of the inputs anymore
+            self.live.cancel()
+            self.status_label.setText('incomplete input')
+            return
+        if walls['shear_span'][0] <= 0 or walls['width_to_thick'][0] <= 0:
+            self.live.cancel()
+            self.status_label.setText('M / (Vlw) and lw / tw must be positive')
+            return
+        self.live.request(walls)
+
+    @pyqtSlot(object, object, object, object)
+    def on_live_prediction(self, walls, predicted, timings, recomputed):
+        self.set_inputs(walls)
+        self.show_prediction(predicted, timings, recomputed)
+
+    @pyqtSlot(str)
+    def on_live_error(self, message):
+        self.status_label.setText(message)
 
     @pyqtSlot()
     def on_pred_button_click(self):
-        self.capacity_ratio_val = float(self.capacity_ratio_line.text())
-        self.shear_span_val     = float(self.shear_span_line.text())
-        self.axial_ratio_val    = float(self.axial_ratio_line.text())
-        self.longi_reinf_val    = float(self.longi_reinf_line.text())
-        self.hoop_reinf_val     = float(self.hoop_reinf_line.text())
-        self.width_to_thick_val = float(self.width_to_thick_line.text())
-        self.web_hor_reinf_val  = float(self.web_hor_reinf_line.text())
-        self.web_ver_reinf_val  = float(self.web_ver_reinf_line.text())
-        self.Ab_Ag_val          = float(self.Ab_Ag_line.text())
-        self.section_type_val   = self.section_type_combox.currentText()
-        # predict failure mode
-        failure_mode_display = predictor_fm(capacity_ratio=self.capacity_ratio_val, shear_span=self.shear_span_val,
-                    axial_ratio=self.axial_ratio_val, longi_reinf=self.longi_reinf_val,
-                    hoop_reinf=self.hoop_reinf_val, width_to_thick=self.width_to_thick_val,
-                    web_hor_reinf=self.web_hor_reinf_val, web_ver_reinf=self.web_ver_reinf_val,
-                    Ab_Ag=self.Ab_Ag_val, section_type=self.section_type_val)
-        self.failure_mode_line.setText(failure_mode_display)
-        # predict strength capacity
-        strength_dispaly = predictor_strength(shear_span=self.shear_span_val, axial_ratio=self.axial_ratio_val,
-                    longi_reinf=self.longi_reinf_val, hoop_reinf=self.hoop_reinf_val,
-                    width_to_thick=self.width_to_thick_val, web_hor_reinf=self.web_hor_reinf_val,
-                    web_ver_reinf=self.web_ver_reinf_val, Ab_Ag=self.Ab_Ag_val,
-                    section_type=self.section_type_val)
-        self.strength_line.setText('{0:4f}'.format(strength_dispaly))
-        # predict deformation capacity
-        deformation_dispaly = predictor_deformation(shear_span=self.shear_span_val, axial_ratio=self.axial_ratio_val,
-                    longi_reinf=self.longi_reinf_val, hoop_reinf=self.hoop_reinf_val,
-                    width_to_thick=self.width_to_thick_val, web_hor_reinf=self.web_hor_reinf_val,
-                    web_ver_reinf=self.web_ver_reinf_val, Ab_Ag=self.Ab_Ag_val,
-                    section_type=self.section_type_val)
-        self.deformation_line.setText('{0:4f}'.format(deformation_dispaly))
-        # plot crack
-        self.fig_fm.clf()
-        plt.cla()
-        width     = 1
-        height    = self.shear_span_val*width
-        thickness = width/self.width_to_thick_val
-        plot_wall(section_type=self.section_type_val, height=height, width=1, thickness=thickness, fig_num=1)
-        if failure_mode_display == 'Shear':
-            plot_shear_crack(origin=[0,0], height=height, width=width)
-            self.plt_fm.draw()
-        if failure_mode_display == 'Flexure':
-            plot_flexural_crack(origin=[0,0], height=height, width=width)
-            self.plt_fm.draw()
-        if failure_mode_display == 'Flexure-Shear':
-            plot_flexural_shear_crack(origin=[0,0], height=height, width=width)
-            self.plt_fm.draw()
-        if failure_mode_display == 'Sliding':
-            plot_sliding_crack(origin=[0,0], height=height, width=width)
-            self.plt_fm.draw()
+        # the prediction of the button replaces any live one still computing
+        self.live.cancel()
+        walls = self.read_inputs()
+        self.set_inputs(walls)
+        with profiler.record() as timings:
+            # predict failure mode, strength and deformation capacity (a wall predicted before comes from
+            # result_cache, otherwise only the models whose inputs changed are rerun)
+            with profiler.span('predict'):
+                predicted = self.model_graph.predict(walls)
+        self.show_prediction(predicted, timings, self.model_graph.recomputed)
+
+    def show_prediction(self, predicted, timings, recomputed=()):
+        '''
+        shows the prediction (failure_mode, strength, deformation) of the current *_val inputs
+        timings: spans of the prediction, recomputed: model graph nodes it recomputed
+        '''
+        with profiler.record() as draw_timings:
+            self.view_graph.set_inputs({'section_type': self.section_type_val, 'shear_span': self.shear_span_val,
+                                        'width_to_thick': self.width_to_thick_val,
+                                        'failure_mode': str(predicted['failure_mode']),
+                                        'strength': float(predicted['strength']),
+                                        'deformation': float(predicted['deformation'])})
+            self.view_graph.evaluate()
+        self.recomputed = list(recomputed)+self.view_graph.recomputed
+        if profiler.enabled:
+            self.status_label.setText(format_timings(list(timings)+draw_timings))
+
+    def closeEvent(self, event):
+        self.live.stop()
+        super(predictor, self).closeEvent(event)
 
 
 if __name__ == '__main__':
@@ -549,4 +331,8 @@ if __name__ == '__main__':
     app.setFont(font)
     demo = predictor()
     demo.show()
-    sys.exit(app.exec_())
\ No newline at end of file
+    status = app.exec_()
+    # WALL_TRACE=trace.json: profile of the session, opens in chrome://tracing or Perfetto
+    if os.environ.get('WALL_TRACE'):
+        profiler.dump_trace(os.environ['WALL_TRACE'])
+    sys.exit(status)
\ No newline at end of file
@@ -0,0 +1,305 @@
+'''
+Headless predictions for wall inventories stored as CSV or Parquet.
+
+The input is read in chunks (shards) that are predicted in a pool of worker processes, each of which
+loads the models and scalers once. Results are written in input order, one output row per input row:
+
+    row, <--keep columns>, failure_mode, strength, deformation, error
+
+A row that cannot be predicted (missing or non-numeric value, non-positive shear_span or
+width_to_thick, unknown section_type) gets an error message and empty predictions instead of
+stopping the run, and a shard that fails as a whole is reported the same way.
+
+    python batch_runner.py walls.csv predictions.parquet --workers 8 --chunk-size 20000 --keep wall_id
+
+CSV shards are split on lines, so quoted fields must not contain line breaks. Parquet needs pyarrow.
+'''
+import os
+import io
+import sys
+import csv
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import numpy as np
+from predictor_core import input_names, section_type_list, predict_batch, result_cache, set_inference_precision
+from model_registry import registry
+from sweep import csv_lines
+
+
+prediction_names = ['failure_mode', 'strength', 'deformation', 'error']
+# inputs that divide the wall geometry and must be strictly positive
+positive_inputs  = ['shear_span', 'width_to_thick']
+
+def read_csv_shards(path, chunk_size):
+    '''
+    yields (first row, header, text of up to chunk_size data lines)
+    '''
+    with open(path, newline='') as walls:
+        header = next(csv.reader([walls.readline()]))
+        first_row = 0
+        while True:
+            lines = [line for _, line in zip(range(chunk_size), walls)]
+            if not lines:
+                return
+            yield first_row, header, ''.join(lines)
+            first_row += len(lines)
+
+def read_parquet_shards(path, chunk_size, columns):
+    '''
+    yields (first row, None, dict of column arrays)
+    '''
+    import pyarrow.parquet as pq
+    first_row = 0
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=columns):
+        shard = {name: batch.column(name).to_numpy(zero_copy_only=False) for name in batch.schema.names}
+        yield first_row, None, shard
+        first_row += batch.num_rows
+
+def parse_shard(header, shard):
+    if header is None:
+        return shard
+    rows = list(csv.reader(io.StringIO(shard)))
+    return {name: [row[i] if i < len(row) else '' for row in rows] for i, name in enumerate(header)}
+
+def parse_column(values, name, errors):
+    try:
+        return np.asarray(values, dtype=float)
+    except (TypeError, ValueError):
+        pass
+    column = np.full(len(values), np.nan)
+    for i, value in enumerate(values):
+        try:
+            column[i] = float(value)
+        except (TypeError, ValueError):
+            errors[i] = errors[i] or '{0} is not a number: {1!r}'.format(name, value)
+    return column
+
+def validate(columns):
+    '''
+    returns the parsed wall inputs and one error message per row ('' for valid rows)
+    '''
+    n_rows = len(columns[input_names[0]])
+    errors = np.full(n_rows, '', dtype=object)
+    walls  = {}
+    for name in input_names[:-1]:
+        walls[name] = parse_column(columns[name], name, errors)
+        if name in positive_inputs:
+            invalid = ~(walls[name] > 0)
+        else:
+            invalid = ~np.isfinite(walls[name])
+        for i in np.nonzero(invalid & (errors == ''))[0]:
+            errors[i] = '{0} = {1}'.format(name, columns[name][i])
+    walls['section_type'] = np.asarray(columns['section_type']).astype(str)
+    for i in np.nonzero(~np.isin(walls['section_type'], section_type_list) & (errors == ''))[0]:
+        errors[i] = 'unknown section_type {0!r}'.format(walls['section_type'][i])
+    return walls, errors
+
+def predict_rows(walls, errors):
+    valid  = np.nonzero(errors == '')[0]
+    result = {'failure_mode': np.full(len(errors), '', dtype=object),
+              'strength':     np.full(len(errors), np.nan),
+              'deformation':  np.full(len(errors), np.nan)}
+    try:
+        predicted = predict_batch({name: walls[name][valid] for name in input_names})
+        rows = [(valid, predicted)]
+    except Exception:
+        # isolate the rows the models reject
+        rows = []
+        for i in valid:
+            try:
+                rows.append(([i], predict_batch({name: walls[name][[i]] for name in input_names})))
+            except Exception as e:
+                errors[i] = '{0}: {1}'.format(type(e).__name__, e)
+    for index, predicted in rows:
+        for name in predicted.dtype.names:
+            result[name][index] = predicted[name]
+    result['error'] = errors
+    return result
+
+def shard_output(output, output_format):
+    '''
+    (number of rows, number of rows with an error, CSV text or column dict)
+    '''
+    n_errors = int(np.sum(output['error'] != ''))
+    if output_format == 'csv':
+        return len(output['row']), n_errors, csv_lines(output, list(output))
+    return len(output['row']), n_errors, output
+
+def predict_shard(first_row, header, shard, keep, output_format):
+    columns = parse_shard(header, shard)
+    missing = [name for name in input_names+keep if name not in columns]
+    if missing:
+        raise KeyError('missing input columns: {0}'.format(', '.join(missing)))
+    walls, errors = validate(columns)
+    output = {'row': np.arange(first_row, first_row+len(errors))}
+    for name in keep:
+        output[name] = np.asarray(columns[name])
+    output.update(predict_rows(walls, errors))
+    return shard_output(output, output_format)
+
+def failed_shard(first_row, n_rows, keep, message, output_format):
+    output = {'row': np.arange(first_row, first_row+n_rows)}
+    for name in keep:
+        output[name] = np.full(n_rows, '', dtype=object)
+    output['failure_mode'] = np.full(n_rows, '', dtype=object)
+    output['strength']     = np.full(n_rows, np.nan)
+    output['deformation']  = np.full(n_rows, np.nan)
+    output['error']        = np.full(n_rows, message, dtype=object)
+    return shard_output(output, output_format)
+
+def shard_rows(header, shard):
+    if header is None:
+        return len(next(iter(shard.values())))
+    return shard.count('\n')+(not shard.endswith('\n'))
+
+def init_worker(cache_path=None, precision='float64'):
+    if cache_path:
+        result_cache.set_sqlite_path(cache_path)
+    # verified by run() before the pool starts
+    set_inference_precision(precision, verify=False)
+    registry.warm_up()
+
+# precisions that passed check_precision in this process
+_checked_precisions = {'float64'}
+
+def check_precision(precision):
+    '''
+    set_inference_precision(precision) in a fresh process, ValueError when it is refused: the check
+    loads the library models, whose OpenMP runtime is kept out of the parent of the workers
+    '''
+    if precision in _checked_precisions:
+        return
+    with ProcessPoolExecutor(1, mp_context=multiprocessing.get_context('spawn')) as executor:
+        executor.submit(set_inference_precision, precision).result()
+    _checked_precisions.add(precision)
+
+class OutputWriter(object):
+
+    def __init__(self, path, keep, output_format):
+        self.path   = path
+        self.format = output_format
+        self.names  = ['row']+keep+prediction_names
+        self.parquet_writer = None
+        if self.format == 'csv':
+            self.output = open(path, 'w', newline='')
+            self.output.write(','.join(self.names)+'\n')
+
+    def write(self, result):
+        if self.format == 'csv':
+            self.output.write(result)
+            return
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.table({name: result[name] for name in self.names})
+        if self.parquet_writer is None:
+            self.parquet_writer = pq.ParquetWriter(self.path, table.schema)
+        self.parquet_writer.write_table(table)
+
+    def close(self):
+        if self.format == 'csv':
+            self.output.close()
+        elif self.parquet_writer is not None:
+            self.parquet_writer.close()
+
+def file_format(path):
+    return 'parquet' if os.path.splitext(path)[1].lower() in ('.parquet', '.pq') else 'csv'
+
+def run(input_path, output_path, workers=None, chunk_size=20000, keep=(), progress=True, cache_path=None,
+        precision='float64'):
+    '''
+    predicts every wall of input_path into output_path, returns the number of rows and of rows with an error
+    cache_path: SQLite file of result_cache shared by the workers (and by later runs)
+    precision:  'float32' predicts in single precision, once it passed check_precision
+    '''
+    check_precision(precision)
+    keep    = list(keep)
+    workers = workers or os.cpu_count()
+    output_format = file_format(output_path)
+    if file_format(input_path) == 'parquet':
+        shards = read_parquet_shards(input_path, chunk_size, input_names+keep)
+    else:
+        shards = read_csv_shards(input_path, chunk_size)
+    writer   = OutputWriter(output_path, keep, output_format)
+
+    def new_pool():
+        # spawned workers: a forked child of a process that already ran the library models (OpenMP) can hang
+        return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=init_worker, initargs=(cache_path, precision))
+
+    executor = [new_pool()]
+    # shards in flight, oldest first, so that results are written in input order
+    pending  = deque()
+    counts   = [0, 0]
+    start_time = time.time()
+
+    def submit(first_row, header, shard, attempt=0):
+        future = executor[0].submit(predict_shard, first_row, header, shard, keep, output_format)
+        pending.append((future, first_row, header, shard, attempt))
+
+    def collect():
+        future, first_row, header, shard, attempt = pending[0]
+        try:
+            n_rows, n_errors, result = future.result()
+        except BrokenProcessPool:
+            if attempt == 0:
+                # a worker died (e.g. killed for memory): give every shard in flight one more try in a new pool
+                executor[0].shutdown(wait=False)
+                executor[0] = new_pool()
+                retry = list(pending)
+                pending.clear()
+                for future, first_row, header, shard, attempt in retry:
+                    submit(first_row, header, shard, attempt+1)
+                return
+            n_rows, n_errors, result = failed_shard(first_row, shard_rows(header, shard), keep,
+                                                    'worker process died', output_format)
+        except Exception as e:
+            n_rows, n_errors, result = failed_shard(first_row, shard_rows(header, shard), keep,
+                                                    '{0}: {1}'.format(type(e).__name__, e), output_format)
+        pending.popleft()
+        writer.write(result)
+        counts[0] += n_rows
+        counts[1] += n_errors
+        if progress:
+            _report(counts[0], counts[1], start_time)
+
+    try:
+        for first_row, header, shard in shards:
+            submit(first_row, header, shard)
+            while len(pending) >= 2*workers or (pending and pending[0][0].done()):
+                collect()
+        while pending:
+            collect()
+    finally:
+        executor[0].shutdown()
+        writer.close()
+    if progress:
+        sys.stderr.write('\n')
+    return counts[0], counts[1]
+
+def _report(n_rows, n_errors, start_time):
+    elapsed = time.time()-start_time
+    sys.stderr.write('\r{0} walls, {1} errors, {2:.0f} walls/s'.format(n_rows, n_errors, n_rows/max(elapsed, 1e-9)))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='predict failure mode, strength and drift of every wall of a CSV/Parquet inventory')
+    parser.add_argument('input')
+    parser.add_argument('output', help='.csv or .parquet')
+    parser.add_argument('--workers', type=int, default=None, help='worker processes (default: number of cores)')
+    parser.add_argument('--chunk-size', type=int, default=20000, help='walls per shard')
+    parser.add_argument('--keep', action='append', default=[], help='input column copied to the output (e.g. a wall id)')
+    parser.add_argument('--cache', default=None, help='SQLite file caching the predictions of repeated designs across runs')
+    parser.add_argument('--precision', default='float64', choices=['float64', 'float32'],
+                        help='float32 is refused when precision_check finds deviations beyond its tolerances')
+    parser.add_argument('--quiet', action='store_true')
+    args = parser.parse_args()
+    try:
+        check_precision(args.precision)
+    except ValueError as e:
+        sys.exit(str(e))
+    run(args.input, args.output, workers=args.workers, chunk_size=args.chunk_size, keep=args.keep,
+        progress=not args.quiet, cache_path=args.cache, precision=args.precision)
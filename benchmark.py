@@ -0,0 +1,247 @@
+'''
+Benchmarks of every stage of the prediction pipeline and of the batch throughput.
+
+    python benchmark.py --save benchmark_baseline.json          # record a baseline
+    python benchmark.py --compare benchmark_baseline.json       # exit 1 on a regression beyond --threshold
+    python benchmark.py --quick --stages predict                # batch sizes up to 1e4, matching stages only
+                                                                # (batch timings are named batch/<size>/<stage>)
+
+Every stage is timed in the same process after a warm-up call, except the cold loads (scaler text
+parsing, joblib.load, tree array loading) which are the stage themselves. Timings are the median of
+--repeat runs, each run looping the stage until it takes at least --min-time seconds. Plots are
+rendered with the Agg backend, so no display is needed.
+'''
+import os
+import sys
+import json
+import time
+import platform
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+import matplotlib.pyplot as plt
+import predictor_core as core
+from predictor_core import (input_names, section_type_list, registry, build_features, normalize,
+                            back_from_normalized, predict_features, predict_batch, load_pickle)
+from scaler_compiler import read_scaler_fm, read_scaler_xy, load_scaler
+from tree_engine import load_tree_ensemble, artifact_path
+import model_bundle
+import wall_plot
+from wall_renderer import WallRenderer
+
+
+model_names = ['fm', 'strength', 'deformation']
+batch_sizes = [1, 10, 100, 1000, 10000, 100000, 1000000]
+
+def random_walls(n, seed=0):
+    '''
+    n walls drawn uniformly inside the ranges of the GUI examples
+    '''
+    rng = np.random.RandomState(seed)
+    walls = dict(capacity_ratio=rng.uniform(0.5, 3, n), shear_span=rng.uniform(0.3, 3, n),
+                 axial_ratio=rng.uniform(0, 0.4, n), longi_reinf=rng.uniform(0.1, 1, n),
+                 hoop_reinf=rng.uniform(0.01, 0.3, n), width_to_thick=rng.uniform(5, 25, n),
+                 web_hor_reinf=rng.uniform(0.01, 0.3, n), web_ver_reinf=rng.uniform(0.01, 0.3, n),
+                 Ab_Ag=rng.uniform(0, 0.3, n))
+    walls['section_type'] = np.array(section_type_list)[rng.randint(0, len(section_type_list), n)]
+    return walls
+
+def time_stage(function, repeat=5, min_time=0.05):
+    '''
+    seconds per call: median, min and max over repeat runs, and the number of calls per run
+    '''
+    function()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        elapsed = time.perf_counter()-start
+        if elapsed >= min_time or number >= 1<<20:
+            break
+        number *= max(2, min(10, int(min_time/max(elapsed, 1e-9))+1))
+    runs = [elapsed/number]
+    for _ in range(repeat-1):
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        runs.append((time.perf_counter()-start)/number)
+    return dict(median=float(np.median(runs)), min=float(np.min(runs)), max=float(np.max(runs)), number=number)
+
+def stage_functions():
+    '''
+    name -> function of every pipeline stage, in pipeline order
+    '''
+    stages = {}
+    # the cold loads read the source files, the registry may map the trees and scalers from the bundle
+    def source_path(artifact):
+        return os.path.join(core.model_dir, model_bundle.bundle_groups[artifact])
+    for name in model_names:
+        scaler_path = source_path(name+'_scaler')
+        read = read_scaler_fm if name == 'fm' else read_scaler_xy
+        stages['scaler_parse/'+name] = lambda read=read, path=scaler_path: read(path)
+        stages['scaler_load/'+name]  = lambda path=scaler_path: load_scaler(path)
+        if os.path.exists(registry.path(name+'_model')):
+            stages['joblib_load/'+name] = lambda path=registry.path(name+'_model'): load_pickle(path)
+        trees_path = artifact_path(core.model_dir, model_bundle.bundle_groups[name+'_trees'])
+        stages['trees_load/'+name] = lambda path=trees_path: load_tree_ensemble(path)
+    if os.path.exists(core.bundle_path):
+        stages['bundle_open'] = lambda: model_bundle.ModelBundle(core.bundle_path)
+    walls_1, walls_1000 = random_walls(1), random_walls(1000)
+    features_1, features_1000 = build_features(walls_1), build_features(walls_1000)
+    stages['build_features/1']    = lambda: build_features(walls_1)
+    stages['build_features/1000'] = lambda: build_features(walls_1000)
+    scaler_x, scaler_y = read_scaler_xy(source_path('strength_scaler'))
+    numeric_1000 = features_1000[:, core.xy_columns]
+    stages['normalize/1000'] = lambda: normalize(numeric_1000, **scaler_x)
+    normalized_1000 = normalize(numeric_1000, **scaler_x)[:, :1]
+    stages['back_from_normalized/1000'] = lambda: back_from_normalized(normalized_1000, **scaler_y)
+    for name in model_names:
+        scaler = registry.get(name+'_scaler')
+        columns = slice(None) if name == 'fm' else core.xy_columns
+        x_1 = features_1[:, columns]*scaler['x_scale']+scaler['x_offset']
+        x_1000 = features_1000[:, columns]*scaler['x_scale']+scaler['x_offset']
+        trees = registry.get(name+'_trees')
+        stages['predict_trees/{0}/1'.format(name)]    = lambda trees=trees, x=x_1: trees.predict(x)
+        stages['predict_trees/{0}/1000'.format(name)] = lambda trees=trees, x=x_1000: trees.predict(x)
+        try:
+            model = registry.get(name+'_model')
+        except (ImportError, OSError):
+            continue
+        stages['predict_model/{0}/1'.format(name)]    = lambda model=model, x=x_1: model.predict(x)
+        stages['predict_model/{0}/1000'.format(name)] = lambda model=model, x=x_1000: model.predict(x)
+    stages['predict_batch/1']        = lambda: predict_batch(walls_1, use_cache=False)
+    stages['predict_batch_cached/1'] = lambda: predict_batch(walls_1)
+    stages['predict_batch_uncertainty/1']    = lambda: core.predict_batch_uncertainty(walls_1)
+    stages['predict_batch_uncertainty/1000'] = lambda: core.predict_batch_uncertainty(walls_1000)
+    stages['read_crack_data'] = lambda: wall_plot.read_crack_data(crack_data='/Crack/Flexure.txt', line_num=4)
+    figure = plt.figure(1)
+    for failure_mode, plot_crack in wall_plot.crack_plots.items():
+        stages['render/'+failure_mode] = lambda plot_crack=plot_crack: render_prediction(figure, plot_crack)
+    renderer = WallRenderer(plt.figure(2))
+    modes = list(wall_plot.crack_plots)
+    # alternating failure modes so that every call repaints
+    stages['render_retained'] = lambda: [(renderer.update('Barbell', 2.0, 0.1, failure_mode), renderer.draw())
+                                         for failure_mode in modes]
+    return stages
+
+def render_prediction(figure, plot_crack, shear_span=2.0, width_to_thick=10.0, section_type='Barbell'):
+    '''
+    the drawing part of on_pred_button_click, including the canvas draw
+    '''
+    figure.clf()
+    plt.cla()
+    height = shear_span
+    wall_plot.plot_wall(section_type=section_type, height=height, width=1, thickness=1/width_to_thick, fig_num=1)
+    plot_crack(origin=[0,0], height=height, width=1)
+    figure.canvas.draw()
+
+def run_stages(pattern=None, repeat=5, min_time=0.05, progress=True):
+    results = {}
+    for name, function in stage_functions().items():
+        if pattern and pattern not in name:
+            continue
+        results[name] = time_stage(function, repeat=repeat, min_time=min_time)
+        if progress:
+            sys.stderr.write('{0:32s} {1}\n'.format(name, format_seconds(results[name]['median'])))
+    return results
+
+def run_batches(sizes, repeat=3, progress=True, pattern=None):
+    '''
+    throughput of predict_batch (cache off) and of each model stage for every batch size
+    pattern: only time those whose name batch/<size>/<stage> contains it
+    '''
+    results = {}
+    walls = random_walls(max(sizes), seed=1)
+    for size in sizes:
+        subset = {name: values[:size] for name, values in walls.items()}
+        features = build_features(subset)
+        timings = {'build_features': lambda: build_features(subset),
+                   'fm': lambda: core.predict_fm_features(features),
+                   'strength': lambda: core.predict_strength_features(features),
+                   'deformation': lambda: core.predict_deformation_features(features),
+                   'predict_batch': lambda: predict_batch(subset, use_cache=False)}
+        timings = {name: function for name, function in timings.items()
+                   if not pattern or pattern in 'batch/{0}/{1}'.format(size, name)}
+        if not timings:
+            continue
+        results[str(size)] = {}
+        for name, function in timings.items():
+            # one call of a large batch is long enough on its own
+            timing = time_stage(function, repeat=repeat if size < 100000 else 1, min_time=0.05)
+            timing['rows_per_second'] = size/timing['median']
+            results[str(size)][name] = timing
+        if progress:
+            # predict_batch, or the first stage timed when the pattern left it out
+            shown = 'predict_batch' if 'predict_batch' in timings else next(iter(timings))
+            sys.stderr.write('batch {0:>8d}: {1:12.0f} walls/s{2}\n'.format(size, results[str(size)][shown]['rows_per_second'],
+                                                                          '' if shown == 'predict_batch' else ' ('+shown+')'))
+    return results
+
+def environment():
+    versions = {'python': platform.python_version(), 'numpy': np.__version__, 'matplotlib': matplotlib.__version__}
+    for module in ('sklearn', 'xgboost', 'joblib'):
+        try:
+            versions[module] = __import__(module).__version__
+        except ImportError:
+            versions[module] = None
+    return dict(versions=versions, platform=platform.platform(), processor=platform.processor(),
+                cpu_count=os.cpu_count(), time=time.strftime('%Y-%m-%d %H:%M:%S'))
+
+def compare(current, baseline, threshold=0.1):
+    '''
+    returns the (name, baseline seconds, current seconds, ratio) of every timing slower than
+    baseline*(1+threshold), stages and batch timings that only exist on one side are skipped
+    '''
+    regressions = []
+    pairs = [(name, current['stages'][name], baseline['stages'][name])
+             for name in current.get('stages', {}) if name in baseline.get('stages', {})]
+    for size, timings in current.get('batch', {}).items():
+        for name, timing in timings.items():
+            if name in baseline.get('batch', {}).get(size, {}):
+                pairs.append(('batch/{0}/{1}'.format(size, name), timing, baseline['batch'][size][name]))
+    for name, timing, base in pairs:
+        ratio = timing['median']/base['median']
+        if ratio > 1+threshold:
+            regressions.append((name, base['median'], timing['median'], ratio))
+    return regressions
+
+def format_seconds(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return '{0:8.3f} {1}'.format(seconds/scale, unit)
+    return '{0:8.3f} ns'.format(seconds/1e-9)
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='time every stage of the prediction pipeline')
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='JSON baseline to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative slowdown reported as a regression')
+    parser.add_argument('--stages', default=None,
+                        help='only run stages (and batch timings, named batch/<size>/<stage>) whose name contains this text')
+    parser.add_argument('--max-batch', type=int, default=batch_sizes[-1])
+    parser.add_argument('--quick', action='store_true', help='batch sizes up to 1e4 and fewer repeats')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.05, help='seconds per timed run')
+    args = parser.parse_args()
+    max_batch = min(args.max_batch, 10000) if args.quick else args.max_batch
+    repeat = 3 if args.quick else args.repeat
+    registry.warm_up()
+    results = dict(environment=environment(),
+                   stages=run_stages(args.stages, repeat=repeat, min_time=args.min_time),
+                   batch=run_batches([size for size in batch_sizes if size <= max_batch], repeat=repeat,
+                                     pattern=args.stages))
+    if args.save:
+        with open(args.save, 'w') as output:
+            json.dump(results, output, indent=1)
+    if args.compare:
+        with open(args.compare) as baseline:
+            regressions = compare(results, json.load(baseline), args.threshold)
+        for name, base, current, ratio in regressions:
+            print('REGRESSION {0}: {1} -> {2} ({3:+.0f}%)'.format(name, format_seconds(base).strip(),
+                                                                 format_seconds(current).strip(), (ratio-1)*100))
+        if regressions:
+            sys.exit(1)
+        print('no regression beyond {0:.0f}%'.format(args.threshold*100))
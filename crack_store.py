@@ -0,0 +1,180 @@
+'''
+Crack patterns drawn over the wall for each failure mode, loaded once per process.
+
+Crack/patterns.json lists the patterns (a GetData Graph Digitizer export with "Line #i" blocks of
+"x y" points in wall units, the mirrored copies to draw and the line style) and the pattern and
+title of every failure mode. Any other Crack/*.txt digitizer export is registered under its file
+name, so a new pattern only needs its file (and a patterns.json entry for mirroring or styling).
+
+All points of a pattern are kept in one contiguous (n, 2) array with the start offset of each
+polyline, and are scaled to the wall in one vectorized operation. "python crack_store.py" compiles
+the text files into Crack/crack_patterns.npz, which is used while the text files are unchanged. The
+registry watches the text files and the Crack directory, so an edited or new pattern file is picked
+up while the process runs.
+'''
+import os
+import sys
+import json
+import numpy as np
+from model_registry import file_sha1
+from predictor_core import model_dir, registry
+
+
+class CrackPattern(object):
+
+    def __init__(self, name, points, offsets, mirror=(), color='r', linewidth=None, source_sha1=''):
+        self.name        = name
+        self.points      = np.ascontiguousarray(points, dtype=float)   # (n, 2) x, y of every polyline
+        self.offsets     = np.asarray(offsets, dtype=np.int64)        # start of each polyline, then n
+        self.mirror      = tuple(mirror)    # 'x': also drawn at 1-x, 'y': also drawn at 1-y
+        self.color       = color
+        self.linewidth   = linewidth
+        self.source_sha1 = source_sha1
+
+    @property
+    def n_lines(self):
+        return len(self.offsets)-1
+
+    def transformed(self, origin=(0, 0), width=1, height=1):
+        '''
+        (n_copies*n, 2) points of the pattern and of its mirrored copies: (origin+point)*(width, height)
+        '''
+        copies = [self.points]
+        for axis in self.mirror:
+            mirrored = self.points.copy()
+            column = 0 if axis == 'x' else 1
+            mirrored[:, column] = 1-mirrored[:, column]
+            copies.append(mirrored)
+        points = np.concatenate(copies) if len(copies) > 1 else self.points
+        return (points+np.asarray(origin, dtype=float))*np.array([width, height], dtype=float)
+
+    def polylines(self, origin=(0, 0), width=1, height=1):
+        '''
+        list of (k, 2) arrays (views of one transformed array), the original lines then each mirrored copy
+        '''
+        points = self.transformed(origin, width, height)
+        lines  = []
+        for copy in range(1+len(self.mirror)):
+            base = copy*len(self.points)
+            lines.extend(points[base+start:base+stop] for start, stop in zip(self.offsets[:-1], self.offsets[1:]))
+        return lines
+
+def parse_digitizer(path):
+    '''
+    (points, offsets) of the "Line #i" blocks of a GetData Graph Digitizer text export
+    '''
+    with open(path) as data:
+        text = data.read()
+    blocks  = []
+    current = None
+    for line in text.splitlines():
+        if line.startswith('Line #'):
+            current = []
+            blocks.append(current)
+        elif current is not None and line.strip():
+            current.append(line)
+    if not blocks:
+        raise ValueError('{0}: no "Line #" block'.format(path))
+    arrays  = [np.array(' '.join(block).split(), dtype=float).reshape(-1, 2) for block in blocks]
+    offsets = np.cumsum([0]+[len(array) for array in arrays])
+    return np.concatenate(arrays), offsets
+
+class CrackStore(object):
+    '''
+    patterns by name and the pattern/title of every failure mode
+    '''
+
+    def __init__(self, patterns, failure_modes):
+        self.patterns      = patterns
+        self.failure_modes = failure_modes
+
+    def register(self, name, path, **style):
+        '''
+        adds or replaces a pattern from a digitizer text file, style: mirror, color, linewidth
+        '''
+        points, offsets = parse_digitizer(path)
+        self.patterns[name] = CrackPattern(name, points, offsets, source_sha1=file_sha1(path), **style)
+        return self.patterns[name]
+
+    def pattern(self, name):
+        return self.patterns[name]
+
+    def for_failure_mode(self, failure_mode):
+        '''
+        (pattern, title) drawn for a predicted failure mode
+        '''
+        entry = self.failure_modes[failure_mode]
+        return self.patterns[entry['pattern']], entry.get('title', failure_mode)
+
+def pattern_sources(manifest_path):
+    '''
+    name -> (text file path, style) of the patterns of the manifest and of the unlisted Crack/*.txt files
+    '''
+    crack_dir = os.path.dirname(os.path.abspath(manifest_path))
+    with open(manifest_path) as manifest:
+        manifest = json.load(manifest)
+    sources = {}
+    for name, entry in manifest['patterns'].items():
+        style = {key: value for key, value in entry.items() if key != 'file'}
+        sources[name] = (os.path.join(crack_dir, entry['file']), style)
+    listed = set(os.path.basename(path) for path, _ in sources.values())
+    for file_name in sorted(os.listdir(crack_dir)):
+        name, extension = os.path.splitext(file_name)
+        if extension == '.txt' and file_name not in listed and name not in sources:
+            with open(os.path.join(crack_dir, file_name)) as data:
+                if 'Line #' in data.read():
+                    sources[name] = (os.path.join(crack_dir, file_name), {})
+    return sources, manifest.get('failure_modes', {})
+
+def source_files(manifest_path):
+    '''
+    registry sources of the store: the text file of every pattern and the Crack directory (for new files)
+    '''
+    sources, _ = pattern_sources(manifest_path)
+    return [os.path.dirname(os.path.abspath(manifest_path))]+sorted(path for path, _ in sources.values())
+
+def compiled_path(manifest_path):
+    return os.path.join(os.path.dirname(os.path.abspath(manifest_path)), 'crack_patterns.npz')
+
+def load_crack_store(manifest_path):
+    '''
+    registry loader of Crack/patterns.json: takes each pattern from crack_patterns.npz when it was
+    compiled from the current text file, parses the text file otherwise
+    '''
+    sources, failure_modes = pattern_sources(manifest_path)
+    compiled = {}
+    if os.path.exists(compiled_path(manifest_path)):
+        with np.load(compiled_path(manifest_path)) as arrays:
+            compiled = {key: arrays[key] for key in arrays.files}
+    store = CrackStore({}, failure_modes)
+    for name, (path, style) in sources.items():
+        sha1 = file_sha1(path)
+        if str(compiled.get(name+'/source_sha1', '')) == sha1:
+            store.patterns[name] = CrackPattern(name, compiled[name+'/points'], compiled[name+'/offsets'],
+                                                source_sha1=sha1, **style)
+        else:
+            store.register(name, path, **style)
+    return store
+
+def compile_patterns(manifest_path):
+    store  = load_crack_store(manifest_path)
+    arrays = {}
+    for name, pattern in store.patterns.items():
+        arrays[name+'/points']      = pattern.points
+        arrays[name+'/offsets']     = pattern.offsets
+        arrays[name+'/source_sha1'] = np.array(pattern.source_sha1)
+        print('{0}: {1} lines, {2} points'.format(name, pattern.n_lines, len(pattern.points)))
+    np.savez(compiled_path(manifest_path), **arrays)
+
+# parsed once per process (or read from Crack/crack_patterns.npz), for the GUI (wall_plot, wall_renderer)
+# and the report pages, which import this module instead of the pyplot drawings of wall_plot
+default_manifest = model_dir+'/Crack/patterns.json'
+registry.register('crack_patterns', default_manifest, load_crack_store, sources=lambda: source_files(default_manifest))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='compile the Crack/*.txt patterns into Crack/crack_patterns.npz')
+    parser.add_argument('--manifest', default=os.path.join(sys.path[0], 'Crack', 'patterns.json'))
+    args = parser.parse_args()
+    compile_patterns(args.manifest)
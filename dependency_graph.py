@@ -0,0 +1,182 @@
+'''
+Incremental recomputation over a small dependency graph of cached values.
+
+    graph = DependencyGraph()
+    graph.add_input('a', 1)
+    graph.add('b', lambda a: 2*a, ['a'])
+    graph.evaluate()        # computes b
+    graph.set('a', 3)
+    graph.evaluate()        # recomputes b, graph.recomputed == ['b']
+
+Every node keeps its value and a version that only changes when a new value differs from the old
+one. A node is recomputed when the versions of its inputs differ from those of its last computation,
+so setting an input to the value it already has recomputes nothing, and a recomputation that gives
+the same value stops there (its dependents are not recomputed).
+
+PredictionGraph is the graph of one wall: the ten inputs, the feature vector of the classifier (all
+inputs) and the one of the regressors (all but capacity_ratio), and the three model outputs. A wall
+predicted before is answered by result_cache without running the models; otherwise editing
+capacity_ratio only reruns the classifier.
+'''
+import numpy as np
+import predictor_core
+from predictor_core import (input_names, prediction_dtype, build_features, predict_fm_features,
+                            predict_strength_features, predict_deformation_features, result_cache)
+from profiling import profiler
+
+
+def same_value(a, b):
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return (isinstance(a, np.ndarray) and isinstance(b, np.ndarray) and a.dtype == b.dtype
+                and a.shape == b.shape and np.array_equal(a, b))
+    return type(a) == type(b) and a == b
+
+class Node(object):
+
+    def __init__(self, name, function=None, inputs=()):
+        self.name     = name
+        self.function = function    # None for an input
+        self.inputs   = list(inputs)
+        self.value    = None
+        self.version  = 0           # 0: never set or computed
+        self.stamp    = None        # versions of the inputs at the last computation
+
+class DependencyGraph(object):
+    '''
+    nodes are added after their inputs, so the order of addition is a valid evaluation order
+    recomputed: names of the nodes computed by the last evaluate(), in evaluation order
+    '''
+
+    def __init__(self):
+        self.nodes = {}
+        self.recomputed = []
+
+    def add_input(self, name, value=None):
+        self._add(Node(name))
+        if value is not None:
+            self.set(name, value)
+
+    def add(self, name, function, inputs):
+        '''
+        node computed as function(*values of inputs)
+        '''
+        for input_name in inputs:
+            if input_name not in self.nodes:
+                raise KeyError('{0}: unknown input {1!r}'.format(name, input_name))
+        self._add(Node(name, function, inputs))
+
+    def _add(self, node):
+        if node.name in self.nodes:
+            raise KeyError('node {0!r} already exists'.format(node.name))
+        self.nodes[node.name] = node
+
+    def set(self, name, value):
+        '''
+        sets an input, returns False when it already had that value
+        '''
+        node = self.nodes[name]
+        if node.function is not None:
+            raise KeyError('{0!r} is computed, not an input'.format(name))
+        return self._store(node, value)
+
+    def set_inputs(self, values):
+        return [name for name, value in values.items() if self.set(name, value)]
+
+    def value(self, name):
+        return self.nodes[name].value
+
+    def invalidate(self, name):
+        '''
+        forces the recomputation of a node (and of its dependents if its value changes)
+        '''
+        self.nodes[name].stamp = None
+
+    def evaluate(self, names=None):
+        '''
+        brings the nodes names (all by default) and what they depend on up to date, returns recomputed
+        '''
+        needed = set(self.nodes) if names is None else self._ancestors(names)
+        self.recomputed = []
+        for node in self.nodes.values():
+            if node.function is None or node.name not in needed:
+                continue
+            stamp = tuple(self.nodes[name].version for name in node.inputs)
+            if stamp == node.stamp:
+                continue
+            with profiler.span('graph/'+node.name):
+                value = node.function(*[self.nodes[name].value for name in node.inputs])
+            node.stamp = stamp
+            self.recomputed.append(node.name)
+            self._store(node, value)
+        return self.recomputed
+
+    def _store(self, node, value):
+        if node.version and same_value(value, node.value):
+            return False
+        node.value = value
+        node.version += 1
+        return True
+
+    def _ancestors(self, names):
+        needed, pending = set(), list(names)
+        while pending:
+            name = pending.pop()
+            if name not in needed:
+                needed.add(name)
+                pending.extend(self.nodes[name].inputs)
+        return needed
+
+class PredictionGraph(DependencyGraph):
+    '''
+    failure mode, strength and drift capacity of one wall, recomputed from the inputs that changed;
+    the result_cache fingerprint (model and scaler files, precision) and the inference precision of
+    the features are inputs too, so edited models and a switched precision are picked up
+    '''
+
+    output_names = ['failure_mode', 'strength', 'deformation']
+    xy_inputs    = [name for name in input_names if name != 'capacity_ratio']
+
+    def __init__(self):
+        super(PredictionGraph, self).__init__()
+        for name in input_names+['precision', 'artifacts']:
+            self.add_input(name)
+        self.add('fm_features', self._fm_features, input_names+['precision'])
+        self.add('xy_features', self._xy_features, self.xy_inputs+['precision'])
+        self.add('failure_mode', lambda features, artifacts: str(predict_fm_features(features)[0]),
+                 ['fm_features', 'artifacts'])
+        self.add('strength', lambda features, artifacts: float(predict_strength_features(features)[0]),
+                 ['xy_features', 'artifacts'])
+        self.add('deformation', lambda features, artifacts: float(predict_deformation_features(features)[0]),
+                 ['xy_features', 'artifacts'])
+
+    @staticmethod
+    def _fm_features(*values):
+        return build_features({name: [value] for name, value in zip(input_names, values)}, dtype=values[-1])
+
+    def _xy_features(self, *values):
+        walls = {name: [value] for name, value in zip(self.xy_inputs, values)}
+        # placeholder, the regressors do not read the capacity_ratio column
+        walls['capacity_ratio'] = [0.0]
+        return build_features(walls, dtype=values[-1])
+
+    def predict(self, walls):
+        '''
+        walls: predict_batch columns of one wall, returns {failure_mode, strength, deformation}
+        recomputed lists the nodes computed for it, only fm_features when result_cache had the wall
+        '''
+        self.set_inputs({name: walls[name][0] for name in input_names})
+        self.set('precision', predictor_core.inference_dtype.name)
+        self.set('artifacts', result_cache.fingerprint())
+        recomputed = list(self.evaluate(['fm_features']))
+        def predict_features(features_np):
+            # a wall missing from result_cache: the model outputs whose inputs changed are rerun
+            recomputed.extend(self.evaluate(self.output_names))
+            predicted = np.empty(len(features_np), dtype=prediction_dtype)
+            for name in self.output_names:
+                predicted[name] = self.value(name)
+            return predicted
+        # the same key as predict_batch, so the walls of the button, the live mode and the batches share entries
+        predicted = result_cache.predict(self.value('fm_features'), predict_features)[0]
+        self.recomputed = recomputed
+        return {'failure_mode': str(predicted['failure_mode']), 'strength': float(predicted['strength']),
+                'deformation': float(predicted['deformation'])}
@@ -0,0 +1,68 @@
+'''
+Import-time budget of the headless prediction core, measured with "python -X importtime" in a fresh
+interpreter so that nothing is already cached in sys.modules.
+
+    python import_budget.py                 # predictor_core within budget_ms, no GUI/ML libraries imported
+    python import_budget.py --module sweep --budget-ms 200 --top 15
+
+Exits with status 1 when the budget is exceeded or a forbidden module was imported.
+'''
+import os
+import sys
+import subprocess
+
+
+# cumulative import time of predictor_core, most of it is numpy (about 100 ms on a laptop)
+budget_ms = 250
+# only imported on demand: by the GUI, or on the first prediction that needs a pickled model
+forbidden_modules = ['PyQt5', 'matplotlib', 'joblib', 'sklearn', 'xgboost', 'scipy', 'sqlite3']
+
+def measure(module, repeat=3):
+    '''
+    returns {module name: (self us, cumulative us)} of the fastest of repeat cold imports
+    '''
+    best = None
+    for _ in range(repeat):
+        command = [sys.executable, '-X', 'importtime', '-c', 'import {0}'.format(module)]
+        process = subprocess.run(command, cwd=os.path.dirname(os.path.abspath(__file__)),
+                                 stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+        if process.returncode != 0:
+            raise RuntimeError('import {0} failed:\n{1}'.format(module, process.stderr))
+        timings = parse_importtime(process.stderr)
+        if best is None or timings[module][1] < best[module][1]:
+            best = timings
+    return best
+
+def parse_importtime(text):
+    timings = {}
+    for line in text.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        timings[name.strip()] = (int(self_us), int(cumulative_us))
+    return timings
+
+def check(module='predictor_core', budget=budget_ms, forbidden=forbidden_modules, top=10):
+    timings = measure(module)
+    total_ms = timings[module][1]/1000
+    print('import {0}: {1:.1f} ms (budget {2} ms)'.format(module, total_ms, budget))
+    for name, (self_us, cumulative_us) in sorted(timings.items(), key=lambda item: -item[1][0])[:top]:
+        print('  {0:8.1f} ms  {1}'.format(self_us/1000, name))
+    imported = sorted(set(name.split('.')[0] for name in timings) & set(forbidden))
+    ok = total_ms <= budget
+    if not ok:
+        print('over budget by {0:.1f} ms'.format(total_ms-budget))
+    if imported:
+        ok = False
+        print('imports forbidden modules: {0}'.format(', '.join(imported)))
+    return ok
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='check the cold import time of the headless prediction core')
+    parser.add_argument('--module', default='predictor_core')
+    parser.add_argument('--budget-ms', type=float, default=budget_ms)
+    parser.add_argument('--top', type=int, default=10, help='number of slowest modules listed')
+    args = parser.parse_args()
+    sys.exit(0 if check(args.module, args.budget_ms, top=args.top) else 1)
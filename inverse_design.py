@@ -0,0 +1,242 @@
+'''
+Inverse design: the least reinforcement giving a wanted failure mode, strength and drift capacity.
+
+For every wall the geometry, axial load and the other fixed inputs are given, and the reinforcement
+inputs (design_names) are searched by differential evolution (DE/rand/1/bin):
+
+    minimize    sum_i weights_i*x_i                        over x = longi_reinf, hoop_reinf, web_hor_reinf, web_ver_reinf
+    subject to  failure mode = failure_mode, strength >= min_strength, deformation >= min_deformation
+
+Constraints are handled with Deb's feasibility rules (a feasible design beats an infeasible one, two
+infeasible designs are compared by their total violation). The failure mode violation is the
+probability gap to the most likely other mode, so that infeasible populations still move towards
+the wanted mode. The populations of all walls of a call are scored together each generation, with
+one predict_fm_proba_features/predict_strength_features/predict_deformation_features call on the
+stacked candidates, and every wall stops on its own once its best design stopped improving.
+
+    designs = optimize_walls(walls, min_strength=0.1, min_deformation=1.5, workers=8)
+
+    python inverse_design.py walls.csv designs.csv --min-strength 0.1 --min-deformation 1.5 --workers 8
+'''
+import os
+import sys
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from predictor_core import (input_names, feature_names, failure_mode_names, registry, build_features,
+                            predict_fm_proba_features, predict_strength_features, predict_deformation_features)
+from profiling import profiler
+
+
+design_names = ['longi_reinf', 'hoop_reinf', 'web_hor_reinf', 'web_ver_reinf']
+fixed_names  = [name for name in input_names if name not in design_names]
+
+design_dtype = np.dtype([(name, float) for name in design_names] +
+                        [('failure_mode', failure_mode_names.dtype), ('strength', float), ('deformation', float),
+                         ('objective', float), ('violation', float), ('feasible', bool), ('generations', int)])
+
+def training_bounds(names=design_names):
+    '''
+    (lower, upper) of the inputs over the training data of all three models (the scalers map it to [0, 1])
+    '''
+    lower = np.full(len(names), -np.inf)
+    upper = np.full(len(names), np.inf)
+    for model in ('fm', 'strength', 'deformation'):
+        scaler  = registry.get(model+'_scaler')
+        columns = feature_names if model == 'fm' else [name for name in feature_names if name != 'capacity_ratio']
+        for i, name in enumerate(names):
+            column = columns.index(name)
+            scale, offset = scaler['x_scale'][column], scaler['x_offset'][column]
+            lower[i] = max(lower[i], -offset/scale)
+            upper[i] = min(upper[i], (1-offset)/scale)
+    return lower, upper
+
+class DesignProblem(object):
+    '''
+    fixed:           dict of the fixed_names inputs, one value per wall (scalars are broadcast)
+    failure_mode:    wanted failure mode, None for any
+    min_strength:    lower bound of V/(Ag fc), scalar or one per wall
+    min_deformation: lower bound of the drift capacity (%), scalar or one per wall
+    bounds:          (lower, upper) arrays of the design_names inputs, training_bounds() by default
+    weights:         cost of a unit of each design input in the objective
+    '''
+
+    def __init__(self, fixed, failure_mode='Flexure', min_strength=0.0, min_deformation=0.0, bounds=None,
+                 weights=None):
+        self.n_walls = max(np.size(value) for value in fixed.values())
+        self.fixed   = {name: np.broadcast_to(np.asarray(fixed[name]), (self.n_walls,)) for name in fixed_names}
+        if failure_mode is not None and failure_mode not in failure_mode_names:
+            raise ValueError('unknown failure mode {0!r}'.format(failure_mode))
+        self.failure_mode    = failure_mode
+        self.min_strength    = np.broadcast_to(np.asarray(min_strength, dtype=float), (self.n_walls,))
+        self.min_deformation = np.broadcast_to(np.asarray(min_deformation, dtype=float), (self.n_walls,))
+        self.bounds  = training_bounds() if bounds is None else tuple(np.asarray(bound, dtype=float) for bound in bounds)
+        self.weights = np.ones(len(design_names)) if weights is None else np.asarray(weights, dtype=float)
+
+    def subset(self, walls):
+        fixed = {name: values[walls] for name, values in self.fixed.items()}
+        return DesignProblem(fixed, self.failure_mode, self.min_strength[walls], self.min_deformation[walls],
+                             self.bounds, self.weights)
+
+    def evaluate(self, walls, designs):
+        '''
+        walls: (m,) wall index of every candidate, designs: (m, len(design_names)) candidates
+        returns objective, total constraint violation, failure mode, strength and deformation of each candidate
+        '''
+        columns = {name: values[walls] for name, values in self.fixed.items()}
+        for i, name in enumerate(design_names):
+            columns[name] = designs[:, i]
+        features_np   = build_features(columns)
+        probabilities = predict_fm_proba_features(features_np)
+        strength      = predict_strength_features(features_np)
+        deformation   = predict_deformation_features(features_np)
+        violation = np.maximum(0, self.min_strength[walls]-strength)/np.maximum(self.min_strength[walls], 1e-12)
+        violation += np.maximum(0, self.min_deformation[walls]-deformation)/np.maximum(self.min_deformation[walls], 1e-12)
+        if self.failure_mode is not None:
+            target = list(failure_mode_names).index(self.failure_mode)
+            others = np.delete(probabilities, target, axis=1).max(axis=1)
+            # zero only when the wanted mode is the predicted one
+            violation += np.where(probabilities[:, target] >= others, 0, others-probabilities[:, target])
+        failure_mode = failure_mode_names[np.argmax(probabilities, axis=1)]
+        return designs.dot(self.weights), violation, failure_mode, strength, deformation
+
+def better(objective, violation, best_objective, best_violation):
+    '''
+    Deb's rules: lower violation first, the objective among designs of equal (zero) violation
+    '''
+    return (violation < best_violation) | ((violation == best_violation) & (objective < best_objective))
+
+def best_designs(objective, violation):
+    '''
+    index of the best design of every row of (walls, population) scores
+    '''
+    return np.lexsort((objective, violation), axis=-1)[:, 0]
+
+def differential_evolution(problem, population=24, max_generations=300, patience=30, tol=1e-6, F=0.6, CR=0.9,
+                           seed=None):
+    '''
+    optimizes every wall of problem, returns a design_dtype array
+    patience: generations without improvement of the best design by more than tol before a wall stops
+    seed:     seed of the run, or one seed per wall (optimize_walls spawns them from its seed so that
+              a wall draws the same random numbers whatever block of walls it is optimized with)
+    '''
+    n_walls, n_design = problem.n_walls, len(design_names)
+    lower, upper = problem.bounds
+    if not isinstance(seed, (list, tuple)):
+        seed = np.random.SeedSequence(seed).spawn(n_walls)
+    rngs = [np.random.default_rng(wall_seed) for wall_seed in seed]
+    # (walls, population, design) arrays of the current population and its scores
+    designs = lower+(upper-lower)*np.stack([rng.random((population, n_design)) for rng in rngs])
+    wall_index = np.repeat(np.arange(n_walls), population)
+    with profiler.span('design/evaluate'):
+        scores = problem.evaluate(wall_index, designs.reshape(-1, n_design))
+    objective, violation = (score.reshape(n_walls, population) for score in scores[:2])
+    failure_mode, strength, deformation = (score.reshape(n_walls, population) for score in scores[2:])
+    active      = np.ones(n_walls, dtype=bool)
+    generations = np.zeros(n_walls, dtype=int)
+    stalled     = np.zeros(n_walls, dtype=int)
+    best = best_designs(objective, violation)
+    best_violation = violation[np.arange(n_walls), best]
+    best_objective = objective[np.arange(n_walls), best]
+    for generation in range(max_generations):
+        walls = np.nonzero(active)[0]
+        if not len(walls):
+            break
+        # DE/rand/1/bin trial vectors of the active walls
+        trials = np.empty((len(walls), population, n_design))
+        for row, w in enumerate(walls):
+            rng = rngs[w]
+            # three distinct donors per target vector: the first columns of random permutations
+            picks = np.argsort(rng.random((population, population-1)), axis=1)[:, :3]
+            # the donors must also differ from the target vector
+            picks += picks >= np.arange(population)[:, None]
+            mutant = designs[w, picks[:, 0]]+F*(designs[w, picks[:, 1]]-designs[w, picks[:, 2]])
+            crossover = rng.random((population, n_design)) < CR
+            crossover[np.arange(population), rng.integers(n_design, size=population)] = True
+            trials[row] = np.clip(np.where(crossover, mutant, designs[w]), lower, upper)
+        with profiler.span('design/evaluate'):
+            scores = problem.evaluate(np.repeat(walls, population), trials.reshape(-1, n_design))
+        scores = [score.reshape(len(walls), population) for score in scores]
+        replace = better(scores[0], scores[1], objective[walls], violation[walls])
+        for array, score in zip((objective, violation, failure_mode, strength, deformation), scores):
+            array[walls] = np.where(replace, score, array[walls])
+        designs[walls] = np.where(replace[..., None], trials, designs[walls])
+        generations[walls] += 1
+        # the selection is elitist: the best design of a wall never gets worse
+        best[walls] = best_designs(objective[walls], violation[walls])
+        new_violation = violation[walls, best[walls]]
+        new_objective = objective[walls, best[walls]]
+        improved = (new_violation < best_violation[walls]-tol) | \
+                   ((new_violation <= best_violation[walls]) & (new_objective < best_objective[walls]-tol))
+        best_violation[walls] = new_violation
+        best_objective[walls] = new_objective
+        stalled[walls] = np.where(improved, 0, stalled[walls]+1)
+        active[walls]  = stalled[walls] < patience
+    result = np.empty(n_walls, dtype=design_dtype)
+    chosen = (np.arange(n_walls), best)
+    for i, name in enumerate(design_names):
+        result[name] = designs[chosen][:, i]
+    result['failure_mode'] = failure_mode[chosen]
+    result['strength']     = strength[chosen]
+    result['deformation']  = deformation[chosen]
+    result['objective']    = objective[chosen]
+    result['violation']    = violation[chosen]
+    result['feasible']     = violation[chosen] == 0
+    result['generations']  = generations
+    return result
+
+def _optimize_block(problem, seeds, options):
+    # worker of optimize_walls: one process optimizes a block of walls together
+    return differential_evolution(problem, seed=seeds, **options)
+
+def optimize_walls(walls, failure_mode='Flexure', min_strength=0.0, min_deformation=0.0, bounds=None, weights=None,
+                   workers=1, block_size=64, seed=0, **options):
+    '''
+    least reinforcement of many walls, see DesignProblem for the arguments and differential_evolution
+    for the options; walls: dict of the fixed_names inputs (the design inputs are ignored)
+    workers > 1 optimizes blocks of block_size walls in a process pool
+    '''
+    problem = DesignProblem(walls, failure_mode, min_strength, min_deformation, bounds, weights)
+    seeds   = np.random.SeedSequence(seed).spawn(problem.n_walls)
+    if workers <= 1 or problem.n_walls <= block_size:
+        return differential_evolution(problem, seed=seeds, **options)
+    blocks = [np.arange(start, min(start+block_size, problem.n_walls)) for start in range(0, problem.n_walls, block_size)]
+    # spawned, not forked: the OpenMP threads of xgboost/scikit-learn used by this process do not survive a fork
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+        results = executor.map(_optimize_block, [problem.subset(block) for block in blocks],
+                               [[seeds[i] for i in block] for block in blocks], [options]*len(blocks))
+        return np.concatenate(list(results))
+
+
+if __name__ == '__main__':
+    import argparse
+    import csv
+    from batch_runner import read_csv_shards, parse_shard
+    parser = argparse.ArgumentParser(description='least reinforcement of walls for a failure mode, strength and drift')
+    parser.add_argument('input', help='CSV file with the fixed wall inputs as columns: '+', '.join(fixed_names))
+    parser.add_argument('output', help='CSV file of the designs')
+    parser.add_argument('--failure-mode', default='Flexure', help='wanted failure mode, "any" for none')
+    parser.add_argument('--min-strength', type=float, default=0.0)
+    parser.add_argument('--min-deformation', type=float, default=0.0)
+    parser.add_argument('--population', type=int, default=24)
+    parser.add_argument('--max-generations', type=int, default=300)
+    parser.add_argument('--patience', type=int, default=30)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    columns = {}
+    for _, header, shard in read_csv_shards(args.input, 1<<30):
+        columns = parse_shard(header, shard)
+    missing = [name for name in fixed_names if name not in columns]
+    if missing:
+        sys.exit('missing columns: {0}'.format(', '.join(missing)))
+    walls = {name: np.asarray(columns[name], dtype=str if name == 'section_type' else float) for name in fixed_names}
+    designs = optimize_walls(walls, None if args.failure_mode == 'any' else args.failure_mode, args.min_strength,
+                             args.min_deformation, workers=args.workers, seed=args.seed, population=args.population,
+                             max_generations=args.max_generations, patience=args.patience)
+    with open(args.output, 'w', newline='') as output:
+        writer = csv.writer(output)
+        writer.writerow(['row']+list(design_dtype.names))
+        for row, design in enumerate(designs):
+            writer.writerow([row]+design.tolist())
+    sys.stderr.write('{0} of {1} walls feasible\n'.format(int(designs['feasible'].sum()), len(designs)))
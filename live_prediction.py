@@ -0,0 +1,118 @@
+'''
+Predictions of the GUI computed on a background thread while the inputs are edited.
+
+    live = LivePrediction(debounce_ms=150)
+    live.ready.connect(show)            # show(walls, predicted, timings, recomputed) on the GUI thread
+    live.request(walls)                 # after every edit, only the last one of a burst is predicted
+
+Every request gets a generation number. The worker skips a request that is already superseded when
+it reaches the front of its queue, and a result that arrives after a newer request was made is
+dropped, so the window only ever shows the prediction of the current inputs. The models are loaded
+by the worker (warm_up on start), never on the GUI thread. The worker keeps a PredictionGraph of the
+last wall it predicted: a wall already in result_cache is not predicted again, a new one only reruns
+the models whose inputs changed.
+'''
+from PyQt5.QtCore import QObject, QThread, QTimer, pyqtSignal, pyqtSlot
+from predictor_core import registry
+from dependency_graph import PredictionGraph
+from profiling import profiler
+
+
+class PredictionWorker(QObject):
+
+    # generation, walls, {failure_mode, strength, deformation}, [(span, seconds)], recomputed graph nodes
+    finished = pyqtSignal(int, object, object, object, object)
+    failed   = pyqtSignal(int, str)
+
+    def __init__(self, live):
+        super(PredictionWorker, self).__init__()
+        self.live  = live
+        self.graph = PredictionGraph()    # only used on the worker thread
+
+    @pyqtSlot()
+    def warm_up(self):
+        registry.warm_up()
+
+    @pyqtSlot(int, object)
+    def predict(self, generation, walls):
+        if generation != self.live.generation:
+            profiler.count('live/skipped')
+            return
+        try:
+            with profiler.record() as timings:
+                with profiler.span('predict'):
+                    predicted = self.graph.predict(walls)
+        except Exception as error:
+            self.failed.emit(generation, '{0}: {1}'.format(type(error).__name__, error))
+            return
+        self.finished.emit(generation, walls, predicted, timings, list(self.graph.recomputed))
+
+class LivePrediction(QObject):
+    '''
+    debounces the requests of the GUI thread and runs them on one worker thread
+    '''
+
+    ready  = pyqtSignal(object, object, object, object)     # walls, predicted, [(span, seconds)], recomputed nodes of the worker
+    error  = pyqtSignal(str)
+    _start = pyqtSignal()
+    _submit_request = pyqtSignal(int, object)
+
+    def __init__(self, debounce_ms=150, parent=None):
+        super(LivePrediction, self).__init__(parent)
+        self.generation = 0
+        self._pending   = None
+        self._timer     = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(debounce_ms)
+        self._timer.timeout.connect(self._submit)
+        self._thread = QThread()
+        self._worker = PredictionWorker(self)
+        self._worker.moveToThread(self._thread)
+        # cross-thread signals are queued: the slots run on the worker thread, the results on this one
+        self._start.connect(self._worker.warm_up)
+        self._submit_request.connect(self._worker.predict)
+        self._worker.finished.connect(self._on_finished)
+        self._worker.failed.connect(self._on_failed)
+        self._thread.start()
+        self._start.emit()
+
+    def request(self, walls, immediate=False):
+        '''
+        predicts walls (predict_batch columns of one wall) once no newer request came for debounce_ms
+        '''
+        self.generation += 1
+        self._pending = (self.generation, walls)
+        if immediate:
+            self._timer.stop()
+            self._submit()
+        else:
+            self._timer.start()
+
+    def cancel(self):
+        '''
+        drops the pending request and the result of the one being computed
+        '''
+        self.generation += 1
+        self._pending = None
+        self._timer.stop()
+
+    def stop(self):
+        self.cancel()
+        self._thread.quit()
+        self._thread.wait()
+
+    def _submit(self):
+        if self._pending is not None:
+            generation, walls = self._pending
+            self._pending = None
+            self._submit_request.emit(generation, walls)
+
+    def _on_finished(self, generation, walls, predicted, timings, recomputed):
+        if generation == self.generation:
+            self.ready.emit(walls, predicted, timings, recomputed)
+        else:
+            profiler.count('live/stale')
+
+    def _on_failed(self, generation, message):
+        if generation == self.generation:
+            self.error.emit(message)
@@ -0,0 +1,214 @@
+'''
+All tree ensembles and scalers in one versioned, checksummed file of plain arrays (models.bundle).
+
+The file is memory-mapped read-only: the arrays are numpy views of the mapping, so opening it only
+parses a JSON header (and checks the checksum), and every worker process that maps the same file
+shares its pages through the page cache instead of holding a private copy of the unpickled models.
+
+    magic b'WALLBNDL' | format version (uint32) | header length (uint32) | JSON header | arrays
+
+The header lists every array (group/name -> dtype, shape, offset into the payload, 64-byte aligned),
+the source file and sha1 each group was converted from, and the sha256 of the payload.
+
+    python model_bundle.py                  # models.bundle from the .pkl models and Scaler_*.txt files
+    python model_bundle.py --check 10000    # and compare its predictions with the sources
+
+predictor_core uses the bundle when it exists (or the file named by WALL_MODEL_BUNDLE). A group whose
+source file is present and changed since the conversion is loaded from that source instead, and the
+registry watches the source files as well as the bundle, so such an edit is picked up (and changes
+the result_cache fingerprint) while the process runs.
+'''
+import os
+import sys
+import json
+import mmap
+import struct
+import hashlib
+import threading
+import numpy as np
+from model_registry import file_sha1
+
+
+magic          = b'WALLBNDL'
+format_version = 1
+alignment      = 64
+default_name   = 'models.bundle'
+_prefix        = struct.Struct('<8sII')
+
+# registry artifact stored as a group -> the source file it is converted from
+bundle_groups = {
+    'fm_trees':           'fm_xgboost.pkl',
+    'strength_trees':     'strength_gb.pkl',
+    'deformation_trees':  'deformation_rf.pkl',
+    'fm_scaler':          'Scaler_fm.txt',
+    'strength_scaler':    'Scaler_strength.txt',
+    'deformation_scaler': 'Scaler_deformation.txt',
+}
+
+def _aligned(offset):
+    return (offset+alignment-1)//alignment*alignment
+
+def write_bundle(path, groups, sources):
+    '''
+    groups:  {group name: {array name: array}}, no object arrays
+    sources: {group name: {'file': source file name, 'sha1': its sha1}}
+    the file is written next to path and renamed over it, processes mapping the old file keep it
+    '''
+    arrays, payload_size = {}, 0
+    for group, group_arrays in groups.items():
+        for name, array in group_arrays.items():
+            # (ascontiguousarray would turn the 0-d scalars into 1-d arrays)
+            array = np.array(array, copy=False, order='C')
+            if array.dtype.hasobject:
+                raise TypeError('{0}/{1}: object arrays cannot be mapped'.format(group, name))
+            payload_size = _aligned(payload_size)
+            arrays[group+'/'+name] = (array, payload_size)
+            payload_size += array.nbytes
+    payload = bytearray(payload_size)
+    for array, offset in arrays.values():
+        payload[offset:offset+array.nbytes] = array.tobytes()
+    header = {'format_version': format_version, 'sources': sources, 'sha256': hashlib.sha256(payload).hexdigest(),
+              'arrays': {key: {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+                         for key, (array, offset) in arrays.items()}}
+    header = json.dumps(header, sort_keys=True).encode()
+    payload_start = _aligned(_prefix.size+len(header))
+    temporary = path+'.tmp{0}'.format(os.getpid())
+    with open(temporary, 'wb') as bundle:
+        bundle.write(_prefix.pack(magic, format_version, len(header)))
+        bundle.write(header)
+        bundle.write(b'\0'*(payload_start-_prefix.size-len(header)))
+        bundle.write(payload)
+    os.replace(temporary, path)
+
+class ModelBundle(object):
+    '''
+    read-only mapping of a bundle file, group() returns numpy views of the mapped arrays
+    '''
+
+    def __init__(self, path, verify=True):
+        self.path = path
+        with open(path, 'rb') as bundle:
+            self._map = mmap.mmap(bundle.fileno(), 0, access=mmap.ACCESS_READ)
+        file_magic, version, header_size = _prefix.unpack_from(self._map, 0)
+        if file_magic != magic:
+            raise ValueError('{0} is not a model bundle'.format(path))
+        if version != format_version:
+            raise ValueError('{0}: format version {1}, expected {2}'.format(path, version, format_version))
+        self.header = json.loads(self._map[_prefix.size:_prefix.size+header_size].decode())
+        self.payload_start = _aligned(_prefix.size+header_size)
+        self.sources = self.header['sources']
+        if verify:
+            self.verify()
+
+    def verify(self):
+        if hashlib.sha256(memoryview(self._map)[self.payload_start:]).hexdigest() != self.header['sha256']:
+            raise ValueError('{0}: checksum mismatch, the file is corrupt or truncated'.format(self.path))
+
+    def groups(self):
+        return sorted(set(key.split('/')[0] for key in self.header['arrays']))
+
+    def group(self, group):
+        arrays = {}
+        for key, entry in self.header['arrays'].items():
+            group_name, name = key.split('/', 1)
+            if group_name != group:
+                continue
+            dtype = np.dtype(entry['dtype'])
+            count = int(np.prod(entry['shape'], dtype=np.int64))
+            arrays[name] = np.frombuffer(self._map, dtype=dtype, count=count,
+                                         offset=self.payload_start+entry['offset']).reshape(tuple(entry['shape']))
+        if not arrays:
+            raise KeyError('{0} has no group {1}'.format(self.path, group))
+        return arrays
+
+# bundles mapped by this process, one mapping per file version
+_bundles = {}
+_lock    = threading.Lock()
+
+def open_bundle(path):
+    stat = os.stat(path)
+    key  = (os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        if key not in _bundles:
+            _bundles[key] = ModelBundle(path)
+        return _bundles[key]
+
+def source_path(path, group):
+    '''
+    the source file of a group of the bundle path, next to the bundle
+    '''
+    return os.path.join(os.path.dirname(os.path.abspath(path)), bundle_groups[group])
+
+def bundle_loader(group, source_loader):
+    '''
+    registry loader of a group of the bundle, source_loader(source path) is used instead when the
+    source file is present and differs from the one the group was converted from; register the
+    group with source_path() as a source so that an edit of that file reloads it
+    '''
+    def load(path):
+        bundle = open_bundle(path)
+        source = bundle.sources[group]
+        source_path = os.path.join(os.path.dirname(os.path.abspath(path)), source['file'])
+        if os.path.exists(source_path) and file_sha1(source_path) != source['sha1']:
+            return source_loader(source_path)
+        arrays = bundle.group(group)
+        if group.endswith('_trees'):
+            from tree_engine import TreeEnsemble
+            return TreeEnsemble(arrays)
+        return arrays
+    return load
+
+def build_bundle(model_dir, path=None):
+    '''
+    converts the tree ensembles (their .npz exports when up to date, the .pkl models otherwise) and
+    the scalers of model_dir into one bundle
+    '''
+    from tree_engine import load_tree_ensemble
+    from scaler_compiler import load_scaler
+    path = path or os.path.join(model_dir, default_name)
+    groups, sources = {}, {}
+    for group, source_file in bundle_groups.items():
+        source_path = os.path.join(model_dir, source_file)
+        if group.endswith('_trees'):
+            ensemble = load_tree_ensemble(source_path)
+            groups[group] = ensemble.arrays()
+            sha1 = ensemble.source_sha1
+        else:
+            groups[group] = load_scaler(source_path)
+            sha1 = str(groups[group]['source_sha1'])
+        sources[group] = {'file': source_file, 'sha1': sha1}
+    write_bundle(path, groups, sources)
+    return path
+
+def check_bundle(path, model_dir, n_check=10000, seed=0):
+    '''
+    largest difference between the predictions of the bundle and of the source artifacts
+    '''
+    from tree_engine import load_tree_ensemble
+    from scaler_compiler import load_scaler
+    bundle = ModelBundle(path)
+    rng = np.random.RandomState(seed)
+    for group, source_file in bundle_groups.items():
+        source_path = os.path.join(model_dir, source_file)
+        if group.endswith('_trees'):
+            ensemble, source = bundle_loader(group, load_tree_ensemble)(path), load_tree_ensemble(source_path)
+            X = rng.uniform(-0.2, 1.2, size=(n_check, ensemble.n_features))
+            difference = np.abs(ensemble.predict_raw(X)-source.predict_raw(X)).max()
+        else:
+            mapped, source = bundle.group(group), load_scaler(source_path)
+            difference = max(np.abs(mapped[key]-source[key]).max() for key in mapped if mapped[key].dtype.kind == 'f')
+        print('{0:20s} max difference {1:.2e}'.format(group, difference))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='convert the models and scalers into one memory-mapped bundle')
+    parser.add_argument('--model-dir', default=sys.path[0])
+    parser.add_argument('--output', help='bundle file, {0} in the model directory by default'.format(default_name))
+    parser.add_argument('--check', type=int, default=0, metavar='N', help='compare N random rows with the sources')
+    args = parser.parse_args()
+    path = build_bundle(args.model_dir, args.output)
+    bundle = ModelBundle(path)
+    print('{0}: {1} bytes, groups {2}'.format(path, os.path.getsize(path), ', '.join(bundle.groups())))
+    if args.check:
+        check_bundle(path, args.model_dir, n_check=args.check)
@@ -0,0 +1,154 @@
+import os
+import hashlib
+import threading
+from profiling import profiler
+
+
+def file_sha1(path, block_size=1<<20):
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha1.update(block)
+    return sha1.hexdigest()
+
+class ModelRegistry(object):
+    '''
+    Process-wide cache of the model and scaler artifacts.
+
+    Every artifact is registered once with its file path and a loader (e.g. joblib.load) and is
+    loaded lazily on the first get(). Later calls only stat() the file: when its mtime or size
+    changed, the content hash is compared and the artifact is reloaded if the file really changed.
+    An artifact converted from other files (a group of the model bundle, the crack pattern texts) also
+    lists them as sources, which are watched the same way.
+    '''
+
+    def __init__(self):
+        self._artifacts = {}    # name -> (path, loader, source paths or callable returning them)
+        self._loaded    = {}    # name -> [stat signature, sha1, loaded object, source paths]
+        self._hashes    = {}    # path -> (stat signature, sha1), see fingerprint()
+        self._lock      = threading.RLock()
+
+    def register(self, name, path, loader, sources=()):
+        '''
+        sources: files the artifact was made from, an edit (or removal) of one of them reloads it; a
+        directory counts as changed when a file is added, removed or renamed in it; a callable is
+        called again at every load, for sources that come and go
+        '''
+        with self._lock:
+            self._artifacts[name] = (path, loader, sources if callable(sources) else tuple(sources))
+            self._loaded.pop(name, None)
+
+    def names(self):
+        return list(self._artifacts)
+
+    def path(self, name):
+        return self._artifacts[name][0]
+
+    def is_loaded(self, name):
+        return name in self._loaded
+
+    def get(self, name):
+        with self._lock:
+            path, loader, _ = self._artifacts[name]
+            cached = self._loaded.get(name)
+            if cached is not None:
+                sources = cached[3]
+                stat_signature = _files_signature(path, sources)
+                if cached[0] == stat_signature:
+                    return cached[2]
+                # touched on disk, only reload when the content really changed
+                if self._content_sha1(path, sources) == cached[1]:
+                    cached[0] = stat_signature
+                    return cached[2]
+            sources = self._sources(name)
+            stat_signature = _files_signature(path, sources)
+            sha1 = self._content_sha1(path, sources)
+            with profiler.span('load/'+name):
+                loaded = loader(path)
+            self._loaded[name] = [stat_signature, sha1, loaded, sources]
+            return loaded
+
+    def _sources(self, name):
+        sources = self._artifacts[name][2]
+        return tuple(sources()) if callable(sources) else sources
+
+    def _content_sha1(self, path, sources):
+        if not sources:
+            return file_sha1(path)
+        sha1 = hashlib.sha1(file_sha1(path).encode())
+        for source in sources:
+            sha1.update('{0}={1};'.format(os.path.basename(source), self._file_hash(source)).encode())
+        return sha1.hexdigest()
+
+    def _file_hash(self, path):
+        '''
+        sha1 of a file or of the file names of a directory (None when it does not exist), rehashed only
+        when its stat changed
+        '''
+        if not os.path.exists(path):
+            return None
+        stat_signature = _stat_signature(path)
+        cached = self._hashes.get(path)
+        if cached is None or cached[0] != stat_signature:
+            if os.path.isdir(path):
+                file_hash = hashlib.sha1('\n'.join(sorted(os.listdir(path))).encode()).hexdigest()
+            else:
+                file_hash = file_sha1(path)
+            cached = self._hashes[path] = (stat_signature, file_hash)
+        return cached[1]
+
+    def sha1(self, name):
+        with self._lock:
+            self.get(name)
+            return self._loaded[name][1]
+
+    def fingerprint(self, names=None):
+        '''
+        hash of the files (and source files) of the given artifacts (all by default) that exist on disk,
+        without loading them, changes whenever one of the files is edited, added or removed
+        '''
+        with self._lock:
+            sha1 = hashlib.sha1()
+            for name in sorted(self.names() if names is None else names):
+                path = self._artifacts[name][0]
+                sources = self._loaded[name][3] if name in self._loaded else self._sources(name)
+                file_hash = self._file_hash(path)
+                if file_hash is not None:
+                    sha1.update('{0}={1};'.format(name, file_hash).encode())
+                for source in sources:
+                    source_hash = self._file_hash(source)
+                    if source_hash is not None:
+                        sha1.update('{0}<{1}={2};'.format(name, os.path.basename(source), source_hash).encode())
+            return sha1.hexdigest()
+
+    def warm_up(self, names=None):
+        '''
+        load the given artifacts (all registered ones by default) ahead of the first prediction
+        '''
+        for name in (self.names() if names is None else names):
+            self.get(name)
+
+    def evict(self, names=None):
+        '''
+        drop the given artifacts (all by default) from memory, they are reloaded on the next get()
+        '''
+        with self._lock:
+            if names is None:
+                self._loaded.clear()
+            else:
+                for name in names:
+                    self._loaded.pop(name, None)
+
+def _stat_signature(path):
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size)
+
+def _files_signature(path, sources):
+    return (_stat_signature(path),)+tuple(_source_signature(source) for source in sources)
+
+def _source_signature(path):
+    # a missing source is a state too: the bundle falls back to it when it appears
+    return _stat_signature(path) if os.path.exists(path) else None
+
+# shared by the GUI and every batch path of this process
+registry = ModelRegistry()
@@ -0,0 +1,375 @@
+'''
+Monte Carlo fragility analysis: failure mode probabilities and strength/drift distributions of walls
+whose inputs scatter around their nominal values.
+
+    distributions = {'axial_ratio': Lognormal(cov=0.15), 'longi_reinf': Normal(cov=0.1)}
+    result = run_monte_carlo(walls, distributions, n_samples=100000, seed=1, workers=8)
+    result.summary()                    # p_<failure mode>, mean, std and quantiles per wall
+    result.fragility([1, 2, 3])         # P(drift capacity <= demand) per wall and demand
+
+    python monte_carlo.py walls.csv summary.csv --samples 100000 --vary axial_ratio=lognormal:0.15 --workers 8
+
+The samples of a block of walls are drawn and predicted in batches of about chunk_size rows and
+reduced on the fly: running mean and variance (merged with the pairwise update of Chan et al.), a
+log-bucket histogram per wall giving quantiles and CDF values within relative_accuracy, and the
+count of every failure mode. Memory depends on the number of walls and on chunk_size, not on
+n_samples. Batch (block, i) draws from SeedSequence(seed, spawn_key=(block, i)), so a run is
+reproduced by its seed whatever the number of workers.
+'''
+import os
+import sys
+import time
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+import predictor_core
+from predictor_core import (input_names, failure_mode_names, registry, build_features, predict_features,
+                            set_inference_precision)
+from profiling import profiler
+
+
+# value range of the quantile histograms (strength in V/(Ag fc), drift in %), values outside it are
+# counted in an underflow or overflow bucket and reported as the range limit
+sketch_ranges = {'strength': (1e-3, 10.0), 'deformation': (1e-2, 100.0)}
+numeric_inputs = [name for name in input_names if name != 'section_type']
+
+class Normal(object):
+    '''
+    nominal*(1+cov*z), or nominal+std*z when std is given, clipped to [lower, upper]
+    '''
+
+    def __init__(self, cov=None, std=None, lower=0.0, upper=np.inf):
+        if (cov is None) == (std is None):
+            raise ValueError('give either cov or std')
+        self.cov, self.std, self.lower, self.upper = cov, std, lower, upper
+
+    def sample(self, nominal, rng, n):
+        z = rng.standard_normal((len(nominal), n))
+        spread = nominal[:, None]*self.cov if self.std is None else self.std
+        return np.clip(nominal[:, None]+spread*z, self.lower, self.upper)
+
+class Lognormal(object):
+    '''
+    lognormal with mean nominal and coefficient of variation cov
+    '''
+
+    def __init__(self, cov):
+        self.cov = cov
+
+    def sample(self, nominal, rng, n):
+        sigma = np.sqrt(np.log1p(self.cov**2))
+        z = rng.standard_normal((len(nominal), n))
+        return nominal[:, None]*np.exp(sigma*z-sigma**2/2)
+
+class Uniform(object):
+    '''
+    uniform on nominal*(1-spread) .. nominal*(1+spread), or on low .. high when they are given
+    '''
+
+    def __init__(self, spread=None, low=None, high=None):
+        if (spread is None) == (low is None or high is None):
+            raise ValueError('give either spread or low and high')
+        self.spread, self.low, self.high = spread, low, high
+
+    def sample(self, nominal, rng, n):
+        u = rng.random((len(nominal), n))
+        if self.spread is None:
+            return self.low+(self.high-self.low)*u
+        return nominal[:, None]*(1+self.spread*(2*u-1))
+
+distribution_types = {'normal': Normal, 'lognormal': Lognormal, 'uniform': Uniform}
+
+def parse_distribution(text):
+    '''
+    'name=normal:0.1' (cov), 'name=lognormal:0.15' (cov), 'name=uniform:0.2' (spread) or
+    'name=uniform:0.1:0.3' (low:high) -> (name, distribution)
+    '''
+    name, _, spec = text.partition('=')
+    kind, _, parameters = spec.partition(':')
+    if name not in numeric_inputs:
+        raise ValueError('unknown input {0!r}'.format(name))
+    if kind not in distribution_types:
+        raise ValueError('unknown distribution {0!r}, expected one of {1}'.format(kind, ', '.join(distribution_types)))
+    values = [float(value) for value in parameters.split(':') if value]
+    if kind == 'uniform' and len(values) == 2:
+        return name, Uniform(low=values[0], high=values[1])
+    if len(values) != 1:
+        raise ValueError('{0}: expected {1}:<value>'.format(text, kind))
+    return name, distribution_types[kind](values[0])
+
+class QuantityStatistics(object):
+    '''
+    streaming statistics of one predicted quantity for n_walls walls: count, mean and m2 (sum of squared
+    deviations) per wall, and a histogram of log-spaced buckets of relative width 2*relative_accuracy
+    '''
+
+    def __init__(self, n_walls, value_range, relative_accuracy=0.01):
+        self.value_range = value_range
+        self.relative_accuracy = relative_accuracy
+        self.gamma  = (1+relative_accuracy)/(1-relative_accuracy)
+        self.first_key = int(np.ceil(np.log(value_range[0])/np.log(self.gamma)))
+        self.n_keys = int(np.ceil(np.log(value_range[1])/np.log(self.gamma)))-self.first_key+1
+        self.count  = np.zeros(n_walls, dtype=np.int64)
+        self.mean   = np.zeros(n_walls)
+        self.m2     = np.zeros(n_walls)
+        # bucket 0: below the range, 1 .. n_keys: keys first_key .., n_keys+1: above the range
+        self.buckets = np.zeros((n_walls, self.n_keys+2), dtype=np.int64)
+
+    def bucket(self, values):
+        with np.errstate(divide='ignore', invalid='ignore'):
+            keys = np.ceil(np.log(values)/np.log(self.gamma))-self.first_key+1
+        return np.clip(np.nan_to_num(keys, nan=0, neginf=0), 0, self.n_keys+1).astype(np.intp)
+
+    def update(self, values):
+        '''
+        values: (n_walls, k) new samples of every wall
+        '''
+        n_walls, k = values.shape
+        batch_mean = values.mean(axis=1)
+        batch_m2   = ((values-batch_mean[:, None])**2).sum(axis=1)
+        self._combine(slice(None), np.full(n_walls, k), batch_mean, batch_m2)
+        flat = self.bucket(values)+(np.arange(n_walls)*(self.n_keys+2))[:, None]
+        self.buckets += np.bincount(flat.ravel(), minlength=self.buckets.size).reshape(self.buckets.shape)
+
+    def merge(self, other, rows=slice(None)):
+        '''
+        adds the statistics of other (same range and accuracy) to the walls rows of this one
+        '''
+        self._combine(rows, other.count, other.mean, other.m2)
+        self.buckets[rows] += other.buckets
+
+    def _combine(self, rows, count, mean, m2):
+        total = self.count[rows]+count
+        # pairwise update of Chan et al., exact for any split of the samples
+        weight = np.divide(count, total, out=np.zeros(len(total)), where=total > 0)
+        delta  = mean-self.mean[rows]
+        self.mean[rows] += delta*weight
+        self.m2[rows]   += m2+delta**2*self.count[rows]*weight
+        self.count[rows] = total
+
+    def std(self, ddof=1):
+        return np.sqrt(self.m2/np.maximum(self.count-ddof, 1))
+
+    def values(self):
+        # value reported for every bucket: the range limits for the outer ones, else the bucket middle
+        keys = np.arange(self.first_key, self.first_key+self.n_keys)
+        middle = 2*self.gamma**keys/(self.gamma+1)
+        return np.concatenate([[self.value_range[0]], middle, [self.value_range[1]]])
+
+    def quantiles(self, quantiles):
+        '''
+        (n_walls, len(quantiles)) quantiles, within relative_accuracy inside value_range
+        '''
+        cumulative = np.cumsum(self.buckets, axis=1)
+        ranks = np.floor(np.asarray(quantiles)[None, :]*(self.count[:, None]-1))
+        # first bucket whose cumulative count exceeds the rank of each quantile
+        index = (cumulative[:, :, None] <= ranks[:, None, :]).sum(axis=1)
+        return self.values()[np.minimum(index, self.n_keys+1)]
+
+    def cdf(self, values):
+        '''
+        (n_walls, len(values)) fraction of the samples of every wall not above each of values
+        '''
+        cumulative = np.cumsum(self.buckets, axis=1)
+        index = self.bucket(np.asarray(values, dtype=float))
+        return cumulative[:, index]/np.maximum(self.count, 1)[:, None]
+
+class MonteCarloResult(object):
+    '''
+    failure mode counts and QuantityStatistics of the strength and of the drift capacity of n_walls walls
+    '''
+
+    def __init__(self, n_walls, relative_accuracy=0.01):
+        self.failure_mode_counts = np.zeros((n_walls, len(failure_mode_names)), dtype=np.int64)
+        self.strength    = QuantityStatistics(n_walls, sketch_ranges['strength'], relative_accuracy)
+        self.deformation = QuantityStatistics(n_walls, sketch_ranges['deformation'], relative_accuracy)
+
+    @property
+    def n_samples(self):
+        return self.failure_mode_counts.sum(axis=1)
+
+    def update(self, predicted, k):
+        '''
+        predicted: predict_features records of k samples per wall, wall after wall
+        '''
+        n_walls = len(predicted)//k
+        # failure_mode_names is sorted
+        modes = np.searchsorted(failure_mode_names, predicted['failure_mode']).reshape(n_walls, k)
+        flat  = modes+(np.arange(n_walls)*len(failure_mode_names))[:, None]
+        self.failure_mode_counts += np.bincount(flat.ravel(), minlength=self.failure_mode_counts.size
+                                                ).reshape(self.failure_mode_counts.shape)
+        self.strength.update(predicted['strength'].reshape(n_walls, k))
+        self.deformation.update(predicted['deformation'].reshape(n_walls, k))
+
+    def merge(self, other, rows=slice(None)):
+        self.failure_mode_counts[rows] += other.failure_mode_counts
+        self.strength.merge(other.strength, rows)
+        self.deformation.merge(other.deformation, rows)
+
+    def failure_mode_probabilities(self):
+        '''
+        (n_walls, 4) probabilities in failure_mode_names order
+        '''
+        return self.failure_mode_counts/np.maximum(self.n_samples, 1)[:, None]
+
+    def fragility(self, demands, quantity='deformation'):
+        '''
+        (n_walls, len(demands)) probability that the capacity (drift in %, or strength) is not above each demand
+        '''
+        return getattr(self, quantity).cdf(demands)
+
+    def summary(self, quantiles=(0.05, 0.5, 0.95)):
+        '''
+        structured array: n_samples, most likely failure_mode, p_<failure mode>, then mean, std and
+        q<percent> of strength and of deformation
+        '''
+        fields = [('n_samples', np.int64), ('failure_mode', failure_mode_names.dtype)]
+        fields += [('p_'+name, float) for name in failure_mode_names]
+        for quantity in ('strength', 'deformation'):
+            fields += [(quantity+'_mean', float), (quantity+'_std', float)]
+            fields += [('{0}_q{1:g}'.format(quantity, 100*q), float) for q in quantiles]
+        summary = np.empty(len(self.failure_mode_counts), dtype=fields)
+        probabilities = self.failure_mode_probabilities()
+        summary['n_samples'] = self.n_samples
+        summary['failure_mode'] = failure_mode_names[np.argmax(probabilities, axis=1)]
+        for column, name in enumerate(failure_mode_names):
+            summary['p_'+name] = probabilities[:, column]
+        for quantity in ('strength', 'deformation'):
+            statistics = getattr(self, quantity)
+            summary[quantity+'_mean'] = statistics.mean
+            summary[quantity+'_std']  = statistics.std()
+            for column, q in enumerate(statistics.quantiles(quantiles).T):
+                summary['{0}_q{1:g}'.format(quantity, 100*quantiles[column])] = q
+        return summary
+
+def sample_walls(walls, distributions, k, rng):
+    '''
+    k samples of every wall (dict of columns keyed by input_names), wall after wall
+    '''
+    n_walls = len(walls['section_type'])
+    samples = {}
+    for name in numeric_inputs:
+        nominal = np.asarray(walls[name], dtype=float)
+        if name in distributions:
+            samples[name] = distributions[name].sample(nominal, rng, k).ravel()
+        else:
+            samples[name] = np.repeat(nominal, k)
+    samples['section_type'] = np.repeat(walls['section_type'], k)
+    return samples
+
+def simulate_block(walls, distributions, block, batches, seed, relative_accuracy=0.01):
+    '''
+    statistics of the walls of block number block over batches, a list of (batch number, k samples per wall)
+    '''
+    result = MonteCarloResult(len(walls['section_type']), relative_accuracy)
+    for batch, k in batches:
+        rng = np.random.default_rng(np.random.SeedSequence(seed, spawn_key=(block, batch)))
+        with profiler.span('monte_carlo/sample'):
+            samples = sample_walls(walls, distributions, k, rng)
+            features_np = build_features(samples, dtype=predictor_core.inference_dtype)
+        # samples never repeat: no result_cache
+        predicted = predict_features(features_np)
+        with profiler.span('monte_carlo/reduce'):
+            result.update(predicted, k)
+    return result
+
+def init_worker(precision):
+    # verified by the parent when it switched to that precision
+    set_inference_precision(precision, verify=False)
+    registry.warm_up()
+
+def run_monte_carlo(walls, distributions, n_samples=10000, seed=0, workers=1, chunk_size=1<<16,
+                    relative_accuracy=0.01, progress=None):
+    '''
+    walls:         dict of columns keyed by input_names with the nominal inputs
+    distributions: input name -> Normal/Lognormal/Uniform, the other inputs keep their nominal value
+    n_samples:     samples per wall
+    chunk_size:    rows predicted at once (samples of a block of walls)
+    workers:       processes sharing the batches, 1 runs in this process
+    progress:      optional callable(batches done, n_batches)
+    returns a MonteCarloResult
+    '''
+    for name in distributions:
+        if name not in numeric_inputs:
+            raise ValueError('unknown input {0!r}'.format(name))
+    walls   = {name: np.asarray(walls[name]).reshape(-1) for name in input_names}
+    n_walls = len(walls['section_type'])
+    result  = MonteCarloResult(n_walls, relative_accuracy)
+    if n_walls == 0:
+        return result
+    # blocks of walls, k samples of each wall per batch
+    block_size = min(n_walls, chunk_size)
+    k = max(1, chunk_size//block_size)
+    batches = [(batch, min(k, n_samples-start)) for batch, start in enumerate(range(0, n_samples, k))]
+    blocks  = [slice(first, min(first+block_size, n_walls)) for first in range(0, n_walls, block_size)]
+    # the batches of every block are split into consecutive runs, a few per worker
+    n_parts = min(len(batches), 2*workers) if workers > 1 else 1
+    rows, tasks = [], []
+    for block, block_rows in enumerate(blocks):
+        block_walls = {name: column[block_rows] for name, column in walls.items()}
+        for part in np.array_split(np.arange(len(batches)), n_parts):
+            if len(part):
+                rows.append(block_rows)
+                tasks.append((block_walls, distributions, block, [batches[i] for i in part], seed, relative_accuracy))
+
+    def merge(task_results):
+        done = 0
+        for task_rows, task, task_result in zip(rows, tasks, task_results):
+            result.merge(task_result, task_rows)
+            done += len(task[3])
+            if progress:
+                progress(done, len(batches)*len(blocks))
+
+    if workers <= 1:
+        merge(simulate_block(*task) for task in tasks)
+        return result
+    # spawned workers: a forked child of a process that already ran the library models (OpenMP) can hang
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'), initializer=init_worker,
+                             initargs=(predictor_core.inference_dtype.name,)) as executor:
+        merge(executor.map(simulate_block, *zip(*tasks)))
+    return result
+
+
+if __name__ == '__main__':
+    import argparse
+    import csv
+    from batch_runner import read_csv_shards, parse_shard, validate
+    parser = argparse.ArgumentParser(description='Monte Carlo failure mode probabilities and strength/drift distributions of walls')
+    parser.add_argument('input', help='CSV file with the nominal wall inputs as columns')
+    parser.add_argument('output', help='CSV file of the summary of every wall')
+    parser.add_argument('--vary', action='append', default=[], metavar='NAME=KIND:PARAMETERS',
+                        help='e.g. axial_ratio=lognormal:0.15, longi_reinf=normal:0.1, capacity_ratio=uniform:0.2')
+    parser.add_argument('--samples', type=int, default=10000, help='samples per wall')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk-size', type=int, default=1<<16, help='rows predicted at once')
+    parser.add_argument('--quantile', type=float, action='append', help='quantiles of the summary (default 0.05, 0.5, 0.95)')
+    parser.add_argument('--precision', default='float64', choices=['float64', 'float32'])
+    args = parser.parse_args()
+    try:
+        distributions = dict(parse_distribution(text) for text in args.vary)
+        set_inference_precision(args.precision)
+    except ValueError as e:
+        sys.exit(str(e))
+    if not distributions:
+        sys.exit('no --vary: every sample would be the nominal wall')
+    columns = {}
+    for _, header, shard in read_csv_shards(args.input, 1<<30):
+        columns = parse_shard(header, shard)
+    walls, errors = validate(columns)
+    valid = np.nonzero(errors == '')[0]
+    if len(valid) < len(errors):
+        sys.stderr.write('{0} invalid rows skipped\n'.format(len(errors)-len(valid)))
+    start_time = time.time()
+    def report(done, total):
+        sys.stderr.write('\rbatch {0}/{1}, {2:.0f} s'.format(done, total, time.time()-start_time))
+    result = run_monte_carlo({name: walls[name][valid] for name in input_names}, distributions,
+                             n_samples=args.samples, seed=args.seed, workers=args.workers,
+                             chunk_size=args.chunk_size, progress=report)
+    sys.stderr.write('\n')
+    summary = result.summary(tuple(args.quantile or (0.05, 0.5, 0.95)))
+    with open(args.output, 'w', newline='') as output:
+        writer = csv.writer(output)
+        writer.writerow(['row']+list(summary.dtype.names))
+        for row, record in zip(valid, summary):
+            writer.writerow([row]+list(record.tolist()))
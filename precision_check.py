@@ -0,0 +1,127 @@
+'''
+Verification of single-precision inference against the default float64 pipeline.
+
+The reference walls are predicted twice, with the features built, scaled and evaluated in float64
+and in float32, once by the library models and once by the exported tree arrays (tree_engine), and
+the report gives the failure mode agreement rate and the largest strength and drift deviations in
+their own units (after back_from_normalized). predictor_core.set_inference_precision('float32')
+refuses single precision when one of them is outside tolerances.
+
+    python precision_check.py                   # 20000 random walls over the training range
+    python precision_check.py walls.csv         # the walls of an inventory
+
+The reference walls cover the training range of the fm scaler uniformly, plus walls on the edges of
+that range, where the float32 rounding of the inputs is largest.
+'''
+import sys
+import numpy as np
+import predictor_core
+from predictor_core import (input_names, feature_names, section_type_list, registry, build_features,
+                            predict_features)
+
+
+# smallest failure mode agreement rate, largest strength/drift deviation relative to the float64 value;
+# an input rounded across a split threshold moves a wall by one tree step (up to about 1% was seen in
+# 10**6 random walls, roughly one wall in 10**5), everywhere else the deviation stays around 1e-6
+tolerances = {'failure_mode_agreement': 0.999, 'strength': 0.02, 'deformation': 0.02}
+
+def reference_walls(n_walls=20000, seed=0):
+    '''
+    random walls uniform over the training range of the inputs, the first ones on its corners
+    returns a dict of columns keyed by input_names
+    '''
+    rng = np.random.RandomState(seed)
+    scaler = registry.get('fm_scaler')
+    # the fm scaler maps the training range of every input to [0, 1]
+    scale, offset = scaler['x_scale'][:len(feature_names)], scaler['x_offset'][:len(feature_names)]
+    normalized = rng.uniform(0, 1, size=(n_walls, len(feature_names)))
+    n_edges = min(n_walls//10, 1<<len(feature_names))
+    normalized[:n_edges] = rng.randint(0, 2, size=(n_edges, len(feature_names)))
+    values = (normalized-offset)/scale
+    walls = {name: values[:, i] for i, name in enumerate(feature_names)}
+    walls['section_type'] = np.array(section_type_list)[rng.randint(len(section_type_list), size=n_walls)]
+    return walls
+
+def deviation(reference, candidate):
+    '''
+    largest |candidate-reference| relative to max(|reference|, 1e-12)
+    '''
+    return float(np.max(np.abs(candidate-reference)/np.maximum(np.abs(reference), 1e-12), initial=0))
+
+def compare(reference, candidate):
+    '''
+    agreement rate of the failure modes and largest relative strength/drift deviation of two
+    predict_features outputs
+    '''
+    return {'failure_mode_agreement': float(np.mean(reference['failure_mode'] == candidate['failure_mode'])),
+            'strength':    deviation(reference['strength'], candidate['strength']),
+            'deformation': deviation(reference['deformation'], candidate['deformation'])}
+
+def verify_precision(walls=None, section_type=None, dtype=np.float32, tolerances=None):
+    '''
+    compares the predictions of walls (see build_features, reference_walls() by default) in dtype with
+    the float64 ones, for the library models and for the tree arrays
+    tolerances: entries overriding the module tolerances
+    returns a report: n_walls, the compare() entries of both engines (the worst one under each key),
+    failures (one message per exceeded tolerance) and passed
+    '''
+    tolerances = dict(globals()['tolerances'], **(tolerances or {}))
+    if walls is None:
+        walls = reference_walls()
+    features_64 = build_features(walls, section_type=section_type)
+    features_32 = build_features(walls, section_type=section_type, dtype=dtype)
+    report = {'n_walls': len(features_64), 'engines': {}}
+    use_library_models = predictor_core.use_library_models
+    try:
+        # the library models are used above native_batch_limit, the tree arrays up to it
+        for engine, library in (('library', use_library_models), ('tree_arrays', False)):
+            predictor_core.use_library_models = library
+            report['engines'][engine] = compare(predict_features(features_64), predict_features(features_32))
+    finally:
+        predictor_core.use_library_models = use_library_models
+    results = report['engines'].values()
+    report['failure_mode_agreement'] = min(result['failure_mode_agreement'] for result in results)
+    report['strength']    = max(result['strength'] for result in results)
+    report['deformation'] = max(result['deformation'] for result in results)
+    report['failures'] = []
+    if report['failure_mode_agreement'] < tolerances['failure_mode_agreement']:
+        report['failures'].append('failure mode agreement {0:.4%} below {1:.4%}'.format(
+                                  report['failure_mode_agreement'], tolerances['failure_mode_agreement']))
+    for name in ('strength', 'deformation'):
+        if report[name] > tolerances[name]:
+            report['failures'].append('{0} deviation {1:.2e} above {2:.2e}'.format(name, report[name], tolerances[name]))
+    report['passed'] = not report['failures']
+    return report
+
+
+if __name__ == '__main__':
+    import argparse
+    from batch_runner import read_csv_shards, parse_shard, validate
+    parser = argparse.ArgumentParser(description='compare float32 with float64 predictions of reference walls')
+    parser.add_argument('input', nargs='?', help='CSV file with the wall inputs as columns (random walls by default)')
+    parser.add_argument('--walls', type=int, default=20000, help='number of random walls')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tolerance', action='append', default=[], metavar='NAME=VALUE',
+                        help='override one of {0}'.format(', '.join(sorted(tolerances))))
+    args = parser.parse_args()
+    overrides = {}
+    for text in args.tolerance:
+        name, value = text.split('=', 1)
+        if name not in tolerances:
+            parser.error('unknown tolerance {0!r}'.format(name))
+        overrides[name] = float(value)
+    if args.input:
+        columns = {}
+        for _, header, shard in read_csv_shards(args.input, 1<<30):
+            columns = parse_shard(header, shard)
+        walls, errors = validate(columns)
+        valid = errors == ''
+        walls = {name: walls[name][valid] for name in input_names}
+    else:
+        walls = reference_walls(args.walls, args.seed)
+    report = verify_precision(walls, tolerances=overrides)
+    for engine, result in report['engines'].items():
+        print('{0:12s} failure mode agreement {1:.4%}, strength deviation {2:.2e}, drift deviation {3:.2e}'.format(
+              engine, result['failure_mode_agreement'], result['strength'], result['deformation']))
+    print('passed' if report['passed'] else 'failed: '+'; '.join(report['failures']))
+    sys.exit(0 if report['passed'] else 1)
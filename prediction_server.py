@@ -0,0 +1,263 @@
+'''
+Local HTTP/JSON prediction service.
+
+Concurrent requests are queued and coalesced into one predict_batch call (one batched predict per
+model): a batch is flushed as soon as it holds max_batch walls or max_wait_ms after its first wall
+arrived, whichever comes first. Predictions run in a worker thread, so the next batch keeps filling
+while the current one is being predicted.
+
+    python prediction_server.py --port 8765 --max-batch 256 --max-wait-ms 2
+
+    POST /predict   {"shear_span": 1.5, ..., "section_type": "Rectangular"}
+                    or {"walls": [{...}, {...}]}
+                    -> {"predictions": [{"failure_mode": "Flexure", "strength": ..., "deformation": ...}]}
+    GET  /stats     request latency and batch size histograms
+    GET  /health
+'''
+import sys
+import json
+import time
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from predictor_core import input_names, section_type_list, predict_batch, result_cache
+from model_registry import registry
+from profiling import Histogram
+
+
+max_body_size = 1<<20
+
+class MicroBatcher(object):
+    '''
+    coalesces the walls of concurrent requests into batches of at most max_batch walls
+    '''
+
+    def __init__(self, max_batch=256, max_wait_ms=2.0):
+        self.max_batch  = max_batch
+        self.max_wait   = max_wait_ms/1000
+        self.queue      = asyncio.Queue()
+        self.executor   = ThreadPoolExecutor(1)
+        self.batch_size = Histogram(1, 2, 20)       # walls per batch
+        self.queue_time = Histogram(1e-5, 1.25, 64) # seconds from arrival to the start of its batch
+        self.predict_time = Histogram(1e-5, 1.25, 64)
+
+    async def predict(self, walls):
+        '''
+        walls: dict of input columns, returns the structured array of predict_batch
+        '''
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((walls, future, time.perf_counter()))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            requests = [await self.queue.get()]
+            n_walls  = len(requests[0][0]['section_type'])
+            deadline = loop.time()+self.max_wait
+            while n_walls < self.max_batch:
+                timeout = deadline-loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    request = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                requests.append(request)
+                n_walls += len(request[0]['section_type'])
+            start_time = time.perf_counter()
+            for walls, future, arrival_time in requests:
+                self.queue_time.add(start_time-arrival_time)
+            self.batch_size.add(n_walls)
+            await self._predict(loop, requests)
+            self.predict_time.add(time.perf_counter()-start_time)
+
+    async def _predict(self, loop, requests):
+        columns = {name: np.concatenate([walls[name] for walls, _, _ in requests]) for name in input_names}
+        try:
+            predicted = await loop.run_in_executor(self.executor, predict_batch, columns)
+        except Exception:
+            # predict the requests one by one so that only the offending one fails
+            for walls, future, _ in requests:
+                try:
+                    result = await loop.run_in_executor(self.executor, predict_batch, walls)
+                except Exception as e:
+                    result = e
+                _resolve(future, result)
+            return
+        start = 0
+        for walls, future, _ in requests:
+            stop = start+len(walls['section_type'])
+            _resolve(future, predicted[start:stop])
+            start = stop
+
+    def stats(self):
+        return {'queued': self.queue.qsize(),
+                'batch_size': self.batch_size.summary(),
+                'queue_seconds': self.queue_time.summary(),
+                'predict_seconds': self.predict_time.summary()}
+
+def _resolve(future, result):
+    # the client may have gone away and its future been cancelled
+    if future.done():
+        return
+    if isinstance(result, Exception):
+        future.set_exception(result)
+    else:
+        future.set_result(result)
+
+def parse_walls(payload):
+    '''
+    dict of input columns from one wall object or {"walls": [...]}, raises ValueError on invalid input
+    '''
+    walls = payload.get('walls', [payload]) if isinstance(payload, dict) else payload
+    if not isinstance(walls, list) or not walls or not all(isinstance(wall, dict) for wall in walls):
+        raise ValueError('expected a wall object or {"walls": [wall objects]}')
+    columns = {}
+    for name in input_names:
+        missing = [i for i, wall in enumerate(walls) if name not in wall]
+        if missing:
+            raise ValueError('wall {0}: missing {1}'.format(missing[0], name))
+        values = [wall[name] for wall in walls]
+        if name == 'section_type':
+            unknown = [value for value in values if value not in section_type_list]
+            if unknown:
+                raise ValueError('unknown section_type {0!r}'.format(unknown[0]))
+            columns[name] = np.array(values)
+            continue
+        if not all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values):
+            raise ValueError('{0} must be a number'.format(name))
+        columns[name] = np.array(values, dtype=float)
+        if not np.all(np.isfinite(columns[name])):
+            raise ValueError('{0} must be finite'.format(name))
+    for name in ('shear_span', 'width_to_thick'):
+        if not np.all(columns[name] > 0):
+            raise ValueError('{0} must be positive'.format(name))
+    return columns
+
+class PredictionServer(object):
+
+    def __init__(self, batcher):
+        self.batcher    = batcher
+        self.latency    = {'/predict': Histogram(1e-5, 1.25, 64)}
+        self.n_requests = {}
+        self.start_time = time.time()
+
+    async def handle(self, method, path, body):
+        '''
+        returns (status, JSON-serializable response)
+        '''
+        if path == '/predict':
+            if method != 'POST':
+                return 405, {'error': 'use POST'}
+            try:
+                walls = parse_walls(json.loads(body.decode('utf-8')))
+            except ValueError as e:
+                return 400, {'error': str(e)}
+            predicted = await self.batcher.predict(walls)
+            return 200, {'predictions': [{'failure_mode': str(failure_mode), 'strength': float(strength),
+                                          'deformation': float(deformation)}
+                                         for failure_mode, strength, deformation in predicted.tolist()]}
+        if path == '/stats' and method == 'GET':
+            return 200, self.stats()
+        if path == '/health' and method == 'GET':
+            return 200, {'status': 'ok'}
+        return 404, {'error': 'not found'}
+
+    def stats(self):
+        stats = {'uptime_seconds': time.time()-self.start_time, 'requests': dict(self.n_requests),
+                 'latency_seconds': {path: histogram.summary() for path, histogram in self.latency.items()}}
+        stats.update(self.batcher.stats())
+        stats['cache'] = result_cache.stats()
+        return stats
+
+    async def serve_connection(self, reader, writer):
+        '''
+        minimal HTTP/1.1 with keep-alive, one request at a time per connection
+        '''
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                start_time = time.perf_counter()
+                try:
+                    method, path, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await _respond(writer, 400, {'error': 'malformed request line'}, False)
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                connection = headers.get('connection', '').lower()
+                keep_alive = connection == 'keep-alive' or (version == 'HTTP/1.1' and connection != 'close')
+                try:
+                    length = int(headers.get('content-length', 0) or 0)
+                except ValueError:
+                    length = -1
+                if length < 0:
+                    await _respond(writer, 400, {'error': 'bad content-length'}, False)
+                    break
+                if length > max_body_size:
+                    await _respond(writer, 413, {'error': 'request body too large'}, False)
+                    break
+                body = await reader.readexactly(length) if length else b''
+                path = path.split('?', 1)[0]
+                try:
+                    status, response = await self.handle(method, path, body)
+                except Exception as e:
+                    status, response = 500, {'error': '{0}: {1}'.format(type(e).__name__, e)}
+                await _respond(writer, status, response, keep_alive)
+                self.n_requests[path] = self.n_requests.get(path, 0)+1
+                if path in self.latency and status == 200:
+                    self.latency[path].add(time.perf_counter()-start_time)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+async def _respond(writer, status, response, keep_alive):
+    body = json.dumps(response).encode('utf-8')
+    header = ('HTTP/1.1 {0} {1}\r\nContent-Type: application/json\r\nContent-Length: {2}\r\n'
+              'Connection: {3}\r\n\r\n').format(status, reasons[status], len(body), 'keep-alive' if keep_alive else 'close')
+    writer.write(header.encode('latin-1')+body)
+    await writer.drain()
+
+async def serve(host='127.0.0.1', port=8765, max_batch=256, max_wait_ms=2.0, cache_path=None):
+    if cache_path:
+        result_cache.set_sqlite_path(cache_path)
+    registry.warm_up()
+    batcher = MicroBatcher(max_batch, max_wait_ms)
+    server  = PredictionServer(batcher)
+    batch_task = asyncio.ensure_future(batcher.run())
+    tcp_server = await asyncio.start_server(server.serve_connection, host, port)
+    sys.stderr.write('serving on http://{0}:{1}\n'.format(host, port))
+    try:
+        async with tcp_server:
+            await tcp_server.serve_forever()
+    finally:
+        batch_task.cancel()
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='serve wall predictions over HTTP/JSON')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--max-batch', type=int, default=256, help='walls per batched predict')
+    parser.add_argument('--max-wait-ms', type=float, default=2.0, help='longest a wall waits for its batch to fill')
+    parser.add_argument('--cache', default=None, help='SQLite file caching the predictions of repeated designs across runs')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.max_batch, args.max_wait_ms, args.cache))
+    except KeyboardInterrupt:
+        pass
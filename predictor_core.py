@@ -0,0 +1,369 @@
+'''
+Prediction core of the GUI: features, models and scalers, without any Qt or matplotlib import.
+
+    from predictor_core import predictor_strength, predict_batch
+
+numpy is the only heavy import, the pickled models (joblib, scikit-learn, xgboost) are only
+imported when a batch is large enough to need them, see tree_model. import_budget.py keeps track
+of the import time of this module.
+'''
+import os
+import weakref
+import numpy as np
+from model_registry import registry
+from scaler_compiler import load_scaler
+from tree_engine import TreeEnsemble, load_tree_ensemble, artifact_path
+from result_cache import ResultCache
+import model_bundle
+from profiling import profiler
+
+
+# directory of the models, scalers and crack patterns
+model_dir = os.path.dirname(os.path.abspath(__file__))
+
+# wall inputs in the order of the predictor_* arguments
+input_names = ['capacity_ratio', 'shear_span', 'axial_ratio', 'longi_reinf', 'hoop_reinf',
+               'width_to_thick', 'web_hor_reinf', 'web_ver_reinf', 'Ab_Ag', 'section_type']
+# numerical feature columns in the order the models were trained on (followed by the section one-hot code)
+feature_names = ['shear_span', 'width_to_thick', 'web_ver_reinf', 'web_hor_reinf', 'longi_reinf', 'hoop_reinf',
+                 'axial_ratio', 'Ab_Ag', 'capacity_ratio']
+# one-hot lookup table, rows follow section_type_list, columns are B F R
+section_type_list  = ['Barbell', 'Flange', 'Rectangular']
+section_hot_code   = np.eye(len(section_type_list))
+failure_mode_names = np.array(['Flexure', 'Flexure-Shear', 'Shear', 'Sliding'])
+# columns of the shared feature matrix used by the strength and deformation models (no capacity_ratio)
+xy_columns = [0, 1, 2, 3, 4, 5, 6, 7, 9, 10, 11]
+
+prediction_dtype = np.dtype([('failure_mode', failure_mode_names.dtype), ('strength', float), ('deformation', float)])
+
+def section_type_to_hot_code(section_type):
+    if section_type == 'Rectangular':
+        #               B  F  R
+        section_list = [0, 0, 1]
+    if section_type == 'Barbell':
+        #               B  F  R
+        section_list = [1, 0, 0]
+    if section_type == 'Flange':
+        #               B  F  R
+        section_list = [0, 1, 0]
+    return section_list
+
+def section_type_to_hot_codes(section_type):
+    '''
+    vectorized one-hot encoding of an array of section type strings -> (n, 3) array
+    '''
+    section_type = np.asarray(section_type).reshape(-1)
+    types, inverse = np.unique(section_type, return_inverse=True)
+    rows = np.empty(len(types), dtype=int)
+    for i, t in enumerate(types):
+        if t not in section_type_list:
+            raise ValueError('unknown section type: {0!r}'.format(t))
+        rows[i] = section_type_list.index(t)
+    return section_hot_code[rows[inverse]]
+
+def build_features(walls, section_type=None, dtype=float):
+    '''
+    walls: dict of columns (or structured array) keyed by input_names, or a (n, 9) array whose
+           columns follow input_names without section_type, in which case section_type is given separately
+    returns the (n, 12) feature matrix shared by the three models, of dtype
+    '''
+    if isinstance(walls, np.ndarray) and walls.dtype.names is None:
+        walls = np.atleast_2d(np.asarray(walls, dtype=dtype))
+        if walls.shape[1] != len(input_names)-1:
+            raise ValueError('expected {0} columns, got {1}'.format(len(input_names)-1, walls.shape[1]))
+        numeric = walls[:, [input_names.index(n) for n in feature_names]]
+    else:
+        if section_type is None:
+            section_type = walls['section_type']
+        numeric = np.column_stack([np.asarray(walls[n], dtype=dtype).reshape(-1) for n in feature_names])
+    if section_type is None:
+        raise ValueError('section_type is required')
+    section_codes = section_type_to_hot_codes(section_type).astype(dtype, copy=False)
+    if len(section_codes) == 1 and len(numeric) > 1:
+        section_codes = np.repeat(section_codes, len(numeric), axis=0)
+    if len(section_codes) != len(numeric):
+        raise ValueError('section_type has {0} entries for {1} walls'.format(len(section_codes), len(numeric)))
+    return np.hstack([numeric, section_codes])
+
+def normalize(original_data, mean, var, min_data, max_data):
+    normalized_standard = np.true_divide((original_data-mean), np.sqrt(var))
+    normalized_min_max  = np.true_divide((normalized_standard-min_data), (max_data-min_data))
+    return normalized_min_max
+
+def back_from_normalized(normalized_data, mean, var, min_data, max_data):
+    back_from_min_max = normalized_data*(max_data-min_data)+min_data
+    back_from_standard = back_from_min_max*np.sqrt(var)+mean
+    return back_from_standard
+
+def scale_features(features_np, scaler):
+    '''
+    features*x_scale+x_offset of a compiled scaler, in the precision of features_np
+    '''
+    return features_np*scaler['x_scale'].astype(features_np.dtype)+scaler['x_offset'].astype(features_np.dtype)
+
+def load_pickle(path):
+    # joblib (and with it scikit-learn/xgboost) is only imported when a pickled model is first needed
+    import joblib
+    return joblib.load(path)
+
+# models and scalers are loaded once per process and reloaded only when their file changes
+registry.register('fm_model', model_dir+'/fm_xgboost.pkl', load_pickle)
+registry.register('strength_model', model_dir+'/strength_gb.pkl', load_pickle)
+registry.register('deformation_model', model_dir+'/deformation_rf.pkl', load_pickle)
+registry.register('fm_trees', artifact_path(model_dir, 'fm_xgboost.pkl'), load_tree_ensemble)
+registry.register('strength_trees', artifact_path(model_dir, 'strength_gb.pkl'), load_tree_ensemble)
+registry.register('deformation_trees', artifact_path(model_dir, 'deformation_rf.pkl'), load_tree_ensemble)
+registry.register('fm_scaler', model_dir+'/Scaler_fm.txt', load_scaler)
+registry.register('strength_scaler', model_dir+'/Scaler_strength.txt', load_scaler)
+registry.register('deformation_scaler', model_dir+'/Scaler_deformation.txt', load_scaler)
+# the tree arrays and scalers memory-mapped from one file shared by all processes, see model_bundle.py
+bundle_path = os.environ.get('WALL_MODEL_BUNDLE') or os.path.join(model_dir, model_bundle.default_name)
+if os.path.exists(bundle_path):
+    for name in model_bundle.bundle_groups:
+        source_loader = load_tree_ensemble if name.endswith('_trees') else load_scaler
+        registry.register(name, bundle_path, model_bundle.bundle_loader(name, source_loader),
+                          sources=[model_bundle.source_path(bundle_path, name)])
+
+# largest batch for which the exported tree arrays beat the library predict (measured on one core)
+native_batch_limit = {'fm': 4, 'strength': 8, 'deformation': 128}
+# WALL_LIBRARY_MODELS=0: never unpickle the library models, e.g. in server workers sharing the bundle
+use_library_models = os.environ.get('WALL_LIBRARY_MODELS', '1') != '0'
+# precision of the features built by predict_batch and predict_batch_uncertainty, see set_inference_precision
+inference_dtype = np.dtype(np.float64)
+# float32 copies of the tree arrays, dropped with the float64 ensemble they were made from
+_float32_ensembles = weakref.WeakKeyDictionary()
+
+def tree_model(name, n_rows, dtype=np.float64):
+    '''
+    the exported tree arrays (tree_engine) for small batches or when the pickled model cannot be loaded,
+    the library model otherwise; dtype float32 gives the float32 copy of the tree arrays (the library
+    models evaluate float32 inputs as they are)
+    '''
+    if use_library_models and n_rows > native_batch_limit[name] and os.path.exists(registry.path(name+'_model')):
+        try:
+            return registry.get(name+'_model')
+        except ImportError:
+            pass
+    ensemble = registry.get(name+'_trees')
+    if np.dtype(dtype) != np.float32:
+        return ensemble
+    single = _float32_ensembles.get(ensemble)
+    if single is None:
+        single = _float32_ensembles[ensemble] = ensemble.astype(np.float32)
+    return single
+
+def precision_tag():
+    # appended to the cache fingerprint, empty for the default precision
+    return '' if inference_dtype == np.float64 else '/'+inference_dtype.name
+
+def set_inference_precision(precision, verify=True, walls=None, section_type=None, tolerances=None):
+    '''
+    'float32' builds, scales and evaluates the features of predict_batch and predict_batch_uncertainty
+    in single precision, 'float64' (the default) restores double precision
+    float32 is only enabled once precision_check.verify_precision finds the float32 predictions of the
+    reference walls (walls, section_type: see build_features, random walls over the training range by
+    default) within its tolerances (entries of tolerances override them), ValueError otherwise;
+    verify=False skips the check (e.g. in workers of a process that already passed it)
+    returns the report of the check, None when there was none
+    '''
+    global inference_dtype
+    dtype = np.dtype(precision)
+    if dtype not in (np.float32, np.float64):
+        raise ValueError('unsupported inference precision {0}'.format(precision))
+    report = None
+    if dtype == np.float32 and verify:
+        import precision_check
+        report = precision_check.verify_precision(walls, section_type, tolerances=tolerances)
+        if not report['passed']:
+            raise ValueError('float32 inference not enabled: '+'; '.join(report['failures']))
+    inference_dtype = dtype
+    return report
+
+@profiler.timed('predict/fm')
+def predict_fm_features(features_np):
+    '''
+    failure mode names for a (n, 12) feature matrix from build_features
+    '''
+    scaler_fm = registry.get('fm_scaler')
+    features_normalized = scale_features(features_np, scaler_fm)
+
+    fm_predictor = tree_model('fm', len(features_np), features_np.dtype)
+    fm_predicted = fm_predictor.predict(features_normalized)
+    return failure_mode_names[np.asarray(fm_predicted).astype(int)-1]
+
+@profiler.timed('predict/strength')
+def predict_strength_features(features_np):
+    scaler = registry.get('strength_scaler')
+    features_normalized = scale_features(features_np[:, xy_columns], scaler)
+
+    strength_predictor = tree_model('strength', len(features_np), features_np.dtype)
+    strength_predicted = strength_predictor.predict(features_normalized)
+    return strength_predicted*scaler['y_scale']+scaler['y_offset']
+
+@profiler.timed('predict/deformation')
+def predict_deformation_features(features_np):
+    scaler = registry.get('deformation_scaler')
+    features_normalized = scale_features(features_np[:, xy_columns], scaler)
+
+    deformation_predictor = tree_model('deformation', len(features_np), features_np.dtype)
+    deformation_predicted = deformation_predictor.predict(features_normalized)
+    return deformation_predicted*scaler['y_scale']+scaler['y_offset']
+
+def predict_features(features_np):
+    profiler.count('walls_predicted', len(features_np))
+    predicted = np.empty(len(features_np), dtype=prediction_dtype)
+    predicted['failure_mode'] = predict_fm_features(features_np)
+    predicted['strength']     = predict_strength_features(features_np)
+    predicted['deformation']  = predict_deformation_features(features_np)
+    return predicted
+
+def row_chunks(n_rows, n_trees, max_bytes=32<<20):
+    '''
+    row slices for which the (rows, n_trees) float64 per-tree outputs stay within max_bytes
+    '''
+    rows = max(1, max_bytes//(8*n_trees))
+    return [slice(start, min(start+rows, n_rows)) for start in range(0, n_rows, rows)]
+
+# leaf value of every node of every tree of a scikit-learn forest, built once per loaded model
+_leaf_value_tables = weakref.WeakKeyDictionary()
+
+def tree_outputs(name, features_normalized):
+    '''
+    (n, n_trees) output of every tree of the random forest name (normalized units): from the tree
+    arrays for small batches, from the leaf indices of the library's apply() otherwise
+    '''
+    model = tree_model(name, len(features_normalized), features_normalized.dtype)
+    if isinstance(model, TreeEnsemble):
+        return model.predict_trees(features_normalized)
+    table = _leaf_value_tables.get(model)
+    if table is None:
+        estimators = model.estimators_
+        table = np.zeros((len(estimators), max(estimator.tree_.node_count for estimator in estimators)))
+        for i, estimator in enumerate(estimators):
+            table[i, :estimator.tree_.node_count] = estimator.tree_.value[:, 0, 0]
+        _leaf_value_tables[model] = table
+    return table[np.arange(len(table)), model.apply(features_normalized)]
+
+@profiler.timed('predict/deformation_spread')
+def predict_deformation_spread(features_np, quantiles=(0.05, 0.5, 0.95), max_bytes=32<<20):
+    '''
+    spread of the random forest drift prediction over its trees for a (n, 12) feature matrix
+    returns (mean, std, (n, len(quantiles)) quantiles), all in drift units: the tree outputs are
+    mapped back through the linear scaler, so the mean equals predict_deformation_features
+    '''
+    scaler = registry.get('deformation_scaler')
+    features_normalized = scale_features(features_np[:, xy_columns], scaler)
+    n_trees = registry.get('deformation_trees').n_trees
+    mean = np.empty(len(features_np))
+    std  = np.empty(len(features_np))
+    quantile_values = np.empty((len(features_np), len(quantiles)))
+    for rows in row_chunks(len(features_np), n_trees, max_bytes):
+        tree_values = tree_outputs('deformation', features_normalized[rows])*scaler['y_scale']+scaler['y_offset']
+        mean[rows] = tree_values.mean(axis=1)
+        std[rows]  = tree_values.std(axis=1)
+        quantile_values[rows] = np.quantile(tree_values, quantiles, axis=1).T
+    return mean, std, quantile_values
+
+@profiler.timed('predict/fm_proba')
+def predict_fm_proba_features(features_np, max_bytes=32<<20):
+    '''
+    (n, 4) probabilities of the failure modes in failure_mode_names order
+    '''
+    scaler_fm = registry.get('fm_scaler')
+    features_normalized = scale_features(features_np, scaler_fm)
+    n_trees = registry.get('fm_trees').n_trees
+    probabilities = np.zeros((len(features_np), len(failure_mode_names)))
+    for rows in row_chunks(len(features_np), n_trees, max_bytes):
+        fm_predictor = tree_model('fm', rows.stop-rows.start, features_np.dtype)
+        # classes are numbered from 1 in failure_mode_names order
+        columns = np.asarray(fm_predictor.classes_).astype(int)-1
+        probabilities[rows, columns] = fm_predictor.predict_proba(features_normalized[rows])
+    return probabilities
+
+def uncertainty_dtype(quantiles):
+    fields = [('failure_mode', failure_mode_names.dtype)]
+    fields += [('p_'+name, float) for name in failure_mode_names]
+    fields += [('deformation', float), ('deformation_std', float)]
+    fields += [('deformation_q{0:g}'.format(100*q), float) for q in quantiles]
+    return np.dtype(fields)
+
+def predict_batch_uncertainty(walls, section_type=None, quantiles=(0.05, 0.5, 0.95), max_bytes=32<<20):
+    '''
+    failure mode probabilities and drift spread of many walls (walls, section_type: see build_features)
+    returns a structured array with fields failure_mode, p_<failure mode>, deformation (the forest mean),
+    deformation_std and deformation_q<percent> for each of quantiles
+    max_bytes: bound of the per-tree working arrays, the rows are processed in chunks below it
+    '''
+    with profiler.span('build_features'):
+        features_np = build_features(walls, section_type=section_type, dtype=inference_dtype)
+    predicted = np.empty(len(features_np), dtype=uncertainty_dtype(quantiles))
+    probabilities = predict_fm_proba_features(features_np, max_bytes)
+    predicted['failure_mode'] = failure_mode_names[np.argmax(probabilities, axis=1)]
+    for column, name in enumerate(failure_mode_names):
+        predicted['p_'+name] = probabilities[:, column]
+    mean, std, quantile_values = predict_deformation_spread(features_np, quantiles, max_bytes)
+    predicted['deformation']     = mean
+    predicted['deformation_std'] = std
+    for column, q in enumerate(quantiles):
+        predicted['deformation_q{0:g}'.format(100*q)] = quantile_values[:, column]
+    return predicted
+
+# artifacts the predictions depend on (crack_store registers the crack patterns in the same registry)
+model_artifacts = registry.names()
+
+# repeated designs are answered from memory (and from the SQLite file named by WALL_PREDICTION_CACHE),
+# entries are dropped as soon as a model or scaler file changes or the inference precision is switched
+result_cache = ResultCache(prediction_dtype, sqlite_path=os.environ.get('WALL_PREDICTION_CACHE') or None,
+                           fingerprint=lambda: registry.fingerprint(model_artifacts)+precision_tag())
+
+def predict_batch(walls, section_type=None, use_cache=True):
+    '''
+    predict failure mode, strength and deformation capacity of many walls in one call
+    walls, section_type: see build_features
+    use_cache: look the walls up in result_cache first (turn off for inputs that never repeat)
+    returns a structured array with fields failure_mode, strength and deformation
+    the features are computed in inference_dtype, see set_inference_precision
+    '''
+    with profiler.span('build_features'):
+        features_np = build_features(walls, section_type=section_type, dtype=inference_dtype)
+    if use_cache:
+        return result_cache.predict(features_np, predict_features)
+    return predict_features(features_np)
+
+def predictor_fm(capacity_ratio, shear_span, axial_ratio, longi_reinf, hoop_reinf,
+                width_to_thick, web_hor_reinf, web_ver_reinf, Ab_Ag, section_type):
+    
+    features_list = [shear_span, width_to_thick, web_ver_reinf, web_hor_reinf, longi_reinf, hoop_reinf,
+                    axial_ratio, Ab_Ag, capacity_ratio]
+    section_list  = section_type_to_hot_code(section_type)
+    features_list = features_list + section_list
+    features_np   = np.array(features_list)
+
+    fm_name = predict_fm_features(features_np.reshape(1,-1))[0]
+    return str(fm_name)
+
+def predictor_strength(shear_span, axial_ratio, longi_reinf, hoop_reinf,
+                width_to_thick, web_hor_reinf, web_ver_reinf, Ab_Ag, section_type):
+    
+    # capacity_ratio is not used by the strength model
+    features_list = [shear_span, width_to_thick, web_ver_reinf, web_hor_reinf, longi_reinf, hoop_reinf,
+                    axial_ratio, Ab_Ag, 0]
+    section_list  = section_type_to_hot_code(section_type)
+    features_list = features_list + section_list
+    features_np   = np.array(features_list)
+
+    strength = predict_strength_features(features_np.reshape(1,-1))
+    return strength[0]
+
+def predictor_deformation(shear_span, axial_ratio, longi_reinf, hoop_reinf,
+                width_to_thick, web_hor_reinf, web_ver_reinf, Ab_Ag, section_type):
+    
+    # capacity_ratio is not used by the deformation model
+    features_list = [shear_span, width_to_thick, web_ver_reinf, web_hor_reinf, longi_reinf, hoop_reinf,
+                    axial_ratio, Ab_Ag, 0]
+    section_list  = section_type_to_hot_code(section_type)
+    features_list = features_list + section_list
+    features_np   = np.array(features_list)
+
+    deformation = predict_deformation_features(features_np.reshape(1,-1))
+    return deformation[0]
@@ -0,0 +1,199 @@
+'''
+Low-overhead instrumentation of the prediction and drawing path.
+
+    with profiler.span('predict/fm'):
+        ...
+
+Every span adds its duration to a per-name log-bucket histogram and, while tracing, an event to a
+bounded buffer that dump_trace writes in the Chrome trace event format (chrome://tracing, Perfetto).
+profiler.enabled = False (or WALL_PROFILE=0 in the environment) turns every span into a no-op.
+
+    with profiler.record() as timings:      # [(name, seconds)] of the spans finished in the block
+        predict_batch(walls)
+'''
+import os
+import math
+import json
+import time
+import threading
+from collections import deque
+import numpy as np
+
+
+class Histogram(object):
+    '''
+    counts of values in log-spaced buckets: bucket i holds values up to lowest*growth**i
+    '''
+
+    def __init__(self, lowest, growth, n_buckets):
+        self.lowest     = lowest
+        self.log_growth = math.log(growth)
+        self.bounds = lowest*growth**np.arange(n_buckets)
+        self.counts = [0]*(n_buckets+1)
+        self.total  = 0.0
+        self.max    = 0.0
+
+    def add(self, value, count=1):
+        # plain Python: cheaper than numpy for a single value
+        i = 0 if value <= self.lowest else int(math.ceil(math.log(value/self.lowest)/self.log_growth))
+        self.counts[min(i, len(self.bounds))] += count
+        self.total += value*count
+        self.max    = max(self.max, value)
+
+    def quantile(self, q):
+        '''
+        upper bound of the bucket holding the q-quantile
+        '''
+        n = sum(self.counts)
+        if n == 0:
+            return None
+        i = int(np.searchsorted(np.cumsum(self.counts), q*n))
+        return float(self.bounds[i]) if i < len(self.bounds) else self.max
+
+    def summary(self):
+        n = sum(self.counts)
+        buckets = [{'le': float(bound), 'count': count}
+                   for bound, count in zip(self.bounds, self.counts) if count]
+        if self.counts[-1]:
+            buckets.append({'le': None, 'count': self.counts[-1]})
+        return {'count': n, 'mean': self.total/n if n else None, 'max': self.max,
+                'p50': self.quantile(0.5), 'p90': self.quantile(0.9), 'p99': self.quantile(0.99),
+                'buckets': buckets}
+
+def seconds_histogram():
+    # 10 us .. about 16 min
+    return Histogram(1e-5, 1.25, 84)
+
+class _Span(object):
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name     = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.profiler._finish(self.name, self.start, time.perf_counter())
+        return False
+
+class _NullSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+_null_span = _NullSpan()
+
+class Profiler(object):
+
+    def __init__(self, enabled=True, trace=True, max_events=100000):
+        self.enabled    = enabled
+        self.trace      = trace         # keep events for dump_trace
+        self.histograms = {}            # span name -> Histogram of seconds
+        self.counters   = {}
+        self._events    = deque(maxlen=max_events)
+        self._origin    = time.perf_counter()
+        self._local     = threading.local()
+        self._lock      = threading.Lock()
+
+    def span(self, name):
+        if not self.enabled:
+            return _null_span
+        return _Span(self, name)
+
+    def timed(self, name):
+        '''
+        decorator wrapping every call of a function in a span
+        '''
+        def decorator(function):
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return function(*args, **kwargs)
+            wrapper.__name__ = function.__name__
+            wrapper.__doc__  = function.__doc__
+            return wrapper
+        return decorator
+
+    def count(self, name, n=1):
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0)+n
+
+    def record(self):
+        '''
+        context manager yielding the list of (name, seconds) of the spans this thread finishes inside it
+        '''
+        return _Recorder(self)
+
+    def _finish(self, name, start, stop):
+        duration = stop-start
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = seconds_histogram()
+            histogram.add(duration)
+            if self.trace:
+                self._events.append((name, start, duration, threading.get_ident()))
+        for timings in getattr(self._local, 'recorders', ()):
+            timings.append((name, duration))
+
+    def summary(self):
+        with self._lock:
+            return {'spans': {name: histogram.summary() for name, histogram in self.histograms.items()},
+                    'counters': dict(self.counters)}
+
+    def trace_events(self):
+        '''
+        complete ("X") events in microseconds since the profiler was created
+        '''
+        with self._lock:
+            events = list(self._events)
+        pid = os.getpid()
+        return [{'name': name, 'cat': name.split('/')[0], 'ph': 'X', 'pid': pid, 'tid': tid,
+                 'ts': (start-self._origin)*1e6, 'dur': duration*1e6} for name, start, duration, tid in events]
+
+    def dump_trace(self, path):
+        with open(path, 'w') as trace:
+            json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms',
+                       'otherData': {'counters': self.summary()['counters']}}, trace)
+
+    def reset(self):
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self._events.clear()
+
+class _Recorder(object):
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+        self.timings  = []
+
+    def __enter__(self):
+        local = self.profiler._local
+        if not hasattr(local, 'recorders'):
+            local.recorders = []
+        local.recorders.append(self.timings)
+        return self.timings
+
+    def __exit__(self, *exc_info):
+        self.profiler._local.recorders.pop()
+        return False
+
+def format_timings(timings, names=None):
+    '''
+    "fm 0.31 ms | strength 0.12 ms | ..." for a status line, timings of the same name are summed
+    '''
+    totals = {}
+    for name, seconds in timings:
+        if names is None or name in names:
+            totals[name] = totals.get(name, 0.0)+seconds
+    return ' | '.join('{0} {1:.2f} ms'.format(name, seconds*1000) for name, seconds in totals.items())
+
+# shared by the core, the GUI and the batch paths of this process
+profiler = Profiler(enabled=os.environ.get('WALL_PROFILE', '1') != '0')
@@ -0,0 +1,183 @@
+'''
+Headless drawings of the walls of a project: elevation, plan and predicted crack pattern (the picture
+of the GUI) with the predicted strength and drift, one PNG, SVG or PDF page per wall.
+
+    render_reports(walls, 'reports', names=wall_ids, output_format='pdf', workers=8)
+
+    python report_renderer.py walls.csv reports --format png --workers 8 --name-column wall_id
+
+No Qt and no pyplot: every worker process owns one Agg figure with a WallRenderer (artists created
+once, only their data change from wall to wall), the outline of each section type is built once
+(wall_renderer.outline_template) and the crack patterns come from the registry, so a page costs a
+draw and an encode. The walls are cut into chunks that the workers predict and render on their own.
+'''
+import os
+import sys
+import time
+import multiprocessing
+from collections import Counter
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from predictor_core import input_names, predict_batch, registry
+from wall_renderer import WallRenderer
+from profiling import profiler
+
+
+output_formats = ('png', 'svg', 'pdf')
+page_size      = (6.4, 4.8)     # inches
+caption        = '{name}    V / (Ag fc) = {strength:.4f}    θu = {deformation:.2f} %'
+
+class ReportPage(object):
+    '''
+    one reusable figure of this process: draw the wall of a predicted record and save it
+    '''
+
+    def __init__(self, dpi=100, figsize=page_size):
+        self.figure   = Figure(figsize=figsize, dpi=dpi)
+        FigureCanvasAgg(self.figure)
+        self.renderer = WallRenderer(self.figure, blit=False)
+        # spines and ticks are invisible anyway, skip drawing them
+        self.renderer.axes.set_axis_off()
+        self.caption  = self.figure.text(0.5, 0.02, '', ha='center', va='bottom')
+
+    def save(self, path, wall, predicted, name='', output_format='png', width=1):
+        '''
+        wall: dict of the inputs of one wall, predicted: its predict_batch record
+        '''
+        with profiler.span('report/update'):
+            self.renderer.update(wall['section_type'], height=wall['shear_span']*width,
+                                 thickness=width/wall['width_to_thick'], failure_mode=str(predicted['failure_mode']),
+                                 width=width)
+            self.caption.set_text(caption.format(name=name, strength=predicted['strength'],
+                                                 deformation=predicted['deformation']))
+        with profiler.span('report/save'):
+            self.figure.savefig(path, format=output_format)
+
+# the page of this worker process, per (dpi, figsize)
+_pages = {}
+
+def report_page(dpi=100, figsize=page_size):
+    key = (dpi, tuple(figsize))
+    if key not in _pages:
+        _pages[key] = ReportPage(dpi, figsize)
+    return _pages[key]
+
+def file_name(name):
+    # wall names become file names: no directories, nothing the file systems reject
+    return ''.join(c if c.isalnum() or c in '-_.' else '_' for c in str(name)).strip('.') or '_'
+
+def file_names(names):
+    '''
+    one distinct file name per wall: walls whose names give the same file name (equal names, names
+    equal once sanitized or differing only in case) get their row index as suffix
+    '''
+    stems  = [file_name(name) for name in names]
+    counts = Counter(stem.lower() for stem in stems)
+    taken, files = set(), []
+    for row, stem in enumerate(stems):
+        if counts[stem.lower()] > 1 or stem.lower() in taken:
+            stem = '{0}_{1}'.format(stem, row)
+            while stem.lower() in taken:
+                stem += '_'
+        taken.add(stem.lower())
+        files.append(stem)
+    return files
+
+def render_chunk(walls, names, output_dir, output_format='png', predicted=None, dpi=100, figsize=page_size,
+                 files=None):
+    '''
+    renders the walls of one chunk (dict of columns keyed by input_names) into output_dir,
+    predicting them first unless predicted is given; returns the paths written
+    files: file names of the pages (without extension), file_name(name) by default
+    '''
+    if predicted is None:
+        predicted = predict_batch(walls)
+    if files is None:
+        files = [file_name(name) for name in names]
+    page  = report_page(dpi, figsize)
+    paths = []
+    for i, name in enumerate(names):
+        wall = {name_: walls[name_][i] for name_ in input_names}
+        path = os.path.join(output_dir, '{0}.{1}'.format(files[i], output_format))
+        page.save(path, wall, predicted[i], name=name, output_format=output_format)
+        paths.append(path)
+    return paths
+
+def init_worker():
+    # models, scalers and crack patterns are loaded once per worker, before its first chunk
+    registry.warm_up()
+
+def render_reports(walls, output_dir, names=None, predicted=None, output_format='png', workers=1,
+                   chunk_size=100, dpi=100, figsize=page_size, progress=None):
+    '''
+    one page per wall of walls (dict of columns keyed by input_names) in output_dir
+    names:     page titles and file names (see file_names for repeated ones), wall_00000, ... by default
+    predicted: predict_batch records of the walls, computed by the workers when None
+    workers:   processes rendering chunks of chunk_size walls, 1 renders in this process
+    progress:  optional callable(walls done, n_walls)
+    returns the paths of the pages in wall order
+    '''
+    if output_format not in output_formats:
+        raise ValueError('unknown format {0!r}, expected one of {1}'.format(output_format, output_formats))
+    walls   = {name: np.asarray(walls[name]).reshape(-1) for name in input_names}
+    n_walls = len(walls['section_type'])
+    if names is None:
+        names = ['wall_{0:05d}'.format(i) for i in range(n_walls)]
+    if len(names) != n_walls:
+        raise ValueError('{0} names for {1} walls'.format(len(names), n_walls))
+    files = file_names(names)
+    os.makedirs(output_dir, exist_ok=True)
+    chunks = [slice(start, min(start+chunk_size, n_walls)) for start in range(0, n_walls, chunk_size)]
+    def arguments(rows):
+        return ({name: column[rows] for name, column in walls.items()}, list(names[rows]), output_dir,
+                output_format, None if predicted is None else predicted[rows], dpi, figsize, files[rows])
+    paths = []
+    if workers <= 1:
+        for rows in chunks:
+            paths.extend(render_chunk(*arguments(rows)))
+            if progress:
+                progress(len(paths), n_walls)
+        return paths
+    # spawned workers: a forked child of a process that already ran the library models (OpenMP) can hang
+    with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_worker) as executor:
+        for chunk_paths in executor.map(render_chunk, *zip(*[arguments(rows) for rows in chunks])):
+            paths.extend(chunk_paths)
+            if progress:
+                progress(len(paths), n_walls)
+    return paths
+
+
+if __name__ == '__main__':
+    import argparse
+    from batch_runner import read_csv_shards, parse_shard, validate
+    parser = argparse.ArgumentParser(description='draw the wall and its predicted crack pattern for every wall of a CSV file')
+    parser.add_argument('input', help='CSV file with the wall inputs as columns')
+    parser.add_argument('output_dir')
+    parser.add_argument('--format', default='png', choices=output_formats)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunk-size', type=int, default=100, help='walls per task of a worker')
+    parser.add_argument('--dpi', type=int, default=100)
+    parser.add_argument('--name-column', help='column naming the pages (row numbers by default)')
+    args = parser.parse_args()
+    columns = {}
+    for _, header, shard in read_csv_shards(args.input, 1<<30):
+        columns = parse_shard(header, shard)
+    if args.name_column and args.name_column not in columns:
+        sys.exit('no column {0!r} in {1}'.format(args.name_column, args.input))
+    walls, errors = validate(columns)
+    valid = np.nonzero(errors == '')[0]
+    if len(valid) < len(errors):
+        sys.stderr.write('{0} invalid rows skipped\n'.format(len(errors)-len(valid)))
+    names = np.asarray(columns[args.name_column])[valid] if args.name_column else \
+            np.array(['row_{0:05d}'.format(row) for row in valid])
+    start_time = time.time()
+    def report(done, total):
+        elapsed = time.time()-start_time
+        sys.stderr.write('\r{0}/{1} walls, {2:.1f} walls/s'.format(done, total, done/max(elapsed, 1e-9)))
+    render_reports({name: walls[name][valid] for name in input_names}, args.output_dir, names=names,
+                   output_format=args.format, workers=args.workers, chunk_size=args.chunk_size, dpi=args.dpi,
+                   progress=report)
+    sys.stderr.write('\n')
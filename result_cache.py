@@ -0,0 +1,179 @@
+'''
+Memoization of the predictions of repeated wall designs.
+
+An entry is keyed on the (n, 12) feature vector of a wall, quantized to quantize_bits fewer mantissa
+bits so that inputs differing only by float noise (e.g. 0.1+0.2 and 0.3) share an entry, and it is
+only valid for the artifact fingerprint (hash of the model and scaler files) it was computed with:
+editing or retraining a .pkl or a scaler file invalidates every entry of the old fingerprint.
+
+Entries are kept in an in-memory LRU tier bounded by max_bytes and, optionally, in a SQLite file
+shared by every process and run that opens it.
+'''
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+# rough size of one in-memory entry besides its key: dict slot, tuple and float objects
+entry_overhead = 200
+
+def quantize(features, bits=12):
+    '''
+    rounds float64 features to the nearest value with the lowest bits mantissa bits cleared
+    (relative precision 2**(bits-53)) and maps -0.0 to 0.0
+    '''
+    features = np.ascontiguousarray(features, dtype=np.float64)+0.0
+    if bits <= 0:
+        return features
+    raw  = features.view(np.uint64)
+    half = np.uint64(1<<(bits-1))
+    mask = ~np.uint64((1<<bits)-1)
+    return ((raw+half) & mask).view(np.float64)
+
+def feature_keys(features, bits=12):
+    '''
+    one bytes key per row of a 2-D feature matrix
+    '''
+    quantized = np.ascontiguousarray(quantize(features, bits))
+    # fixed-width bytes: trailing zero bytes are stripped by numpy but keys stay unique
+    return quantized.view('S{0}'.format(quantized.shape[1]*8)).ravel().tolist()
+
+class ResultCache(object):
+    '''
+    dtype:       structured dtype of the predictions (failure_mode, strength, deformation)
+    fingerprint: callable returning the current artifact fingerprint (or None for a constant one)
+    sqlite_path: optional file of the shared on-disk tier
+    '''
+
+    def __init__(self, dtype, max_bytes=32<<20, sqlite_path=None, fingerprint=None, quantize_bits=12):
+        self.dtype         = dtype
+        self.max_bytes     = max_bytes
+        self.sqlite_path   = sqlite_path
+        self.fingerprint   = fingerprint or (lambda: '')
+        self.quantize_bits = quantize_bits
+        self.hits          = 0      # rows answered without inference
+        self.disk_hits     = 0      # rows answered from the SQLite tier
+        self.misses        = 0      # designs that had to be predicted
+        self._memory       = OrderedDict()  # key -> (failure_mode, strength, deformation)
+        self._bytes        = 0
+        self._current      = None   # fingerprint of the entries in memory
+        self._connection   = None
+        self._connection_pid = None
+        self._lock         = threading.RLock()
+
+    def predict(self, features, predict_features):
+        '''
+        predictions of a (n, 12) feature matrix, only the rows missing from the cache (each distinct
+        design once) are passed to predict_features, which returns a structured array of dtype
+        '''
+        keys = feature_keys(features, self.quantize_bits)
+        with self._lock:
+            self._check_fingerprint()
+            fingerprint = self._current
+            values  = [self._memory.get(key) for key in keys]
+            missing = OrderedDict()     # key -> rows of the batch
+            for i, (key, value) in enumerate(zip(keys, values)):
+                if value is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    self._memory.move_to_end(key)
+            if missing and self.sqlite_path:
+                for key, value in self._disk_lookup(list(missing)).items():
+                    rows = missing.pop(key)
+                    for i in rows:
+                        values[i] = value
+                    self.disk_hits += len(rows)
+                    self._memory_store(key, value)
+            # repeats of a new design within the batch are predicted once and count as hits
+            self.hits   += len(keys)-len(missing)
+            self.misses += len(missing)
+        if missing:
+            # predicted outside the lock, concurrent callers may predict the same new design twice
+            new_values = predict_features(features[[rows[0] for rows in missing.values()]]).tolist()
+            with self._lock:
+                if self._current == fingerprint:
+                    for key, value in zip(missing, new_values):
+                        self._memory_store(key, value)
+                    if self.sqlite_path:
+                        self._disk_store(list(missing), new_values)
+            for rows, value in zip(missing.values(), new_values):
+                for i in rows:
+                    values[i] = value
+        return np.array(values, dtype=self.dtype)
+
+    def set_sqlite_path(self, sqlite_path):
+        '''
+        switch the on-disk tier to another file (None: memory only)
+        '''
+        with self._lock:
+            if self._connection is not None and self._connection_pid == os.getpid():
+                self._connection.close()
+            self._connection  = None
+            self.sqlite_path  = sqlite_path
+            self._current     = None
+
+    def stats(self):
+        with self._lock:
+            total = self.hits+self.misses
+            return dict(hits=self.hits, disk_hits=self.disk_hits, misses=self.misses,
+                        hit_rate=self.hits/total if total else None,
+                        entries=len(self._memory), bytes=self._bytes, max_bytes=self.max_bytes)
+
+    def clear(self, disk=False):
+        with self._lock:
+            self._memory.clear()
+            self._bytes = 0
+            if disk and self.sqlite_path:
+                self._sqlite().execute('DELETE FROM results')
+                self._sqlite().commit()
+
+    def _check_fingerprint(self):
+        fingerprint = self.fingerprint()
+        if fingerprint == self._current:
+            return
+        self.clear()
+        if self.sqlite_path:
+            # drop what other versions of the artifacts predicted
+            connection = self._sqlite()
+            connection.execute('DELETE FROM results WHERE fingerprint != ?', (fingerprint,))
+            connection.commit()
+        self._current = fingerprint
+
+    def _memory_store(self, key, value):
+        if key in self._memory:
+            return
+        self._memory[key] = value
+        self._bytes += len(key)+entry_overhead
+        while self._bytes > self.max_bytes and self._memory:
+            old_key, _ = self._memory.popitem(last=False)
+            self._bytes -= len(old_key)+entry_overhead
+
+    def _sqlite(self):
+        # connections must not cross a fork (batch_runner workers)
+        if self._connection is None or self._connection_pid != os.getpid():
+            import sqlite3
+            connection = sqlite3.connect(self.sqlite_path, timeout=30, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS results (fingerprint TEXT, key BLOB, failure_mode TEXT, '
+                               'strength REAL, deformation REAL, PRIMARY KEY (fingerprint, key)) WITHOUT ROWID')
+            connection.commit()
+            self._connection, self._connection_pid = connection, os.getpid()
+        return self._connection
+
+    def _disk_lookup(self, keys, block_size=500):
+        found = {}
+        connection = self._sqlite()
+        for start in range(0, len(keys), block_size):
+            block = keys[start:start+block_size]
+            query = ('SELECT key, failure_mode, strength, deformation FROM results WHERE fingerprint = ? '
+                     'AND key IN ({0})'.format(','.join('?'*len(block))))
+            for key, failure_mode, strength, deformation in connection.execute(query, [self._current]+block):
+                found[bytes(key)] = (failure_mode, strength, deformation)
+        return found
+
+    def _disk_store(self, keys, values):
+        connection = self._sqlite()
+        connection.executemany('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+                               [(self._current, key)+tuple(value) for key, value in zip(keys, values)])
+        connection.commit()
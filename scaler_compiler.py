@@ -0,0 +1,126 @@
+'''
+Compiles the Scaler_*.txt files (StandardScaler followed by MinMaxScaler) into Scaler_*.npz artifacts
+holding one fused scale/offset pair for the features and one for the target:
+
+    normalized = features*x_scale + x_offset
+    target     = predicted*y_scale + y_offset
+
+Run "python scaler_compiler.py" after retraining a model or editing a scaler file.
+'''
+import os
+import sys
+import numpy as np
+from model_registry import file_sha1
+
+
+# scaler name -> (scaler file, model file, number of features of the model)
+scaler_list = {
+    'fm':          ('Scaler_fm.txt', 'fm_xgboost.pkl', 12),
+    'strength':    ('Scaler_strength.txt', 'strength_gb.pkl', 11),
+    'deformation': ('Scaler_deformation.txt', 'deformation_rf.pkl', 11),
+}
+
+def read_scaler_fm(scaler_path):
+    with open(scaler_path) as scaler_fm:
+        lines = scaler_fm.readlines()
+        fm_mean_np = np.array(lines[3].split(), dtype=float)
+        fm_var_np  = np.array(lines[5].split(), dtype=float)
+        fm_min_np  = np.array(lines[8].split(), dtype=float)
+        fm_max_np  = np.array(lines[10].split(), dtype=float)
+    return dict(mean=fm_mean_np, var=fm_var_np, min_data=fm_min_np, max_data=fm_max_np)
+
+def read_scaler_xy(scaler_path):
+    '''
+    returns the scaler parameters of the features (x) and of the target (y)
+    '''
+    with open(scaler_path) as scaler:
+        lines = scaler.readlines()
+        mean_x = np.array(lines[4].split(), dtype=float)
+        var_x  = np.array(lines[6].split(), dtype=float)
+        mean_y = np.array(lines[9].split(), dtype=float)
+        var_y  = np.array(lines[11].split(), dtype=float)
+        min_x  = np.array(lines[15].split(), dtype=float)
+        max_x  = np.array(lines[17].split(), dtype=float)
+        min_y  = np.array(lines[20].split(), dtype=float)
+        max_y  = np.array(lines[22].split(), dtype=float)
+    return (dict(mean=mean_x, var=var_x, min_data=min_x, max_data=max_x),
+            dict(mean=mean_y, var=var_y, min_data=min_y, max_data=max_y))
+
+def fuse_scaler(mean, var, min_data, max_data, n_columns, what):
+    for key, value in (('Variance', var), ('Minimum', min_data), ('Maximum', max_data)):
+        if len(value) != len(mean):
+            raise ValueError('{0}: {1} has {2} columns but Mean has {3}'.format(what, key, len(value), len(mean)))
+    if len(mean) != n_columns:
+        raise ValueError('{0}: scaler has {1} columns, expected {2}'.format(what, len(mean), n_columns))
+    if np.any(var <= 0) or np.any(max_data <= min_data):
+        raise ValueError('{0}: degenerate scaler column'.format(what))
+    std      = np.sqrt(var)
+    span     = max_data-min_data
+    # ((x-mean)/std-min)/(max-min) = x*scale+offset
+    scale    = 1/(std*span)
+    offset   = -(mean/std+min_data)/span
+    # (z*(max-min)+min)*std+mean = z*inverse_scale+inverse_offset
+    inverse_scale  = span*std
+    inverse_offset = min_data*std+mean
+    return scale, offset, inverse_scale, inverse_offset
+
+def compile_scaler(name, scaler_path, n_features):
+    '''
+    returns the fused arrays of one scaler file, raises ValueError when the column counts do not match
+    '''
+    what = os.path.basename(scaler_path)
+    compiled = dict(source_sha1=np.array(file_sha1(scaler_path)), n_features=np.array(n_features))
+    try:
+        if name == 'fm':
+            scaler_x, scaler_y = read_scaler_fm(scaler_path), None
+        else:
+            scaler_x, scaler_y = read_scaler_xy(scaler_path)
+    except (IndexError, ValueError) as e:
+        raise ValueError('{0}: malformed scaler file ({1})'.format(what, e))
+    compiled['x_scale'], compiled['x_offset'] = fuse_scaler(n_columns=n_features, what=what+' features', **scaler_x)[:2]
+    if scaler_y is not None:
+        compiled['y_scale'], compiled['y_offset'] = fuse_scaler(n_columns=1, what=what+' target', **scaler_y)[2:]
+    return compiled
+
+def model_n_features(model_path):
+    import joblib
+    model = joblib.load(model_path)
+    for attribute in ('n_features_in_', 'n_features_', '_features_count'):
+        if hasattr(model, attribute):
+            return int(getattr(model, attribute))
+    return None
+
+def load_scaler(scaler_path):
+    '''
+    registry loader of a Scaler_*.txt file: reads the compiled Scaler_*.npz next to it, or compiles
+    the text file in memory when the artifact is missing or was compiled from another version of it
+    '''
+    compiled_path = os.path.splitext(scaler_path)[0]+'.npz'
+    if os.path.exists(compiled_path):
+        with np.load(compiled_path) as compiled:
+            if str(compiled['source_sha1']) == file_sha1(scaler_path):
+                return {key: compiled[key] for key in compiled.files}
+    for name, (scaler_file, model_file, n_features) in scaler_list.items():
+        if os.path.basename(scaler_path) == scaler_file:
+            return compile_scaler(name, scaler_path, n_features)
+    raise ValueError('unknown scaler file {0}'.format(scaler_path))
+
+def compile_all(model_dir, check_models=True):
+    for name, (scaler_file, model_file, n_features) in scaler_list.items():
+        if check_models:
+            model_features = model_n_features(os.path.join(model_dir, model_file))
+            if model_features is not None and model_features != n_features:
+                raise ValueError('{0} expects {1} features, not {2}'.format(model_file, model_features, n_features))
+        compiled = compile_scaler(name, os.path.join(model_dir, scaler_file), n_features)
+        compiled_path = os.path.join(model_dir, os.path.splitext(scaler_file)[0]+'.npz')
+        np.savez(compiled_path, **compiled)
+        print('{0} -> {1}'.format(scaler_file, os.path.basename(compiled_path)))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='compile Scaler_*.txt into fused Scaler_*.npz artifacts')
+    parser.add_argument('--model-dir', default=sys.path[0])
+    parser.add_argument('--skip-model-check', action='store_true', help='do not unpickle the models to check their feature count')
+    args = parser.parse_args()
+    compile_all(args.model_dir, check_models=not args.skip_model_check)
@@ -0,0 +1,192 @@
+'''
+Design-space sweeps over the ten wall inputs.
+
+The Cartesian product of the input values is never built: chunk i of the grid is decoded from the
+flat indices [i*chunk_size, (i+1)*chunk_size) with np.unravel_index, predicted with predict_batch
+and written to a sink, so memory only depends on chunk_size. A CsvSink records the last completed
+chunk next to the output file and a rerun of the same sweep (same grid, precision and models) resumes
+from there.
+
+    python sweep.py sweep.csv --axis shear_span=0.5:3:26 --axis axial_ratio=0:0.3:31
+                    --axis section_type=Rectangular,Barbell,Flange --fixed capacity_ratio=1.45 ...
+'''
+import os
+import sys
+import json
+import hashlib
+import numpy as np
+import predictor_core
+from predictor_core import input_names, predict_batch, set_inference_precision, result_cache
+
+
+def axis_values(values):
+    '''
+    values: a scalar, a list/array of values, or (start, stop, num) for np.linspace
+    '''
+    if isinstance(values, tuple) and len(values) == 3 and not isinstance(values[0], str):
+        return np.linspace(values[0], values[1], int(values[2]))
+    return np.atleast_1d(np.asarray(values))
+
+class Sweep(object):
+
+    def __init__(self, axes, chunk_size=100000):
+        missing = [name for name in input_names if name not in axes]
+        if missing:
+            raise ValueError('no values given for {0}'.format(', '.join(missing)))
+        self.names      = list(input_names)
+        self.values     = [axis_values(axes[name]) for name in self.names]
+        self.shape      = tuple(len(values) for values in self.values)
+        self.size       = 1
+        for length in self.shape:
+            self.size *= length
+        self.chunk_size = int(chunk_size)
+        self.n_chunks   = -(-self.size//self.chunk_size)
+
+    def signature(self):
+        '''
+        identifies the grid, its chunking, the inference precision and the model and scaler files, a
+        sink only resumes a sweep with the same signature (edited models restart it)
+        '''
+        sha1 = hashlib.sha1(str(self.chunk_size).encode())
+        for name, values in zip(self.names, self.values):
+            sha1.update(name.encode())
+            sha1.update(np.asarray(values).astype(str).tobytes())
+        sha1.update(predictor_core.inference_dtype.name.encode())
+        sha1.update(result_cache.fingerprint().encode())
+        return sha1.hexdigest()
+
+    def chunk(self, index):
+        '''
+        columns of the grid points of chunk index, keyed by input name
+        '''
+        start = index*self.chunk_size
+        flat  = np.arange(start, min(start+self.chunk_size, self.size))
+        grid_index = np.unravel_index(flat, self.shape)
+        return {name: values[i] for name, values, i in zip(self.names, self.values, grid_index)}
+
+    def chunks(self, first=0):
+        for index in range(first, self.n_chunks):
+            yield index, self.chunk(index)
+
+def csv_lines(columns, names):
+    '''
+    text lines of a chunk, floats are written with repr precision
+    '''
+    formatted = []
+    for name in names:
+        column = np.asarray(columns[name])
+        if column.dtype.kind == 'f':
+            formatted.append([repr(value) for value in column.tolist()])
+        else:
+            formatted.append([_csv_field(str(value)) for value in column.tolist()])
+    return ''.join(','.join(row)+'\n' for row in zip(*formatted))
+
+def _csv_field(text):
+    if ',' in text or '"' in text or '\n' in text:
+        return '"'+text.replace('"', '""')+'"'
+    return text
+
+class CsvSink(object):
+    '''
+    appends the wall inputs and their predictions to a CSV file, one chunk at a time
+    progress is kept in <path>.progress as the number of completed chunks and the file size after them
+    '''
+
+    def __init__(self, path, names=None):
+        self.path          = path
+        self.progress_path = path+'.progress'
+        self.names         = names or input_names+['failure_mode', 'strength', 'deformation']
+
+    def _save_progress(self, signature, chunks, size):
+        with open(self.progress_path+'.tmp', 'w') as progress:
+            json.dump(dict(signature=signature, chunks=chunks, size=size), progress)
+        os.replace(self.progress_path+'.tmp', self.progress_path)
+
+    def start(self, signature, resume=True):
+        '''
+        returns the number of chunks already written for the sweep with this signature
+        '''
+        self.signature = signature
+        if resume and os.path.exists(self.progress_path) and os.path.exists(self.path):
+            with open(self.progress_path) as progress:
+                progress = json.load(progress)
+            if progress['signature'] == signature:
+                # drop whatever an interrupted run wrote after the last completed chunk
+                with open(self.path, 'r+b') as output:
+                    output.truncate(progress['size'])
+                self.chunks = progress['chunks']
+                return self.chunks
+        with open(self.path, 'w') as output:
+            output.write(','.join(self.names)+'\n')
+        self.chunks = 0
+        self._save_progress(signature, 0, os.path.getsize(self.path))
+        return 0
+
+    def write(self, index, columns, predicted):
+        if index != self.chunks:
+            raise ValueError('chunk {0} written after chunk {1}'.format(index, self.chunks-1))
+        columns = dict(columns)
+        for name in predicted.dtype.names:
+            columns[name] = predicted[name]
+        with open(self.path, 'a') as output:
+            output.write(csv_lines(columns, self.names))
+            output.flush()
+            os.fsync(output.fileno())
+        self.chunks += 1
+        self._save_progress(self.signature, self.chunks, os.path.getsize(self.path))
+
+    def finish(self):
+        if os.path.exists(self.progress_path):
+            os.remove(self.progress_path)
+
+def run_sweep(sweep, sink, resume=True, progress=None):
+    '''
+    predicts every chunk of the sweep into the sink (an object with start(signature, resume),
+    write(index, columns, predicted) and finish()), starting after the last chunk it already holds
+    progress: optional callable(completed_chunks, n_chunks)
+    '''
+    first = sink.start(sweep.signature(), resume=resume)
+    for index, columns in sweep.chunks(first):
+        # grid points never repeat, so result_cache is bypassed
+        sink.write(index, columns, predict_batch(columns, use_cache=False))
+        if progress is not None:
+            progress(index+1, sweep.n_chunks)
+    sink.finish()
+
+def parse_axis(text):
+    '''
+    "name=start:stop:num" (linspace) or "name=v1,v2,..."
+    '''
+    name, values = text.split('=', 1)
+    if name not in input_names:
+        raise ValueError('unknown input {0!r}'.format(name))
+    if ':' in values:
+        start, stop, num = values.split(':')
+        return name, (float(start), float(stop), int(num))
+    values = values.split(',')
+    if name != 'section_type':
+        values = [float(value) for value in values]
+    return name, values
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='predict every point of a grid of wall inputs into a CSV file')
+    parser.add_argument('output')
+    parser.add_argument('--axis', action='append', default=[], help='name=start:stop:num or name=v1,v2,...')
+    parser.add_argument('--fixed', action='append', default=[], help='name=value')
+    parser.add_argument('--chunk-size', type=int, default=100000)
+    parser.add_argument('--restart', action='store_true', help='ignore the progress of a previous run')
+    parser.add_argument('--precision', default='float64', choices=['float64', 'float32'],
+                        help='float32 is refused when precision_check finds deviations beyond its tolerances')
+    args = parser.parse_args()
+    try:
+        set_inference_precision(args.precision)
+    except ValueError as e:
+        sys.exit(str(e))
+    axes = dict(parse_axis(text) for text in args.axis+args.fixed)
+    sweep = Sweep(axes, chunk_size=args.chunk_size)
+    def report(done, total):
+        sys.stderr.write('\rchunk {0}/{1}'.format(done, total))
+    run_sweep(sweep, CsvSink(args.output), resume=not args.restart, progress=report)
+    sys.stderr.write('\n')
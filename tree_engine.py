@@ -0,0 +1,329 @@
+'''
+Array-based inference for the three tree ensembles.
+
+The random forest (deformation_rf.pkl), the gradient boosting regressor (strength_gb.pkl) and the
+XGBoost classifier (fm_xgboost.pkl) are flattened into contiguous node arrays
+
+    feature, threshold, left, right, value, cover, missing_left   (one entry per node)
+    roots, tree_group                                            (one entry per tree)
+
+and evaluated with numpy for a whole batch at once, without scikit-learn or xgboost.
+The right child of a node always follows its left child and leaves point to themselves (left = right = leaf).
+
+Run "python tree_engine.py" to export the .pkl models into .npz artifacts next to them.
+'''
+import os
+import sys
+import json
+import numpy as np
+from model_registry import file_sha1
+
+
+class TreeEnsemble(object):
+
+    def __init__(self, arrays):
+        self.feature      = arrays['feature']
+        self.threshold    = arrays['threshold']
+        self.left         = arrays['left']
+        self.right        = arrays['right']
+        self.value        = arrays['value']
+        self.cover        = arrays['cover']
+        self.missing_left = arrays['missing_left']
+        self.roots        = arrays['roots']
+        self.tree_group   = arrays['tree_group']
+        self.kind         = str(arrays['kind'])
+        self.base_score   = float(arrays['base_score'])
+        self.tree_scale   = float(arrays['tree_scale'])
+        self.max_depth    = int(arrays['max_depth'])
+        self.n_features   = int(arrays['n_features'])
+        self.classes_     = arrays['classes']
+        self.source_sha1  = str(arrays['source_sha1'])
+        self.n_trees      = len(self.roots)
+        self.n_groups     = int(self.tree_group.max())+1
+        self.is_leaf      = self.left == np.arange(len(self.left))
+        self.group_hot_code = np.eye(self.n_groups)[self.tree_group]
+        # xgboost sends a row to the left child when x < threshold, scikit-learn when x <= threshold
+        self.strict       = self.kind == 'xgboost'
+
+    def arrays(self):
+        return dict(feature=self.feature, threshold=self.threshold, left=self.left, right=self.right,
+                    value=self.value, cover=self.cover, missing_left=self.missing_left, roots=self.roots,
+                    tree_group=self.tree_group, kind=np.array(self.kind), base_score=np.array(self.base_score),
+                    tree_scale=np.array(self.tree_scale), max_depth=np.array(self.max_depth),
+                    n_features=np.array(self.n_features), classes=self.classes_,
+                    source_sha1=np.array(self.source_sha1))
+
+    def astype(self, dtype):
+        '''
+        copy with the thresholds and leaf values in dtype (np.float32 halves the node arrays read per
+        row); a rounded threshold is moved to the float32 neighbour on the side that keeps every
+        float32 input on the branch it takes with the float64 threshold, so only the leaf values change
+        '''
+        threshold = self.threshold.astype(dtype)
+        if self.strict:
+            # x >= t for float32 x  <=>  x >= the smallest float32 not below t
+            moved = threshold < self.threshold
+            threshold[moved] = np.nextafter(threshold[moved], np.inf)
+        else:
+            # x > t for float32 x  <=>  x > the largest float32 not above t
+            moved = threshold > self.threshold
+            threshold[moved] = np.nextafter(threshold[moved], -np.inf)
+        return TreeEnsemble(dict(self.arrays(), threshold=threshold, value=self.value.astype(dtype)))
+
+    def save(self, path):
+        np.savez(path, **self.arrays())
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as arrays:
+            return cls({key: arrays[key] for key in arrays.files})
+
+    def apply(self, X, max_rows=None):
+        '''
+        index of the leaf reached in every tree, shape (n, n_trees)
+        '''
+        X = np.atleast_2d(X)
+        if X.shape[1] != self.n_features:
+            raise ValueError('expected {0} features, got {1}'.format(self.n_features, X.shape[1]))
+        # both libraries evaluate the splits on float32 inputs
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        has_missing = bool(np.isnan(X).any())
+        if has_missing and not self.strict:
+            raise ValueError('Input contains NaN')
+        if max_rows is None:
+            # keep the (rows, trees) working arrays around a few hundred kB
+            max_rows = max(1, (1<<15)//self.n_trees)
+        n_rows, n_features = X.shape
+        X_flat = X.reshape(-1)
+        leaves = np.empty((n_rows, self.n_trees), dtype=np.intp)
+        leaves_flat = leaves.reshape(-1)
+        roots = self.roots.astype(np.intp)
+        for start in range(0, n_rows, max_rows):
+            stop = min(start+max_rows, n_rows)
+            # one entry per (row, tree) pair still travelling down, dropped once it reaches a leaf
+            node     = np.tile(roots, stop-start)
+            position = np.arange(start*self.n_trees, stop*self.n_trees)
+            x_start  = np.repeat(np.arange(start*n_features, stop*n_features, n_features), self.n_trees)
+            while len(node):
+                done = self.is_leaf[node]
+                if done.any():
+                    leaves_flat[position[done]] = node[done]
+                    keep     = ~done
+                    node     = node[keep]
+                    position = position[keep]
+                    x_start  = x_start[keep]
+                x = X_flat[x_start+self.feature[node]]
+                if self.strict:
+                    go_right = x >= self.threshold[node]
+                    if has_missing:
+                        go_right = np.where(np.isnan(x), ~self.missing_left[node], go_right)
+                else:
+                    go_right = x > self.threshold[node]
+                # the right child always follows the left one
+                node = self.left[node]+go_right
+        return leaves
+
+    def predict_trees(self, X):
+        '''
+        leaf value of every tree, shape (n, n_trees)
+        '''
+        return self.value[self.apply(X)]
+
+    def predict_raw(self, X):
+        '''
+        regression output, or the (n, n_classes) margins of the classifier
+        '''
+        leaf_values = self.predict_trees(X)
+        if self.kind == 'random_forest':
+            return leaf_values.mean(axis=1)
+        if self.kind == 'gradient_boosting':
+            return self.base_score+self.tree_scale*leaf_values.sum(axis=1)
+        return self.base_score+leaf_values.dot(self.group_hot_code)
+
+    def predict_proba(self, X):
+        if self.kind != 'xgboost':
+            raise TypeError('{0} is not a classifier'.format(self.kind))
+        margins = self.predict_raw(X)
+        margins = np.exp(margins-margins.max(axis=1, keepdims=True))
+        return margins/margins.sum(axis=1, keepdims=True)
+
+    def predict(self, X):
+        if self.kind == 'xgboost':
+            return self.classes_[np.argmax(self.predict_raw(X), axis=1)]
+        return self.predict_raw(X)
+
+def _flatten(trees, n_features, **meta):
+    '''
+    trees: list of dicts of per-tree node arrays (feature, threshold, left, right, value, cover,
+           missing_left) with tree-local child indices and -1 for the children of a leaf
+    nodes are renumbered breadth first so that the right child of every node follows its left child
+    '''
+    renumbered = []
+    for tree in trees:
+        order = [0]
+        for node in order:
+            if tree['left'][node] >= 0:
+                order.extend([tree['left'][node], tree['right'][node]])
+        # unreachable node ids (xgboost keeps the ids of pruned nodes) are dropped
+        order = np.array(order)
+        new_index = np.zeros(len(tree['feature']), dtype=np.int64)
+        new_index[order] = np.arange(len(order))
+        renumbered_tree = {key: np.asarray(tree[key])[order] for key in tree}
+        for key in ('left', 'right'):
+            child = renumbered_tree[key]
+            renumbered_tree[key] = np.where(child < 0, -1, new_index[np.maximum(child, 0)])
+        renumbered.append(renumbered_tree)
+    trees = renumbered
+    offsets = np.cumsum([0]+[len(tree['feature']) for tree in trees])
+    arrays = {}
+    for key in ('feature', 'threshold', 'value', 'cover', 'missing_left'):
+        arrays[key] = np.concatenate([np.asarray(tree[key]) for tree in trees])
+    for key in ('left', 'right'):
+        children = []
+        for offset, tree in zip(offsets, trees):
+            child = np.asarray(tree[key], dtype=np.int64)
+            own   = np.arange(len(child))
+            children.append(np.where(child < 0, own, child)+offset)
+        arrays[key] = np.concatenate(children).astype(np.int32)
+    leaf = arrays['left'] == np.arange(len(arrays['left']))
+    arrays['feature']      = np.where(leaf, 0, arrays['feature']).astype(np.int32)
+    arrays['threshold']    = np.where(leaf, 0, arrays['threshold']).astype(np.float64)
+    arrays['value']        = np.where(leaf, arrays['value'], 0).astype(np.float64)
+    arrays['cover']        = arrays['cover'].astype(np.float64)
+    arrays['missing_left'] = arrays['missing_left'].astype(bool)
+    arrays['roots']        = offsets[:-1].astype(np.int32)
+    arrays['max_depth']    = np.array(max(_tree_depth(tree) for tree in trees))
+    arrays['n_features']   = np.array(n_features)
+    for key, value in meta.items():
+        arrays[key] = np.asarray(value)
+    return arrays
+
+def _tree_depth(tree):
+    depth = np.zeros(len(tree['feature']), dtype=int)
+    for node in range(len(depth)):
+        for child in (tree['left'][node], tree['right'][node]):
+            if child >= 0:
+                depth[child] = depth[node]+1
+    return int(depth.max())
+
+def _sklearn_tree(tree):
+    return dict(feature=tree.feature, threshold=tree.threshold, left=tree.children_left, right=tree.children_right,
+                value=tree.value[:, 0, 0], cover=tree.weighted_n_node_samples,
+                missing_left=np.zeros(tree.node_count, dtype=bool))
+
+def export_random_forest(model, source_sha1=''):
+    trees = [_sklearn_tree(estimator.tree_) for estimator in model.estimators_]
+    return _flatten(trees, n_features=model.estimators_[0].tree_.n_features, kind='random_forest',
+                    tree_group=np.zeros(len(trees), dtype=np.int32), base_score=0.0, tree_scale=1.0/len(trees),
+                    classes=np.zeros(0), source_sha1=source_sha1)
+
+def export_gradient_boosting(model, source_sha1=''):
+    if model.estimators_.shape[1] != 1:
+        raise ValueError('only single-output gradient boosting regressors are supported')
+    if model.init_ == 'zero':
+        base_score = 0.0
+    else:
+        base_score = float(np.ravel(model.init_.constant_)[0])
+    trees = [_sklearn_tree(estimator.tree_) for estimator in model.estimators_[:, 0]]
+    return _flatten(trees, n_features=model.estimators_[0, 0].tree_.n_features, kind='gradient_boosting',
+                    tree_group=np.zeros(len(trees), dtype=np.int32), base_score=base_score,
+                    tree_scale=model.learning_rate, classes=np.zeros(0), source_sha1=source_sha1)
+
+def export_xgboost(model, source_sha1=''):
+    booster = model.get_booster()
+    config  = json.loads(booster.save_config())
+    if config['learner']['learner_train_param']['objective'] != 'multi:softprob':
+        raise ValueError('only multi:softprob classifiers are supported')
+    n_classes  = int(config['learner']['learner_model_param']['num_class'])
+    n_features = int(config['learner']['learner_model_param']['num_feature'])
+    base_score = float(config['learner']['learner_model_param']['base_score'])
+    feature_names = booster.feature_names or ['f{0}'.format(i) for i in range(n_features)]
+    trees = []
+    for dump in booster.get_dump(dump_format='json', with_stats=True):
+        nodes = {}
+        stack = [json.loads(dump)]
+        while stack:
+            node = stack.pop()
+            nodes[node['nodeid']] = node
+            stack.extend(node.get('children', []))
+        n_nodes = max(nodes)+1
+        tree = dict(feature=np.zeros(n_nodes, dtype=np.int64), threshold=np.zeros(n_nodes),
+                    left=-np.ones(n_nodes, dtype=np.int64), right=-np.ones(n_nodes, dtype=np.int64),
+                    value=np.zeros(n_nodes), cover=np.zeros(n_nodes), missing_left=np.zeros(n_nodes, dtype=bool))
+        for nodeid, node in nodes.items():
+            tree['cover'][nodeid] = node['cover']
+            if 'leaf' in node:
+                tree['value'][nodeid] = np.float32(node['leaf'])
+                continue
+            tree['feature'][nodeid]      = feature_names.index(node['split'])
+            tree['threshold'][nodeid]    = np.float32(node['split_condition'])
+            tree['left'][nodeid]         = node['yes']
+            tree['right'][nodeid]        = node['no']
+            tree['missing_left'][nodeid] = node['missing'] == node['yes']
+        trees.append(tree)
+    tree_group = np.arange(len(trees), dtype=np.int32) % n_classes
+    return _flatten(trees, n_features=n_features, kind='xgboost', tree_group=tree_group, base_score=base_score,
+                    tree_scale=1.0, classes=np.asarray(model.classes_), source_sha1=source_sha1)
+
+def export_ensemble(model, source_sha1=''):
+    exporters = {'RandomForestRegressor': export_random_forest,
+                 'GradientBoostingRegressor': export_gradient_boosting,
+                 'XGBClassifier': export_xgboost}
+    name = type(model).__name__
+    if name not in exporters:
+        raise TypeError('no exporter for {0}'.format(name))
+    return TreeEnsemble(exporters[name](model, source_sha1=source_sha1))
+
+def load_tree_ensemble(path):
+    '''
+    registry loader, path is a .pkl model or its .npz export: uses the export unless it was made from
+    another version of the pickle, in which case the pickle is exported again in memory
+    '''
+    pickle_path   = os.path.splitext(path)[0]+'.pkl'
+    exported_path = os.path.splitext(path)[0]+'.npz'
+    if os.path.exists(exported_path):
+        ensemble = TreeEnsemble.load(exported_path)
+        if not os.path.exists(pickle_path) or ensemble.source_sha1 == file_sha1(pickle_path):
+            return ensemble
+    import joblib
+    return export_ensemble(joblib.load(pickle_path), source_sha1=file_sha1(pickle_path))
+
+def artifact_path(model_dir, model_file):
+    '''
+    the .pkl model, or its .npz export when the pickle is not deployed
+    '''
+    pickle_path = os.path.join(model_dir, model_file)
+    if os.path.exists(pickle_path):
+        return pickle_path
+    return os.path.splitext(pickle_path)[0]+'.npz'
+
+def export_all(model_dir, n_check=10000, seed=0):
+    import joblib
+    rng = np.random.RandomState(seed)
+    for model_file in ('fm_xgboost.pkl', 'strength_gb.pkl', 'deformation_rf.pkl'):
+        pickle_path = os.path.join(model_dir, model_file)
+        model = joblib.load(pickle_path)
+        ensemble = export_ensemble(model, source_sha1=file_sha1(pickle_path))
+        # the models were trained on min-max scaled features, check around [0, 1]
+        X = rng.uniform(-0.2, 1.2, size=(n_check, ensemble.n_features))
+        X[:, -3:] = np.eye(3)[rng.randint(3, size=n_check)]
+        if ensemble.kind == 'xgboost':
+            difference = np.abs(ensemble.predict_proba(X)-model.predict_proba(X)).max()
+            mismatch   = np.sum(ensemble.predict(X) != model.predict(X))
+            report     = 'max probability difference {0:.2e}, {1} label mismatches'.format(difference, mismatch)
+        else:
+            difference = np.abs(ensemble.predict(X)-model.predict(X)).max()
+            report     = 'max difference {0:.2e}'.format(difference)
+        exported_path = os.path.splitext(pickle_path)[0]+'.npz'
+        ensemble.save(exported_path)
+        print('{0} -> {1}: {2} trees, {3} nodes, {4}'.format(model_file, os.path.basename(exported_path),
+              ensemble.n_trees, len(ensemble.feature), report))
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='export the .pkl tree ensembles into .npz node arrays')
+    parser.add_argument('--model-dir', default=sys.path[0])
+    parser.add_argument('--n-check', type=int, default=10000, help='random rows compared with the library predictions')
+    args = parser.parse_args()
+    export_all(args.model_dir, n_check=args.n_check)
@@ -0,0 +1,291 @@
+'''
+TreeSHAP feature contributions of the three tree ensembles.
+
+    explanation = explain_batch(walls, 'fm')            # walls: see predictor_core.build_features
+    explanation.values                                  # (n, n_classes, n_names) for fm, (n, n_names) otherwise
+    explanation.global_importance()                     # [(name, mean |contribution|)] most important first
+
+The contributions are the path-dependent TreeSHAP values (Lundberg et al., tree_path_dependent in
+the shap package): for every row, expected_value + values.sum(-1) is the model output, i.e. the
+class margins of the XGBoost classifier (softmax input), or the strength and drift capacity in
+their own units for the regressors (mapped back through the linear y scaler).
+
+Instead of the recursive algorithm, every root-to-leaf path is reduced to its unique features, each
+with the interval of values that follows the path and the fraction of the training cover that does
+(zero fraction). For paths of d unique features, the contribution of feature i to a row is
+
+    v * (o_i - z_i) * sum_k k!(d-1-k)!/d! * [t^k] prod_(j != i) (z_j + o_j t)
+
+with o_j = 1 when the row falls in the interval of feature j. All paths of the same length are
+evaluated together for a chunk of rows, so the work is numpy operations on (rows, paths) arrays
+and grows with the number of leaves times d^2 (d <= 12).
+
+    python tree_shap.py walls.csv --model strength --workers 4 --output contributions.csv
+'''
+import os
+import sys
+import math
+import weakref
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from predictor_core import (input_names, feature_names, section_type_list, failure_mode_names, xy_columns,
+                            registry, build_features)
+from profiling import profiler
+
+
+model_names = ['fm', 'strength', 'deformation']
+# names of the model input columns, the section one-hot columns are named after the section type
+column_names = {'fm': feature_names+['section_type='+name for name in section_type_list]}
+column_names['strength'] = column_names['deformation'] = [column_names['fm'][i] for i in xy_columns]
+
+
+class PathGroup(object):
+    '''
+    all root-to-leaf paths of one ensemble with the same number d of unique features
+    '''
+
+    def __init__(self, features, lower, upper, zero_fraction, value, output):
+        self.features      = features       # (L, d) feature column of every unique path feature
+        self.lower         = lower          # (L, d) interval of the feature values that follow the path
+        self.upper         = upper
+        self.zero_fraction = zero_fraction  # (L, d) fraction of the cover following the path at this feature
+        self.value         = value          # (L,) leaf value
+        self.output        = output         # (L,) first column of the leaf in values: tree group*n_features
+        # for the i-th path feature: path order sorted by output column, start of every column, columns
+        self.scatter = []
+        for i in range(features.shape[1]):
+            columns = output+features[:, i]
+            order   = np.argsort(columns, kind='stable')
+            starts  = np.flatnonzero(np.diff(columns[order], prepend=-1))
+            self.scatter.append((order, starts, columns[order][starts]))
+
+def leaf_paths(ensemble):
+    '''
+    path groups of a tree_engine.TreeEnsemble, by number of unique features
+    '''
+    paths = {}
+    # (node, {feature: (lower, upper, zero fraction)}, tree group) of the paths being followed
+    stack = [(int(root), {}, group) for root, group in zip(ensemble.roots, ensemble.tree_group)]
+    while stack:
+        node, conditions, group = stack.pop()
+        if ensemble.is_leaf[node]:
+            paths.setdefault(len(conditions), []).append((conditions, ensemble.value[node], group))
+            continue
+        feature   = int(ensemble.feature[node])
+        threshold = ensemble.threshold[node]
+        for child, is_right in ((ensemble.left[node], False), (ensemble.right[node], True)):
+            lower, upper, zero_fraction = conditions.get(feature, (-np.inf, np.inf, 1.0))
+            if is_right:
+                lower = max(lower, threshold)
+            else:
+                upper = min(upper, threshold)
+            child_conditions = dict(conditions)
+            child_conditions[feature] = (lower, upper, zero_fraction*ensemble.cover[child]/ensemble.cover[node])
+            stack.append((int(child), child_conditions, group))
+    groups = []
+    for d, leaves in sorted(paths.items()):
+        features = np.array([sorted(conditions) for conditions, _, _ in leaves], dtype=np.intp).reshape(len(leaves), d)
+        bounds   = np.array([[conditions[feature] for feature in sorted(conditions)] for conditions, _, _ in leaves],
+                            dtype=float).reshape(len(leaves), d, 3)
+        value    = np.array([value for _, value, _ in leaves])
+        output   = np.array([tree_group for _, _, tree_group in leaves], dtype=np.intp)*ensemble.n_features
+        groups.append(PathGroup(features, bounds[..., 0], bounds[..., 1], bounds[..., 2], value, output))
+    return groups
+
+# path groups of every loaded ensemble, built on first use
+_path_groups = weakref.WeakKeyDictionary()
+
+def path_groups(ensemble):
+    groups = _path_groups.get(ensemble)
+    if groups is None:
+        with profiler.span('shap/paths'):
+            groups = _path_groups[ensemble] = leaf_paths(ensemble)
+    return groups
+
+def shapley_weights(d):
+    return np.array([math.factorial(k)*math.factorial(d-1-k)/math.factorial(d) for k in range(d)])
+
+def expected_value(ensemble):
+    '''
+    (n_groups,) model output averaged over the training cover, before tree_scale and base_score
+    '''
+    expected = np.zeros(ensemble.n_groups)
+    for tree, root in enumerate(ensemble.roots):
+        end  = ensemble.roots[tree+1] if tree+1 < ensemble.n_trees else len(ensemble.feature)
+        leaf = np.nonzero(ensemble.is_leaf[root:end])[0]+root
+        expected[ensemble.tree_group[tree]] += (ensemble.value[leaf]*ensemble.cover[leaf]).sum()/ensemble.cover[root]
+    return expected
+
+def tree_shap(ensemble, X, max_bytes=1<<20):
+    '''
+    (n, n_groups, n_features) contributions of the trees to the raw sum of leaf values (before
+    tree_scale and base_score) for the model inputs X
+    max_bytes: working set of one chunk of rows, faster while it stays in the CPU cache
+    '''
+    X = np.atleast_2d(X)
+    if X.shape[1] != ensemble.n_features:
+        raise ValueError('expected {0} features, got {1}'.format(ensemble.n_features, X.shape[1]))
+    # the splits are evaluated on float32 inputs, as in tree_engine.apply
+    X = np.ascontiguousarray(X, dtype=np.float32).astype(float)
+    if np.isnan(X).any():
+        raise ValueError('Input contains NaN')
+    values = np.zeros((len(X), ensemble.n_groups*ensemble.n_features))
+    for group in path_groups(ensemble):
+        n_paths, d = group.features.shape
+        if d == 0:
+            continue
+        weights = shapley_weights(d)
+        # the (d+1, rows, paths) polynomial coefficients and their temporaries dominate the memory
+        rows_per_chunk = max(1, max_bytes//(8*n_paths*(d+1)*4))
+        for start in range(0, len(X), rows_per_chunk):
+            rows = slice(start, start+rows_per_chunk)
+            # (d, rows, paths) arrays, x in the interval of the path: o = 1
+            x = X[rows][:, group.features.T].transpose(1, 0, 2)
+            # xgboost: lower <= x < upper, scikit-learn: lower < x <= upper
+            if ensemble.strict:
+                one = ((x >= group.lower.T[:, None]) & (x < group.upper.T[:, None])).astype(float)
+            else:
+                one = ((x > group.lower.T[:, None]) & (x <= group.upper.T[:, None])).astype(float)
+            zero = group.zero_fraction.T
+            # coefficients of prod_j (z_j + o_j t), lowest power first
+            poly = np.zeros((d+1,)+one.shape[1:])
+            poly[0] = 1
+            for j in range(d):
+                poly[1:j+2] = poly[1:j+2]*zero[j]+poly[0:j+1]*one[j]
+                poly[0] *= zero[j]
+            # sum_k w_k [t^k] of the product without feature i is this sum divided by z_i when o_i = 0
+            weighted = np.tensordot(weights, poly[:d], axes=1)
+            for i in range(d):
+                z, o = zero[i], one[i]
+                # o_i = 1: synthetic division by (z_i + t), from the highest power down
+                quotient = poly[d].copy()
+                total    = weights[d-1]*quotient
+                for k in range(d-1, 0, -1):
+                    quotient = poly[k]-z*quotient
+                    total   += weights[k-1]*quotient
+                total = np.where(o > 0, total, weighted/np.where(z > 0, z, 1))
+                contribution = group.value*(o-z)*total
+                order, starts, columns = group.scatter[i]
+                values[rows, columns] += np.add.reduceat(contribution[:, order], starts, axis=1)
+    return values.reshape(len(X), ensemble.n_groups, ensemble.n_features)
+
+class Explanation(object):
+    '''
+    contributions of the model inputs to the predictions of a batch of walls
+    values:         (n, n_names), or (n, n_classes, n_names) margins of the failure mode classifier
+    expected_value: output averaged over the training data, scalar or (n_classes,)
+    output:         expected_value+values.sum(-1), the predicted strength/drift or class margins
+    '''
+
+    def __init__(self, model, names, values, expected_value, classes=None):
+        self.model          = model
+        self.names          = names
+        self.values         = values
+        self.expected_value = expected_value
+        self.classes        = classes
+
+    @property
+    def output(self):
+        return self.expected_value+self.values.sum(axis=-1)
+
+    def global_importance(self, class_name=None):
+        '''
+        [(name, mean |contribution| over the walls)], largest first; for the classifier the mean is
+        summed over the classes, or taken for class_name only
+        '''
+        values = self.values
+        if self.classes is not None:
+            values = values[:, list(self.classes).index(class_name)] if class_name else values
+        importance = np.abs(values).mean(axis=0)
+        if importance.ndim > 1:
+            importance = importance.sum(axis=0)
+        order = np.argsort(-importance, kind='stable')
+        return [(self.names[i], float(importance[i])) for i in order]
+
+def model_inputs(model, features_np):
+    '''
+    normalized input columns of model for a build_features matrix
+    '''
+    scaler = registry.get(model+'_scaler')
+    columns = slice(None) if model == 'fm' else xy_columns
+    return features_np[:, columns]*scaler['x_scale']+scaler['x_offset']
+
+def _explain_rows(model, X, max_bytes):
+    # also the worker function of the process pool: the trees are loaded once per process
+    return tree_shap(registry.get(model+'_trees'), X, max_bytes)
+
+def explain_batch(walls, model='fm', section_type=None, group_sections=True, workers=1, max_bytes=1<<20):
+    '''
+    TreeSHAP contributions of model ('fm', 'strength' or 'deformation') for many walls
+    walls, section_type: see build_features
+    group_sections: one section_type contribution (the sum over the one-hot columns) instead of one per column
+    workers: processes sharing the rows, 1 computes in this process
+    '''
+    if model not in model_names:
+        raise ValueError('unknown model {0!r}, expected one of {1}'.format(model, model_names))
+    with profiler.span('build_features'):
+        features_np = build_features(walls, section_type=section_type)
+    X = model_inputs(model, features_np)
+    ensemble = registry.get(model+'_trees')
+    with profiler.span('shap/'+model):
+        if workers > 1 and len(X) > 1:
+            blocks = np.array_split(np.arange(len(X)), min(len(X), 4*workers))
+            # spawned workers: a forked child of a process that already ran the library models (OpenMP) can hang
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+                parts = executor.map(_explain_rows, [model]*len(blocks), [X[block] for block in blocks],
+                                     [max_bytes]*len(blocks))
+                raw = np.concatenate(list(parts))
+        else:
+            raw = _explain_rows(model, X, max_bytes)
+    # raw sums of leaf values to model outputs
+    values   = ensemble.tree_scale*raw
+    expected = ensemble.base_score+ensemble.tree_scale*expected_value(ensemble)
+    names    = list(column_names[model])
+    if group_sections:
+        sections = [i for i, name in enumerate(names) if name.startswith('section_type=')]
+        others   = [i for i in range(len(names)) if i not in sections]
+        values   = np.concatenate([values[..., others], values[..., sections].sum(axis=-1, keepdims=True)], axis=-1)
+        names    = [names[i] for i in others]+['section_type']
+    if model == 'fm':
+        classes = failure_mode_names[ensemble.classes_.astype(int)-1]
+        return Explanation(model, names, values, expected, classes=classes)
+    # strength and drift in their own units: the y scaler is linear
+    scaler = registry.get(model+'_scaler')
+    return Explanation(model, names, values[:, 0]*scaler['y_scale'],
+                       float(expected[0]*scaler['y_scale']+scaler['y_offset']))
+
+
+if __name__ == '__main__':
+    import argparse
+    import csv
+    from batch_runner import read_csv_shards, parse_shard, validate
+    parser = argparse.ArgumentParser(description='TreeSHAP contributions of the wall inputs to a model')
+    parser.add_argument('input', help='CSV file with the wall inputs as columns')
+    parser.add_argument('--model', default='fm', choices=model_names)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--output', help='CSV file for the contributions of every wall')
+    parser.add_argument('--top', type=int, default=10, help='number of inputs in the global importance')
+    args = parser.parse_args()
+    columns = {}
+    for _, header, shard in read_csv_shards(args.input, 1<<30):
+        columns = parse_shard(header, shard)
+    walls, errors = validate(columns)
+    valid = np.nonzero(errors == '')[0]
+    if len(valid) < len(errors):
+        sys.stderr.write('{0} invalid rows skipped\n'.format(len(errors)-len(valid)))
+    explanation = explain_batch({name: walls[name][valid] for name in input_names}, args.model, workers=args.workers)
+    for name, importance in explanation.global_importance()[:args.top]:
+        print('{0:20s} {1:.6g}'.format(name, importance))
+    if args.output:
+        with open(args.output, 'w', newline='') as output:
+            writer = csv.writer(output)
+            if explanation.classes is None:
+                writer.writerow(['row', 'expected_value']+explanation.names)
+                for row, values in zip(valid, explanation.values):
+                    writer.writerow([row, explanation.expected_value]+list(values))
+            else:
+                writer.writerow(['row', 'failure_mode', 'expected_value']+explanation.names)
+                for row, values in zip(valid, explanation.values):
+                    for class_name, expected, class_values in zip(explanation.classes, explanation.expected_value, values):
+                        writer.writerow([row, class_name, expected]+list(class_values))
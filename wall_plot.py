@@ -0,0 +1,152 @@
+'''
+matplotlib drawings of the wall elevation/plan and of the crack pattern of each failure mode
+'''
+import numpy as np
+import matplotlib.pyplot as plt
+from predictor_core import model_dir, registry
+# registers the crack patterns
+import crack_store
+from profiling import profiler
+
+
+def plot_rec(origin, height, width, fig_num):
+    plt.figure(fig_num)
+    # left -> back -> right -> front
+    plt.plot([origin[0], origin[0]], [origin[1], origin[1]+height], '-k')
+    plt.plot([origin[0], origin[0]+width], [origin[1]+height, origin[1]+height], '-k')
+    plt.plot([origin[0]+width, origin[0]+width], [origin[1]+height, origin[1]], '-k')
+    plt.plot([origin[0]+width, origin[0]], [origin[1], origin[1]], '-k')
+    plt.axis('scaled')
+    plt.xlim(-0.2,1.2)
+    return None
+
+def plot_rectangular(origin, height, width, thickness, fig_num=1):
+    plt.figure(fig_num)
+    # elevation
+    plot_rec(origin=origin, width=width, height=height, fig_num=fig_num)
+    # plan (top view)
+    spacing_of_two_view = 0.5*width
+    plot_rec(origin=[origin[0],height+spacing_of_two_view], width=width, height=thickness, fig_num=fig_num)
+    plt.axis('scaled')
+    plt.xlim(-0.2,1.2)
+    return None
+
+def plot_barbell(origin, height, width, thickness, ratio_width=0.2, ratio_thickness=1.5, fig_num=1):
+    '''
+    ratio_width     = 0.2   # ratio of barbell width to wall width
+    ratio_thickness = 1.5   # ratio of barbell thickness to wall thickness
+    '''
+    plt.figure(fig_num)
+    origin_x = origin[0]
+    origin_y = origin[1]
+    # elevation
+    barbell_width   = width*ratio_width
+    # outline -> two vertical lines inside
+    plot_rec(origin=origin, width=width, height=height, fig_num=fig_num)
+    plt.plot([origin_x+ratio_width*width, origin_x+ratio_width*width], [origin_y, origin_y+height], '-k')
+    plt.plot([origin_x+width-barbell_width, origin_x+width-barbell_width], [origin_y, origin_y+height], '-k')
+    # plan (top view)
+    spacing_of_two_view = 0.5*width
+    barbell_thickness   = thickness*ratio_thickness
+    half_thickness_difference = (barbell_thickness-thickness)/2
+    # left -> back -> right -> front
+    origin_plan_y = origin_y+height+spacing_of_two_view
+    plt.plot([origin_x, origin_x], [origin_plan_y, origin_plan_y+barbell_thickness], '-k')
+    plt.plot([origin_x, origin_x+barbell_width], [origin_plan_y+barbell_thickness, origin_plan_y+barbell_thickness], '-k')
+    plt.plot([origin_x+barbell_width, origin_x+barbell_width],
+            [origin_plan_y+barbell_thickness, origin_plan_y+barbell_thickness-(ratio_thickness*thickness-thickness)/2], '-k')
+    plt.plot([origin_x+barbell_width, origin_x+width-barbell_width],
+            [origin_plan_y+barbell_thickness-half_thickness_difference, origin_plan_y+barbell_thickness-half_thickness_difference], '-k')
+    plt.plot([origin_x+width-barbell_width, origin_x+width-barbell_width],
+            [origin_plan_y+barbell_thickness-half_thickness_difference, origin_plan_y+barbell_thickness], '-k')
+    plt.plot([origin_x+width-barbell_width, origin_x+width], [origin_plan_y+barbell_thickness, origin_plan_y+barbell_thickness], '-k')
+    plt.plot([origin_x+width, origin_x+width], [origin_plan_y+barbell_thickness, origin_plan_y], '-k')
+    plt.plot([origin_x+width, origin_x+width-barbell_width], [origin_plan_y, origin_plan_y], '-k')
+    plt.plot([origin_x+width-barbell_width, origin_x+width-barbell_width],
+            [origin_plan_y, origin_plan_y+half_thickness_difference], '-k')
+    plt.plot([origin_x+width-barbell_width, origin_x+barbell_width],
+            [origin_plan_y+half_thickness_difference, origin_plan_y+half_thickness_difference], '-k')
+    plt.plot([origin_x+barbell_width, origin_x+barbell_width], [origin_plan_y+half_thickness_difference, origin_plan_y], '-k')
+    plt.plot([origin_x+barbell_width, origin_x], [origin_plan_y, origin_plan_y], '-k')
+    plt.axis('scaled')
+    plt.xlim(-0.2,1.2)
+    
+    return None
+
+def plot_wall(section_type, height, width, thickness, fig_num=1):
+    plt.figure(fig_num)
+    if section_type == 'Rectangular':
+        plot_rectangular(origin=[0,0], height=height, width=width, thickness=thickness)
+    if section_type == 'Barbell':
+        plot_barbell(origin=[0,0], height=height, width=width, thickness=thickness, ratio_width=0.2, ratio_thickness=3)
+    if section_type == 'Flange':
+        plot_barbell(origin=[0,0], height=height, width=width, thickness=thickness, ratio_width=0.07, ratio_thickness=8)
+    plt.axis('scaled')
+    plt.xlim(-0.2,1.2)
+    # plt.subplots_adjust(top=1,bottom=0,left=0,right=1,hspace=0,wspace=0)
+    plt.xticks([])
+    plt.yticks([])
+    ax = plt.gca()
+    ax.spines['right'].set_color('none')
+    ax.spines['left'].set_color('none')
+    ax.spines['bottom'].set_color('none')
+    ax.spines['top'].set_color('none')
+    # plt.axis('off')
+    return None
+
+@profiler.timed('read_crack_data')
+def read_crack_data(crack_data, line_num):
+    # the drawing functions take the patterns from crack_store, this reader is kept for scripts
+    with open(model_dir+crack_data) as crack:
+        lines = crack.readlines()
+        line_name_list = ['Line #{0}\n'.format(i) for i in range(1, line_num+1)]
+        lines_row_num = []
+        for r, l in enumerate(lines):
+            if l in line_name_list:
+                lines_row_num.append(r)
+        
+        lines_x_list = []
+        lines_y_list = []
+        for num in range(line_num):
+            line_x  = []
+            line_y  = []
+            if num != line_num-1:
+                for i in lines[lines_row_num[num]+1:lines_row_num[num+1]-1]:
+                    line_x.append(i.split()[0])
+                    line_y.append(i.split()[1])
+            if num == line_num-1:
+                for i in lines[lines_row_num[num]+1:len(lines)]:
+                    line_x.append(i.split()[0])
+                    line_y.append(i.split()[1])
+            lines_x_list.append(np.array(line_x, dtype=float))
+            lines_y_list.append(np.array(line_y, dtype=float))
+    return lines_x_list, lines_y_list
+
+def plot_crack(failure_mode, origin, height, width, fig_num=1):
+    '''
+    crack pattern of a failure mode (crack_store) over a wall drawn by plot_wall
+    '''
+    pattern, title = registry.get('crack_patterns').for_failure_mode(failure_mode)
+    plt.figure(fig_num)
+    for line in pattern.polylines(origin=origin, width=width, height=height):
+        plt.plot(line[:, 0], line[:, 1], '-', color=pattern.color, linewidth=pattern.linewidth)
+    plt.title(title,fontsize=15,fontweight='bold')
+    plt.xlabel('Note: Pictures shown are for illustration purpose only.')
+    plt.axis('scaled')
+    return None
+
+def plot_shear_crack(origin, height, width, fig_num=1):
+    return plot_crack('Shear', origin, height, width, fig_num)
+
+def plot_flexural_crack(origin, height, width, fig_num=1):
+    return plot_crack('Flexure', origin, height, width, fig_num)
+
+def plot_flexural_shear_crack(origin, height, width, fig_num=1):
+    return plot_crack('Flexure-Shear', origin, height, width, fig_num)
+
+def plot_sliding_crack(origin, height, width, fig_num=1):
+    return plot_crack('Sliding', origin, height, width, fig_num)
+
+# crack drawn for each failure mode
+crack_plots = {'Flexure': plot_flexural_crack, 'Flexure-Shear': plot_flexural_shear_crack,
+               'Shear': plot_shear_crack, 'Sliding': plot_sliding_crack}
@@ -0,0 +1,201 @@
+'''
+Retained-mode drawing of the wall and of its crack pattern.
+
+The artists are created once: one LineCollection for the wall elevation and plan, one for the crack
+pattern, plus the title and the note. update() only replaces their vertex data and the y limits;
+draw() repaints these four artists over the cached empty figure (blitting) instead of redrawing the
+whole figure, and falls back to a full canvas draw when the canvas cannot blit. Works on the Qt
+canvas of the GUI as well as on an offscreen Agg canvas.
+
+    renderer = WallRenderer(figure)
+    renderer.update('Barbell', height=1.47, thickness=1/12.96, failure_mode='Flexure')
+    renderer.draw()
+'''
+import numpy as np
+from matplotlib import rcParams
+from matplotlib.collections import LineCollection
+from matplotlib.transforms import offset_copy
+from predictor_core import registry
+# registers the crack patterns
+import crack_store
+
+
+# barbell proportions of plot_wall: (ratio of barbell width to wall width, of barbell thickness to wall thickness)
+barbell_ratios = {'Barbell': (0.2, 3), 'Flange': (0.07, 8)}
+# x range of the drawing and relative y margin of the autoscaled view (as plt.axis('scaled') + plt.xlim)
+x_limits = (-0.2, 1.2)
+y_margin = 0.05
+note = 'Note: Pictures shown are for illustration purpose only.'
+
+def rectangle(x, y, width, height):
+    # left -> back -> right -> front
+    return np.array([[x, y], [x, y+height], [x+width, y+height], [x+width, y], [x, y]])
+
+def wall_polylines(section_type, height, width, thickness, origin=(0, 0)):
+    '''
+    outline of the elevation and of the plan (top view) drawn by plot_wall, as (k, 2) polylines
+    (views of one array computed from the cached outline_template of the section type)
+    '''
+    basis, offsets = outline_template(section_type)
+    points = width*basis[0]+height*basis[1]+thickness*basis[2]+np.asarray(origin, dtype=float)
+    return [points[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+
+# section type -> (basis, offsets), see outline_template
+_outline_templates = {}
+
+def outline_template(section_type):
+    '''
+    the outline at the origin is linear in (width, height, thickness): returns the stacked polyline
+    points of the unit walls (1, 0, 0), (0, 1, 0) and (0, 0, 1) as a (3, n, 2) array, and the start of
+    every polyline followed by n, computed once per section type
+    '''
+    template = _outline_templates.get(section_type)
+    if template is None:
+        units = [_outline(section_type, *unit) for unit in ((0, 1, 0), (1, 0, 0), (0, 0, 1))]
+        basis = np.array([np.concatenate(polylines) for polylines in units])
+        offsets = np.cumsum([0]+[len(line) for line in units[0]])
+        template = _outline_templates[section_type] = (basis, offsets)
+    return template
+
+def _outline(section_type, height, width, thickness, origin=(0, 0)):
+    x, y = origin
+    spacing_of_two_view = 0.5*width
+    polylines = [rectangle(x, y, width, height)]
+    if section_type not in barbell_ratios:
+        polylines.append(rectangle(x, y+height+spacing_of_two_view, width, thickness))
+        return polylines
+    ratio_width, ratio_thickness = barbell_ratios[section_type]
+    barbell_width     = width*ratio_width
+    barbell_thickness = thickness*ratio_thickness
+    half_thickness_difference = (barbell_thickness-thickness)/2
+    # two vertical lines inside the elevation
+    polylines.append(np.array([[x+barbell_width, y], [x+barbell_width, y+height]]))
+    polylines.append(np.array([[x+width-barbell_width, y], [x+width-barbell_width, y+height]]))
+    # plan: barbells at both ends connected by the web
+    plan_y = y+height+spacing_of_two_view
+    top    = plan_y+barbell_thickness
+    web_top, web_bottom = top-half_thickness_difference, plan_y+half_thickness_difference
+    polylines.append(np.array([[x, plan_y], [x, top], [x+barbell_width, top], [x+barbell_width, web_top],
+                               [x+width-barbell_width, web_top], [x+width-barbell_width, top], [x+width, top],
+                               [x+width, plan_y], [x+width-barbell_width, plan_y],
+                               [x+width-barbell_width, web_bottom], [x+barbell_width, web_bottom],
+                               [x+barbell_width, plan_y], [x, plan_y]]))
+    return polylines
+
+class WallRenderer(object):
+    '''
+    figure: a matplotlib figure with a canvas (FigureCanvasQTAgg, FigureCanvasAgg, ...)
+    blit:   repaint only the wall and crack when the canvas supports it; without blitting
+            the artists are ordinary ones and also appear in savefig
+    '''
+
+    def __init__(self, figure, blit=True):
+        self.figure  = figure
+        self.canvas  = figure.canvas
+        self.blit    = blit and getattr(self.canvas, 'supports_blit', hasattr(self.canvas, 'copy_from_bbox'))
+        figure.clf()
+        self.axes    = figure.add_subplot(111)
+        self.axes.set_aspect('equal', adjustable='box')
+        self.axes.set_xlim(*x_limits)
+        self.axes.set_xticks([])
+        self.axes.set_yticks([])
+        for spine in self.axes.spines.values():
+            spine.set_color('none')
+        self.outline = LineCollection([], colors='k')
+        self.crack   = LineCollection([], colors='r')
+        self.axes.add_collection(self.outline)
+        self.axes.add_collection(self.crack)
+        # title and note placed like set_title/set_xlabel, but attached to the axes box so that they
+        # follow it when the equal aspect resizes the box without a full draw
+        self.title   = self.axes.text(0.5, 1, '', ha='center', va='baseline', fontsize=15, fontweight='bold',
+                                      transform=offset_copy(self.axes.transAxes, figure, y=rcParams['axes.titlepad'], units='points'))
+        self.note    = self.axes.text(0.5, 0, '', ha='center', va='top', fontsize=rcParams['axes.labelsize'],
+                                      transform=offset_copy(self.axes.transAxes, figure, y=-rcParams['axes.labelpad'], units='points'))
+        # everything visible is redrawn by draw(), the background only holds the empty figure
+        self.artists = [self.outline, self.crack, self.title, self.note]
+        self._background  = None
+        self.outline_state = None
+        self.crack_state   = None
+        if self.blit:
+            for artist in self.artists:
+                artist.set_animated(True)
+            # any full draw (first show, resize, canvas.draw) refreshes the background
+            self._draw_event = self.canvas.mpl_connect('draw_event', self._on_draw)
+
+    @property
+    def state(self):
+        return self.outline_state, self.crack_state
+
+    def update(self, section_type, height, thickness, failure_mode=None, width=1):
+        '''
+        sets the wall (and the crack pattern of failure_mode, None for the bare wall), returns False
+        when nothing changed
+        '''
+        outline_changed = self.set_outline(section_type, height, thickness, width)
+        crack_changed   = self.set_crack(failure_mode, height, width)
+        return outline_changed or crack_changed
+
+    def set_outline(self, section_type, height, thickness, width=1):
+        '''
+        the elevation and plan layer and the view around it, returns False when nothing changed
+        '''
+        state = (section_type, float(height), float(thickness), float(width))
+        if state == self.outline_state:
+            return False
+        self.outline_state = state
+        outline = wall_polylines(section_type, height, width, thickness)
+        self.outline.set_segments(outline)
+        # the view follows the wall only (plt.axis('scaled') also fitted the crack lines)
+        y_values = np.concatenate([line[:, 1] for line in outline])
+        y_min, y_max = y_values.min(), y_values.max()
+        margin = (y_max-y_min)*y_margin
+        y_limits = (y_min-margin, y_max+margin)
+        self.axes.set_ylim(*y_limits)
+        return True
+
+    def set_crack(self, failure_mode, height, width=1):
+        '''
+        the crack pattern layer with its title and note (none for failure_mode None), returns False
+        when nothing changed
+        '''
+        state = (failure_mode, float(height), float(width))
+        if state == self.crack_state:
+            return False
+        self.crack_state = state
+        if failure_mode is None:
+            crack, title, note_text = [], '', ''
+        else:
+            pattern, title = registry.get('crack_patterns').for_failure_mode(failure_mode)
+            crack = pattern.polylines(origin=(0, 0), width=width, height=height)
+            self.crack.set_color(pattern.color)
+            self.crack.set_linewidth(pattern.linewidth or rcParams['lines.linewidth'])
+            note_text = note
+        self.crack.set_segments(crack)
+        self.title.set_text(title)
+        self.note.set_text(note_text)
+        return True
+
+    def draw(self):
+        if not self.blit:
+            self.canvas.draw()
+            return
+        if self._background is None:
+            self.canvas.draw()
+            return
+        self.canvas.restore_region(self._background)
+        self._draw_artists()
+        self.canvas.blit(self.figure.bbox)
+
+    def _on_draw(self, event):
+        self._background = self.canvas.copy_from_bbox(self.figure.bbox)
+        self._draw_artists()
+
+    def _draw_artists(self):
+        # new y limits resize the axes box (equal aspect), which a full draw would do in Axes.draw
+        self.axes.apply_aspect()
+        for artist in self.artists:
+            self.figure.draw_artist(artist)
+
+    def disconnect(self):
+        if self.blit:
+            self.canvas.mpl_disconnect(self._draw_event)